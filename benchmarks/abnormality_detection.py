@@ -0,0 +1,56 @@
+"""
+Benchmark of batched multi-patient abnormality detection.
+
+Generates a long-format frame of synthetic readings and reports how many readings per
+second detect_abnormalities_batch processes.
+
+Example:
+    python benchmarks/abnormality_detection.py --patients 10000 --readings 5000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from func.health_monitoring_system import detect_abnormalities_batch  # noqa: E402
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark batched abnormality detection")
+    parser.add_argument("--patients", type=int, default=10000, help="number of simulated patients")
+    parser.add_argument("--readings", type=int, default=2000000, help="total readings across patients")
+    parser.add_argument("--repeat", type=int, default=5, help="runs to take the best time of")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+
+def synthetic_readings(patients, readings, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "patient_id": rng.integers(0, patients, readings),
+        "heart_rate": rng.normal(78, 8, readings),
+        "blood_pressure": rng.normal(118, 9, readings),
+        "temperature": rng.normal(98.4, 0.5, readings),
+    })
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    readings = synthetic_readings(args.patients, args.readings, args.seed)
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        abnormalities = detect_abnormalities_batch(readings)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    print(f"{args.readings} readings, {args.patients} patients: {best * 1000:.1f} ms, "
+          f"{args.readings / best / 1e6:.1f}M readings/s, {len(abnormalities)} abnormalities")
+
+
+if __name__ == "__main__":
+    main()
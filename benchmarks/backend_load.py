@@ -0,0 +1,299 @@
+"""
+Load test and benchmark harness for the HealthGuard backend.
+
+Drives the /health API with a synthetic fleet of devices and reports throughput and
+latency percentiles per operation. Every patient gets a reading before the timed run, so
+any non-2xx response or timeout counts as an error and fails the run.
+
+Passing runs are appended to a JSON lines file. Each run is compared against the most
+recent pinned run with the same parameters, or failing that the most recent passing one,
+so regressions in the ingest and query paths fail the run and are never recorded as the
+new baseline.
+
+Examples:
+    # In-process against a temporary SQLite file
+    python benchmarks/backend_load.py --patients 500 --duration 10
+
+    # Against a local Postgres stand-in
+    python benchmarks/backend_load.py --database-url postgresql://localhost/healthguard_bench
+
+    # Against an already running server
+    python benchmarks/backend_load.py --url http://localhost:5000
+
+    # Record this run as the baseline later runs are compared against
+    python benchmarks/backend_load.py --pin-baseline
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "backend")
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+OPERATIONS = ("write", "batch_write", "read_latest", "read_history")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the HealthGuard backend")
+    parser.add_argument("--patients", type=int, default=100, help="number of simulated patients")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent simulated gateways")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="target requests per second across all workers (0 = as fast as possible)")
+    parser.add_argument("--read-ratio", type=float, default=0.5, help="fraction of requests that are reads")
+    parser.add_argument("--batch-ratio", type=float, default=0.1, help="fraction of writes sent as batches")
+    parser.add_argument("--batch-size", type=int, default=500, help="readings per batch write")
+    parser.add_argument("--database-url", help="database for in-process runs (default: temporary SQLite file)")
+    parser.add_argument("--url", help="benchmark a running server instead of an in-process app")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="JSON lines file to append results to")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="fail when throughput drops or p95 latency grows by more than this fraction")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before an HTTP request counts as failed")
+    parser.add_argument("--pin-baseline", action="store_true",
+                        help="record this run as the baseline for its parameters, even if it regressed")
+    return parser.parse_args(argv)
+
+
+class InProcessClient:
+    """
+    Sends requests to the Flask app through its test client, without a network hop.
+    """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, payload=None):
+        response = self.client.open(path, method=method, json=payload)
+        return response.status_code
+
+
+class HttpClient:
+    """
+    Sends requests to a running server over HTTP; failed connections and timeouts are
+    reported with a None status.
+    """
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, method, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except (urllib.error.URLError, socket.timeout, ConnectionError):
+            return None
+
+
+def make_client_factory(args):
+    if args.url:
+        return lambda: HttpClient(args.url, args.timeout)
+
+    # The backend reads its configuration at import time
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["HEALTHGUARD_DATABASE_URL"] = database_url
+    sys.path.insert(0, BACKEND_DIR)
+    from app import app
+    from database import init_db
+
+    init_db()
+    return lambda: InProcessClient(app)
+
+
+def synthetic_reading(rng, patient_id):
+    # Diastolic stays below systolic, so every reading passes validation
+    systolic = rng.randint(90, 160)
+    return {
+        "patient_id": patient_id,
+        "heart_rate": rng.randint(50, 130),
+        "blood_pressure": f"{systolic}/{rng.randint(60, min(100, systolic - 10))}",
+        "temperature": round(rng.uniform(35.5, 40.0), 1),
+    }
+
+
+def seed_patients(args, client):
+    """
+    Give every simulated patient a reading, so reads of their latest reading never 404.
+    """
+    rng = random.Random(args.seed)
+    readings = [synthetic_reading(rng, f"patient-{i}") for i in range(args.patients)]
+    for start in range(0, len(readings), args.batch_size):
+        status = client.request("POST", "/health/batch", readings[start:start + args.batch_size])
+        if status is None or not 200 <= status < 300:
+            raise RuntimeError(f"Seeding patients failed with status {status}")
+
+
+def is_error(status):
+    return status is None or not 200 <= status < 300
+
+
+def run_worker(args, client, seed, deadline, interval, samples):
+    rng = random.Random(seed)
+    patients = [f"patient-{i}" for i in range(args.patients)]
+    next_request = time.perf_counter()
+    while True:
+        # Pace requests when a target rate is set
+        if interval:
+            delay = next_request - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_request += interval
+        if time.perf_counter() >= deadline:
+            return
+
+        patient_id = rng.choice(patients)
+        if rng.random() < args.read_ratio:
+            if rng.random() < 0.5:
+                operation, method, path, payload = "read_latest", "GET", f"/health?patient_id={patient_id}", None
+            else:
+                operation, method, path, payload = ("read_history", "GET",
+                                                    f"/health/history?patient_id={patient_id}&limit=100", None)
+        elif rng.random() < args.batch_ratio:
+            operation, method, path = "batch_write", "POST", "/health/batch"
+            payload = [synthetic_reading(rng, patient_id) for _ in range(args.batch_size)]
+        else:
+            operation, method, path, payload = "write", "POST", "/health", synthetic_reading(rng, patient_id)
+
+        start = time.perf_counter()
+        status = client.request(method, path, payload)
+        samples[operation].append((time.perf_counter() - start, status))
+
+
+def summarize(samples, elapsed, batch_size):
+    summary = {}
+    for operation, results in samples.items():
+        if not results:
+            continue
+        latencies = sorted(latency for latency, status in results)
+        if len(latencies) > 1:
+            quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        else:
+            quantiles = latencies * 99
+        summary[operation] = {
+            "requests": len(results),
+            "errors": sum(1 for latency, status in results if is_error(status)),
+            "timeouts": sum(1 for latency, status in results if status is None),
+            "requests_per_second": len(results) / elapsed,
+            "latency_ms": {
+                "p50": quantiles[49] * 1000,
+                "p95": quantiles[94] * 1000,
+                "p99": quantiles[98] * 1000,
+                "max": latencies[-1] * 1000,
+            },
+        }
+    if "batch_write" in summary:
+        summary["batch_write"]["readings_per_second"] = summary["batch_write"]["requests_per_second"] * batch_size
+    return summary
+
+
+def find_baseline(results_path, parameters):
+    """
+    Return the most recent pinned run with the same parameters, or the most recent
+    recorded one if none is pinned.
+    """
+    if not os.path.exists(results_path):
+        return None
+    latest = pinned = None
+    with open(results_path) as f:
+        for line in f:
+            run = json.loads(line)
+            if run["parameters"] == parameters:
+                latest = run
+                if run.get("pinned"):
+                    pinned = run
+    return pinned or latest
+
+
+def find_errors(summary):
+    return [f"{operation}: {current['errors']} failed requests ({current['timeouts']} timeouts)"
+            for operation, current in summary.items() if current["errors"]]
+
+
+def find_regressions(summary, baseline, max_regression):
+    regressions = []
+    for operation, current in summary.items():
+        previous = baseline["summary"].get(operation)
+        if previous is None:
+            continue
+        if current["requests_per_second"] < previous["requests_per_second"] * (1 - max_regression):
+            regressions.append(f"{operation}: throughput {previous['requests_per_second']:.1f} -> "
+                               f"{current['requests_per_second']:.1f} req/s")
+        if current["latency_ms"]["p95"] > previous["latency_ms"]["p95"] * (1 + max_regression):
+            regressions.append(f"{operation}: p95 latency {previous['latency_ms']['p95']:.2f} -> "
+                               f"{current['latency_ms']['p95']:.2f} ms")
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    client_factory = make_client_factory(args)
+    seed_patients(args, client_factory())
+
+    samples = {operation: [] for operation in OPERATIONS}
+    worker_samples = [{operation: [] for operation in OPERATIONS} for _ in range(args.workers)]
+    interval = args.workers / args.rate if args.rate else 0
+    start = time.perf_counter()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=run_worker,
+                                args=(args, client_factory(), args.seed + i, deadline, interval, worker_samples[i]))
+               for i in range(args.workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for worker in worker_samples:
+        for operation, results in worker.items():
+            samples[operation].extend(results)
+
+    parameters = {
+        "patients": args.patients,
+        "workers": args.workers,
+        "rate": args.rate,
+        "read_ratio": args.read_ratio,
+        "batch_ratio": args.batch_ratio,
+        "batch_size": args.batch_size,
+        "database": args.url or (args.database_url or "sqlite").split("://")[0],
+    }
+    summary = summarize(samples, elapsed, args.batch_size)
+    print(json.dumps(summary, indent=2))
+
+    baseline = find_baseline(args.results, parameters)
+    regressions = find_regressions(summary, baseline, args.max_regression) if baseline else []
+    errors = find_errors(summary)
+
+    # Failing runs are not recorded, so a regression never becomes the next run's baseline
+    if args.pin_baseline or not (regressions or errors):
+        run = {"timestamp": datetime.utcnow().isoformat(), "parameters": parameters,
+               "duration": elapsed, "summary": summary}
+        if args.pin_baseline:
+            run["pinned"] = True
+        with open(args.results, "a") as f:
+            f.write(json.dumps(run) + "\n")
+
+    for error in errors:
+        print("ERRORS:", error)
+    for regression in regressions:
+        print("REGRESSION:", regression)
+    return 1 if regressions or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,18 @@
 import numpy as np
 import pandas as pd
+from scipy import stats
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
 from ai.models import HealthMonitoringModel
+from ai.models.registry import model_registry
 
-def analyze_biometric_data(data):
+def analyze_biometric_data(data, registry=model_registry):
     """
     Analyze the given biometric data using advanced algorithms.
 
     Args:
     - data (pandas.DataFrame): A DataFrame containing the biometric data.
+    - registry (ModelRegistry): The registry holding the current health-status model.
 
     Returns:
     - analysis_results (dict): A dictionary containing the results of the analysis.
@@ -18,10 +22,15 @@ def analyze_biometric_data(data):
     # Perform some basic data cleaning and preprocessing
     data = clean_biometric_data(data)
 
-    # Train a machine learning model to predict health status based on biometric data
-    model = HealthMonitoringModel()
-    X_train, y_train = prepare_data_for_training(data)
-    model.train_model(X_train, y_train)
+    # Use the current registered model to predict health status. Without one, train a model
+    # on this data for this call only: it is not registered, since it never went through
+    # the evaluation a served version needs.
+    try:
+        model = HealthMonitoringModel.from_registry(registry)
+    except LookupError:
+        model = HealthMonitoringModel()
+        X_train, y_train = prepare_data_for_training(data)
+        model.train_model(X_train, y_train)
 
     # Use the trained model to predict the health status of each refugee
     X_test = prepare_data_for_prediction(data)
@@ -96,7 +105,7 @@ def analyze_heart_rate_trend(data):
     if slope > 0:
         trend = "Increasing"
     elif slope < 0:
-trend = "Decreasing"
+        trend = "Decreasing"
     else:
         trend = "Stable"
     return trend
@@ -1,27 +1,251 @@
+import logging
+import queue
+import threading
 import time
+from collections import Counter
+
 import numpy as np
 import pandas as pd
-from func.biometric_analysis import analyze_biometric_data
 
-def monitor_vital_signs(sensor_data):
+from func.vital_rules import VITAL_RULES, VITALS, population_codes, reading_population, reading_values, vital_values
+
+logger = logging.getLogger(__name__)
+
+class PatientState:
+    """
+    What the monitor remembers about a patient between readings.
+    """
+
+    __slots__ = ("readings", "last_seen", "counts", "means", "latest", "abnormal")
+
+    def __init__(self):
+        self.readings = 0
+        self.last_seen = None
+        self.counts = dict.fromkeys(VITALS, 0)
+        self.means = dict.fromkeys(VITALS, 0.0)
+        self.latest = {}
+        self.abnormal = {}
+
+
+class StreamingVitalsMonitor:
     """
-    Monitor the vital signs of a patient in real-time using the given sensor data.
+    Event-driven monitoring of vital signs for many patients at once.
+
+    Each reading updates its patient's state in constant time and is checked against the
+    vital rules as soon as it is consumed. An alert is raised when a vital starts breaking
+    a rule, when it moves to another rule (e.g. from a warning to a critical tier) and,
+    with status "Normal", when it returns to range, rather than on every reading. Errors
+    raised by on_alert are logged and counted, and do not stop the monitor.
 
     Args:
-    - sensor_data (dict): A dictionary containing the latest sensor data for the patient.
+    - on_alert: Called with each alert dictionary.
+    - rules (RuleSet): The vital rules to evaluate.
+    """
+
+    def __init__(self, on_alert=print, rules=VITAL_RULES):
+        self.on_alert = on_alert
+        self.rules = rules
+        self.patients = {}
+        self.counts = Counter()
+
+    def process(self, reading):
+        """
+        Update the patient's state with a reading and raise any alerts it causes.
+
+        Args:
+        - reading (dict): A reading with patient_id and any of the monitored vitals, and
+          optionally the patient's age and pregnancy status.
+
+        Returns:
+        - alerts (list): The alerts raised for the reading.
+        """
+        return self.update(reading, *self.parse(reading))
+
+    @staticmethod
+    def parse(reading):
+        """
+        Extract a reading's patient_id, vital values and population code, raising KeyError,
+        TypeError or AttributeError for a malformed reading.
+        """
+        patient_id = reading["patient_id"]
+        hash(patient_id)
+        return patient_id, reading_values(reading), reading_population(reading)
+
+    def update(self, reading, patient_id, values, population):
+        started = time.perf_counter()
+        state = self.patients.get(patient_id)
+        if state is None:
+            state = self.patients[patient_id] = PatientState()
+        state.readings += 1
+        state.last_seen = time.monotonic()
+        self.counts["readings"] += 1
+
+        fired = self.rules.evaluate_values(values, population)
+        alerts = []
+        for vital, value in values.items():
+            # Running mean over the patient's readings, updated without keeping them
+            state.counts[vital] += 1
+            state.means[vital] += (value - state.means[vital]) / state.counts[vital]
+            state.latest[vital] = value
+            rule = fired.get(vital)
+            previous = state.abnormal.get(vital)
+            if (rule["name"] if rule else None) == previous:
+                continue
+            if rule is None:
+                del state.abnormal[vital]
+            else:
+                state.abnormal[vital] = rule["name"]
+            units, label = VITALS[vital]
+            alerts.append({
+                "patient_id": patient_id,
+                "type": label,
+                "value": value,
+                "units": units,
+                "status": "Abnormal" if rule else "Normal",
+                "rule": rule["name"] if rule else previous,
+                "severity": rule["severity"] if rule else None,
+                "timestamp": reading.get("timestamp"),
+                "latency_ms": (time.perf_counter() - started) * 1000,
+            })
+        for alert in alerts:
+            self.counts["alerts"] += 1
+            try:
+                self.on_alert(alert)
+            except Exception:
+                self.counts["alert_errors"] += 1
+                logger.exception("Alert callback failed for patient %s", patient_id)
+        return alerts
+
+    def consume(self, readings):
+        """
+        Process readings as they arrive until the source is exhausted.
+
+        Args:
+        - readings: An iterable of readings, e.g. a generator over a sensor feed, or a
+          queue.Queue, which is consumed until it yields None. Malformed readings are
+          counted as rejected and skipped.
+        """
+        if isinstance(readings, (dict, pd.DataFrame)):
+            # Iterating these would yield their keys, each rejected as a reading
+            raise TypeError(f"Expected an iterable of readings, got {type(readings).__name__}; "
+                            "wrap a single reading in a list or pass a DataFrame as to_dict('records')")
+        if isinstance(readings, queue.Queue):
+            readings = iter(readings.get, None)
+        for reading in readings:
+            try:
+                parsed = self.parse(reading)
+            except (KeyError, TypeError, AttributeError):
+                self.counts["rejected"] += 1
+                continue
+            self.update(reading, *parsed)
+
+    def evict_idle(self, max_idle_seconds):
+        """
+        Forget patients with no reading for a while, to bound memory on long runs.
+
+        Returns:
+        - evicted (int): The number of patients forgotten.
+        """
+        cutoff = time.monotonic() - max_idle_seconds
+        idle = [patient_id for patient_id, state in self.patients.items() if state.last_seen < cutoff]
+        for patient_id in idle:
+            del self.patients[patient_id]
+        return len(idle)
+
+    def stats(self):
+        return {"patients": len(self.patients), **self.counts}
+
+
+def monitor_vital_signs(sensor_data, on_alert=print):
+    """
+    Monitor the vital signs of patients in real-time as sensor readings arrive.
+
+    Args:
+    - sensor_data: An iterable or queue.Queue of reading dictionaries, each with a
+      patient_id and the latest sensor values.
+    - on_alert: Called with each alert raised.
+
+    Returns:
+    - monitor (StreamingVitalsMonitor): The monitor, once the sensor data is exhausted.
+    """
+    monitor = StreamingVitalsMonitor(on_alert)
+    monitor.consume(sensor_data)
+    return monitor
+
+
+def start_vitals_monitor(sensor_queue, on_alert=print):
+    """
+    Monitor a queue of readings on a background thread; put None on the queue to stop it.
 
     Returns:
-    - None
+    - monitor (StreamingVitalsMonitor), thread (threading.Thread)
     """
-    # Continuously monitor the sensor data and perform analysis every 60 seconds
-    while True:
-        time.sleep(60)
-        biometric_data = pd.DataFrame(sensor_data)
-        analysis_results = analyze_biometric_data(biometric_data)
-        print(analysis_results)
+    monitor = StreamingVitalsMonitor(on_alert)
+    thread = threading.Thread(target=monitor.consume, args=(sensor_queue,), name="healthguard-vitals", daemon=True)
+    thread.start()
+    return monitor, thread
+
+def detect_abnormalities_batch(readings, rules=VITAL_RULES, thresholds=None):
+    """
+    Detect abnormalities for many patients at once.
+
+    The readings are grouped by patient with one sort, after which the minimum, maximum
+    and mean of every vital are reduced over all groups at once.
+
+    Args:
+    - readings (pandas.DataFrame): Readings of any number of patients, one per row, with
+      a patient_id column, a column per vital and optionally age and pregnant columns.
+    - rules (RuleSet): The vital rules; a patient's normal range for a vital lies between
+      the least extreme thresholds of its population's rules.
+    - thresholds (pandas.DataFrame): Optional per-patient ranges overriding the rules,
+      indexed by patient_id with <vital>_low and <vital>_high columns; missing entries
+      fall back to the rules.
+
+    Returns:
+    - abnormalities (pandas.DataFrame): One row per abnormal (patient, vital), with the
+      patient_id, type, value (the mean), units, status, min and max.
+    """
+    columns = ["patient_id", "type", "value", "units", "status", "min", "max"]
+    if readings.empty:
+        return pd.DataFrame(columns=columns)
+    codes, patients = pd.factorize(readings["patient_id"], sort=True)
+    order = np.argsort(codes, kind="stable")
+    starts = np.flatnonzero(np.diff(codes[order], prepend=-1))
+    # Each patient's population is taken from their first reading
+    ranges = rules.normal_ranges(population_codes(readings)[order][starts])
+
+    tables = []
+    for vital, (units, label) in VITALS.items():
+        if vital not in readings:
+            continue
+        values = vital_values(readings[vital], vital)[order]
+        present = ~np.isnan(values)
+        count = np.add.reduceat(present, starts)
+        total = np.add.reduceat(np.where(present, values, 0.0), starts)
+        minimum = np.fmin.reduceat(values, starts)
+        maximum = np.fmax.reduceat(values, starts)
+
+        lows, highs = (bounds.copy() for bounds in ranges[vital])
+        if thresholds is not None:
+            for bounds, suffix in ((lows, "low"), (highs, "high")):
+                if f"{vital}_{suffix}" in thresholds:
+                    override = thresholds[f"{vital}_{suffix}"].reindex(patients).to_numpy(np.float64)
+                    np.copyto(bounds, override, where=~np.isnan(override))
+
+        abnormal = np.flatnonzero((count > 0) & ((minimum < lows) | (maximum > highs)))
+        tables.append(pd.DataFrame({
+            "patient_id": patients[abnormal],
+            "type": label,
+            "value": total[abnormal] / count[abnormal],
+            "units": units,
+            "status": "Abnormal",
+            "min": minimum[abnormal],
+            "max": maximum[abnormal],
+        }))
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(tables, ignore_index=True).sort_values("patient_id", kind="stable", ignore_index=True)
 
-        # Perform additional real-time analysis and alerting based on the analysis results
-        # ...
 
 def detect_abnormalities(biometric_data):
     """
@@ -33,39 +257,5 @@ def detect_abnormalities(biometric_data):
     Returns:
     - abnormalities (list): A list of dictionaries containing information about any detected abnormalities.
     """
-    abnormalities = []
-
-    # Analyze the heart rate data for abnormalities
-    heart_rate_data = biometric_data["heart_rate"]
-    if np.min(heart_rate_data) < 60 or np.max(heart_rate_data) > 100:
-        abnormality = {
-            "type": "Heart Rate",
-            "value": np.mean(heart_rate_data),
-            "units": "bpm",
-            "status": "Abnormal"
-        }
-        abnormalities.append(abnormality)
-
-    # Analyze the blood pressure data for abnormalities
-    blood_pressure_data = biometric_data["blood_pressure"]
-    if np.min(blood_pressure_data) < 90 or np.max(blood_pressure_data) > 140:
-        abnormality = {
-            "type": "Blood Pressure",
-            "value": np.mean(blood_pressure_data),
-            "units": "mmHg",
-            "status": "Abnormal"
-        }
-        abnormalities.append(abnormality)
-
-    # Analyze the temperature data for abnormalities
-    temperature_data = biometric_data["temperature"]
-    if np.min(temperature_data) < 96.8 or np.max(temperature_data) > 100.4:
-        abnormality = {
-            "type": "Temperature",
-            "value": np.mean(temperature_data),
-            "units": "F",
-            "status": "Abnormal"
-        }
-        abnormalities.append(abnormality)
-
-    return abnormalities
+    table = detect_abnormalities_batch(biometric_data.assign(patient_id=0))
+    return table[["type", "value", "units", "status"]].to_dict("records")
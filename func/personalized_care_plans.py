@@ -1,6 +1,8 @@
 import pickle
 from datetime import datetime, timedelta
 
+from func.vital_rules import VITAL_RULES
+
 def load_treatment_models():
     """
     Load the pre-trained treatment models from disk.
@@ -12,6 +14,20 @@ def load_treatment_models():
         treatment_models = pickle.load(f)
     return treatment_models
 
+def elevated_vitals(health_data):
+    """
+    Determine which of a patient's vitals are above their normal range.
+
+    Args:
+    - health_data (dict): A dictionary containing the health data for the patient.
+
+    Returns:
+    - elevated (list): The elevated vitals, in the order care plans list them.
+    """
+    fired = VITAL_RULES.evaluate_one(health_data)
+    return [vital for vital in ("heart_rate", "blood_pressure", "temperature")
+            if vital in fired and fired[vital]["direction"] == "above"]
+
 def generate_medication_schedule(health_data):
     """
     Generate a medication schedule for a patient based on their health data.
@@ -27,29 +43,9 @@ def generate_medication_schedule(health_data):
     medication_schedule = []
 
     # Determine the appropriate medications for the patient based on their health data
-    if health_data["heart_rate"] > 100:
-        medication = treatment_models["heart_rate"]["medication"]
-        dosage = treatment_models["heart_rate"]["dosage"]
-        medication_schedule.append({
-            "medication": medication,
-            "dosage": dosage,
-            "start_time": datetime.now(),
-            "end_time": datetime.now() + timedelta(hours=1)
-        })
-
-    if health_data["blood_pressure"] > 140:
-        medication = treatment_models["blood_pressure"]["medication"]
-        dosage = treatment_models["blood_pressure"]["dosage"]
-        medication_schedule.append({
-            "medication": medication,
-            "dosage": dosage,
-            "start_time": datetime.now(),
-            "end_time": datetime.now() + timedelta(hours=1)
-        })
-
-    if health_data["temperature"] > 100.4:
-        medication = treatment_models["temperature"]["medication"]
-        dosage = treatment_models["temperature"]["dosage"]
+    for vital in elevated_vitals(health_data):
+        medication = treatment_models[vital]["medication"]
+        dosage = treatment_models[vital]["dosage"]
         medication_schedule.append({
             "medication": medication,
             "dosage": dosage,
@@ -74,29 +70,9 @@ def generate_treatment_plan(health_data):
     treatment_plan = []
 
     # Determine the appropriate treatments for the patient based on their health data
-    if health_data["heart_rate"] > 100:
-        treatment = treatment_models["heart_rate"]["treatment"]
-        duration = treatment_models["heart_rate"]["duration"]
-        treatment_plan.append({
-            "treatment": treatment,
-            "duration": duration,
-            "start_time": datetime.now(),
-            "end_time": datetime.now() + timedelta(hours=1)
-        })
-
-    if health_data["blood_pressure"] > 140:
-        treatment = treatment_models["blood_pressure"]["treatment"]
-        duration = treatment_models["blood_pressure"]["duration"]
-        treatment_plan.append({
-            "treatment": treatment,
-            "duration": duration,
-            "start_time": datetime.now(),
-            "end_time": datetime.now() + timedelta(hours=1)
-        })
-
-    if health_data["temperature"] > 100.4:
-        treatment = treatment_models["temperature"]["treatment"]
-        duration = treatment_models["temperature"]["duration"]
+    for vital in elevated_vitals(health_data):
+        treatment = treatment_models[vital]["treatment"]
+        duration = treatment_models[vital]["duration"]
         treatment_plan.append({
             "treatment": treatment,
             "duration": duration,
@@ -121,22 +97,8 @@ def generate_lifestyle_recommendations(health_data):
     lifestyle_recommendations = []
 
     # Determine the appropriate lifestyle recommendations for the patient based on their health data
-    if health_data["heart_rate"] > 100:
-        recommendation = treatment_models["heart_rate"]["recommendation"]
-        lifestyle_recommendations.append({
-            "recommendation": recommendation,
-            "importance": "high"
-        })
-
-    if health_data["blood_pressure"] > 140:
-        recommendation = treatment_models["blood_pressure"]["recommendation"]
-        lifestyle_recommendations.append({
-            "recommendation": recommendation,
-            "importance": "high"
-        })
-
-    if health_data["temperature"] > 100.4:
-        recommendation = treatment_models["temperature"]["recommendation"]
+    for vital in elevated_vitals(health_data):
+        recommendation = treatment_models[vital]["recommendation"]
         lifestyle_recommendations.append({
             "recommendation": recommendation,
             "importance": "high"
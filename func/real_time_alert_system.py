@@ -7,6 +7,8 @@ from email.mime.text import MIMEText
 
 import schedule
 
+from func.vital_rules import VITAL_RULES
+
 
 def send_email_alert(subject, message, recipients):
     """Send an email alert to the provided recipients."""
@@ -40,11 +42,10 @@ def check_health_issues():
     # For example, you can use the remote_sensor_integration module to fetch data from remote sensors
     # and analyze the data to detect any urgent health issues or emergencies
 
-    # In this example, we'll simulate a health issue by checking if the simulated patient's heart rate is too high
+    # In this example, we'll simulate a health issue by checking the simulated patient's heart rate
+    # against the shared vital rules
     simulated_heart_rate = 120
-    if simulated_heart_rate > 100:
-        return True
-    return False
+    return bool(VITAL_RULES.evaluate_one({"heart_rate": simulated_heart_rate}))
 
 
 def execute_real_time_alert_system():
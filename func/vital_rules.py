@@ -0,0 +1,282 @@
+import json
+import os
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+# Units and display label of each vital the rules can refer to (temperature in degrees Fahrenheit)
+VITALS = {
+    "heart_rate": ("bpm", "Heart Rate"),
+    "blood_pressure": ("mmHg", "Blood Pressure"),
+    "temperature": ("F", "Temperature"),
+}
+
+# Patient populations with their own ranges; readings with no age or pregnancy status are adult
+POPULATIONS = ("adult", "pregnant", "child", "infant")
+
+# Upper age, in years, of the pediatric populations
+INFANT_MAX_AGE = 1
+CHILD_MAX_AGE = 13
+
+# Temperatures below this are taken to be in degrees Celsius, as on ingest in the backend
+FAHRENHEIT_THRESHOLD = 50
+
+# Optional JSON file replacing DEFAULT_RULES
+VITAL_RULES_PATH = os.environ.get("HEALTHGUARD_VITAL_RULES")
+
+# A reading is abnormal when a vital is above or below a rule's threshold for its population.
+# Rules on the same vital and direction are tiers: only the most extreme one crossed fires.
+DEFAULT_RULES = [
+    {"name": "heart_rate_low", "vital": "heart_rate", "below": 60, "populations": ["adult", "pregnant"]},
+    {"name": "heart_rate_high", "vital": "heart_rate", "above": 100, "populations": ["adult"]},
+    {"name": "heart_rate_high_pregnant", "vital": "heart_rate", "above": 110, "populations": ["pregnant"]},
+    {"name": "heart_rate_very_high", "vital": "heart_rate", "above": 150, "populations": ["adult", "pregnant"],
+     "severity": "critical"},
+    {"name": "heart_rate_low_child", "vital": "heart_rate", "below": 70, "populations": ["child"]},
+    {"name": "heart_rate_high_child", "vital": "heart_rate", "above": 120, "populations": ["child"]},
+    {"name": "heart_rate_low_infant", "vital": "heart_rate", "below": 100, "populations": ["infant"]},
+    {"name": "heart_rate_high_infant", "vital": "heart_rate", "above": 160, "populations": ["infant"]},
+    {"name": "blood_pressure_low", "vital": "blood_pressure", "below": 90, "populations": ["adult", "pregnant"]},
+    {"name": "blood_pressure_high", "vital": "blood_pressure", "above": 140, "populations": ["adult", "pregnant"]},
+    {"name": "blood_pressure_very_high_pregnant", "vital": "blood_pressure", "above": 160,
+     "populations": ["pregnant"], "severity": "critical"},
+    {"name": "blood_pressure_very_high", "vital": "blood_pressure", "above": 180, "populations": ["adult"],
+     "severity": "critical"},
+    {"name": "blood_pressure_low_child", "vital": "blood_pressure", "below": 80, "populations": ["child"]},
+    {"name": "blood_pressure_high_child", "vital": "blood_pressure", "above": 120, "populations": ["child"]},
+    {"name": "blood_pressure_low_infant", "vital": "blood_pressure", "below": 70, "populations": ["infant"]},
+    {"name": "blood_pressure_high_infant", "vital": "blood_pressure", "above": 100, "populations": ["infant"]},
+    {"name": "temperature_low", "vital": "temperature", "below": 96.8},
+    {"name": "temperature_high", "vital": "temperature", "above": 100.4},
+    {"name": "temperature_very_high", "vital": "temperature", "above": 103, "severity": "critical"},
+]
+
+
+def to_fahrenheit(values):
+    return np.where(values < FAHRENHEIT_THRESHOLD, values * 9 / 5 + 32, values)
+
+
+def vital_values(column, vital=None):
+    """
+    Convert a vital column to a float array, monitoring "120/80" blood pressures by their
+    systolic value and Celsius temperatures in Fahrenheit.
+    """
+    # pandas 3 infers a str dtype for strings, older versions object
+    if pd.api.types.is_string_dtype(column) or column.dtype == object:
+        column = column.astype(str).str.partition("/")[0]
+    values = pd.to_numeric(column, errors="coerce").to_numpy(np.float64)
+    return to_fahrenheit(values) if vital == "temperature" else values
+
+
+def reading_values(reading):
+    """
+    Extract the vitals of a reading as floats, skipping missing or malformed ones.
+    """
+    values = {}
+    for vital in VITALS:
+        value = reading.get(vital)
+        if isinstance(value, str):
+            value = value.partition("/")[0]
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if value != value:
+            continue
+        if vital == "temperature" and value < FAHRENHEIT_THRESHOLD:
+            value = value * 9 / 5 + 32
+        values[vital] = value
+    return values
+
+
+def reading_population(reading):
+    """
+    Return the index in POPULATIONS of the population a reading's patient belongs to.
+    """
+    if reading.get("pregnant"):
+        return POPULATIONS.index("pregnant")
+    try:
+        age = float(reading.get("age"))
+    except (TypeError, ValueError):
+        return POPULATIONS.index("adult")
+    if age < INFANT_MAX_AGE:
+        return POPULATIONS.index("infant")
+    if age < CHILD_MAX_AGE:
+        return POPULATIONS.index("child")
+    return POPULATIONS.index("adult")
+
+
+def population_codes(readings):
+    """
+    Return the index in POPULATIONS of each reading's population, for a frame of readings.
+    """
+    codes = np.full(len(readings), POPULATIONS.index("adult"))
+    if "age" in readings:
+        age = pd.to_numeric(readings["age"], errors="coerce").to_numpy(np.float64)
+        codes[age < CHILD_MAX_AGE] = POPULATIONS.index("child")
+        codes[age < INFANT_MAX_AGE] = POPULATIONS.index("infant")
+    if "pregnant" in readings:
+        codes[readings["pregnant"].fillna(False).astype(bool).to_numpy()] = POPULATIONS.index("pregnant")
+    return codes
+
+
+class RuleSet:
+    """
+    Declarative vital-sign rules compiled into threshold tables.
+
+    For every vital and direction, the thresholds of all rules are laid out as a
+    (population, tier) table, sorted from the least to the most extreme tier. A batch of
+    readings is evaluated by one comparison of each value against its population's row,
+    the number of tiers crossed picking the rule that fires, so the cost depends on the
+    number of vitals and tiers rather than on the number of rules. Single readings are
+    evaluated against the same thresholds with a binary search.
+
+    Args:
+    - rules (list): Rule dictionaries with a name, a vital, an "above" or "below"
+      threshold, optional populations (default: all) and an optional severity
+      (default: "warning").
+    """
+
+    def __init__(self, rules):
+        self.rules = []
+        tiers = {}
+        for rule in rules:
+            if rule.get("vital") not in VITALS:
+                raise ValueError(f"Rule {rule.get('name')!r} has unknown vital {rule.get('vital')!r}")
+            directions = [direction for direction in ("above", "below") if direction in rule]
+            if len(directions) != 1:
+                raise ValueError(f"Rule {rule.get('name')!r} needs exactly one of 'above' or 'below'")
+            populations = rule.get("populations", POPULATIONS)
+            unknown = set(populations) - set(POPULATIONS)
+            if unknown:
+                raise ValueError(f"Rule {rule.get('name')!r} has unknown populations {sorted(unknown)}")
+            units, label = VITALS[rule["vital"]]
+            compiled = dict(rule, direction=directions[0], threshold=float(rule[directions[0]]),
+                            severity=rule.get("severity", "warning"), units=units, label=label,
+                            populations=list(populations))
+            self.rules.append(compiled)
+            for population in populations:
+                tiers.setdefault((rule["vital"], compiled["direction"], POPULATIONS.index(population)), []).append(
+                    (compiled["threshold"], len(self.rules) - 1))
+
+        names = [rule["name"] for rule in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("Rule names must be unique")
+
+        # Rule attributes as categories with a code per rule, to label a batch's fired rules
+        self.columns = {}
+        for column, key in (("rule", "name"), ("vital", "vital"), ("severity", "severity"), ("units", "units"),
+                            ("label", "label")):
+            categories, codes = np.unique([rule[key] for rule in self.rules], return_inverse=True)
+            self.columns[column] = (categories, codes)
+
+        # Batch tables, padded with thresholds nothing crosses
+        self.tables = {}
+        for vital in VITALS:
+            for direction, padding in (("above", np.inf), ("below", -np.inf)):
+                rows = [sorted(tiers.get((vital, direction, code), []), reverse=direction == "below")
+                        for code in range(len(POPULATIONS))]
+                width = max(len(row) for row in rows)
+                if width == 0:
+                    continue
+                bounds = np.full((len(POPULATIONS), width), padding)
+                ids = np.full((len(POPULATIONS), width), -1)
+                for code, row in enumerate(rows):
+                    bounds[code, :len(row)] = [threshold for threshold, _ in row]
+                    ids[code, :len(row)] = [rule_id for _, rule_id in row]
+                self.tables[vital, direction] = (bounds, ids)
+
+        # Single-reading tiers, as ascending keys for bisect; "below" thresholds are negated
+        self.tiers = {}
+        for (vital, direction, code), row in tiers.items():
+            sign = 1 if direction == "above" else -1
+            row = sorted((sign * threshold, rule_id) for threshold, rule_id in row)
+            self.tiers.setdefault((code, vital), []).append(
+                (sign, [key for key, _ in row], [rule_id for _, rule_id in row]))
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def evaluate_one(self, reading):
+        """
+        Evaluate the rules for a single reading.
+
+        Args:
+        - reading (dict): A reading with any of the vitals, and optionally age and pregnant.
+
+        Returns:
+        - fired (dict): The most extreme rule fired per abnormal vital, mapped from the vital.
+        """
+        return self.evaluate_values(reading_values(reading), reading_population(reading))
+
+    def evaluate_values(self, values, population):
+        fired = {}
+        for vital, value in values.items():
+            for sign, keys, rule_ids in self.tiers.get((population, vital), ()):
+                # Number of thresholds strictly crossed, least extreme first
+                crossed = bisect_left(keys, sign * value)
+                if crossed:
+                    fired[vital] = self.rules[rule_ids[crossed - 1]]
+        return fired
+
+    def evaluate(self, readings):
+        """
+        Evaluate the rules for a batch of readings.
+
+        Args:
+        - readings (pandas.DataFrame): Readings with a column per vital, and optionally
+          age and pregnant columns.
+
+        Returns:
+        - fired (pandas.DataFrame): One row per rule fired, with the reading's row
+          position, the rule name, vital, value, severity, units and label.
+        """
+        codes = population_codes(readings)
+        rows, rule_ids, values = [], [], []
+        for (vital, direction), (bounds, ids) in self.tables.items():
+            if vital not in readings:
+                continue
+            value = vital_values(readings[vital], vital)
+            row_bounds = bounds[codes]
+            crossed = value[:, np.newaxis] > row_bounds if direction == "above" else value[:, np.newaxis] < row_bounds
+            count = crossed.sum(axis=1)
+            fired = np.flatnonzero(count)
+            rows.append(fired)
+            rule_ids.append(ids[codes[fired], count[fired] - 1])
+            values.append(value[fired])
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+        rule_ids = np.concatenate(rule_ids) if rule_ids else np.empty(0, dtype=np.intp)
+        order = np.argsort(rows, kind="stable")
+        rule_ids = rule_ids[order]
+        return pd.DataFrame({
+            "row": rows[order],
+            **{column: self.category(column, rule_ids) for column in ("rule", "vital")},
+            "value": np.concatenate(values)[order] if values else np.empty(0),
+            **{column: self.category(column, rule_ids) for column in ("severity", "units", "label")},
+        })
+
+    def category(self, column, rule_ids):
+        categories, codes = self.columns[column]
+        return pd.Categorical.from_codes(codes[rule_ids], categories)
+
+    def normal_ranges(self, codes):
+        """
+        Return the (lows, highs) arrays of each vital's normal range for the given
+        population codes: the least extreme threshold in each direction.
+        """
+        ranges = {}
+        for vital in VITALS:
+            lows = np.full(len(codes), -np.inf)
+            highs = np.full(len(codes), np.inf)
+            if (vital, "below") in self.tables:
+                lows = self.tables[vital, "below"][0][codes, 0]
+            if (vital, "above") in self.tables:
+                highs = self.tables[vital, "above"][0][codes, 0]
+            ranges[vital] = (lows, highs)
+        return ranges
+
+
+VITAL_RULES = RuleSet.from_file(VITAL_RULES_PATH) if VITAL_RULES_PATH else RuleSet(DEFAULT_RULES)
@@ -15,7 +15,7 @@ def logistic_regression(**kwargs):
     return LogisticRegression(**kwargs)
 
 def random_forest_classifier(**kwargs):
-"""
+    """
     Create a random forest classifier.
 
     Keyword arguments:
@@ -28,7 +28,7 @@ def random_forest_classifier(**kwargs):
 
 def support_vector_machine(**kwargs):
     """
-Create a support vector machine classifier.
+    Create a support vector machine classifier.
 
     Keyword arguments:
     - **kwargs: Any keyword arguments to pass to the SVC constructor.
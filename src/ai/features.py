@@ -0,0 +1,240 @@
+"""
+Feature store for derived vital-sign features shared by training and inference.
+
+Raw readings are normalized once into numeric vitals (blood pressure split into systolic
+and diastolic), and per-patient rolling means, deltas and trend slopes are computed over
+time windows. Results are cached as Parquet files under
+<root>/v<feature version>/<window>/<patient>/, one file per update, so new readings only
+require computing features for themselves plus the window of history before them. A
+patient's parts are merged into one once there are more than FEATURE_COMPACT_PARTS.
+"""
+import glob
+import os
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+
+# Bump when feature definitions change, so stale cached features are never served
+FEATURE_VERSION = 1
+
+# Root directory of the feature store
+FEATURE_STORE_DIR = os.environ.get("HEALTHGUARD_FEATURE_STORE_DIR", "models/features")
+
+# Rolling windows, as pandas offsets
+FEATURE_WINDOWS = tuple(os.environ.get("HEALTHGUARD_FEATURE_WINDOWS", "1h,6h,24h").split(","))
+
+# Parts per patient and window above which they are merged into one
+FEATURE_COMPACT_PARTS = int(os.environ.get("HEALTHGUARD_FEATURE_COMPACT_PARTS", 32))
+
+# Numeric vitals features are derived from, with blood pressure split in two
+VITALS = ("heart_rate", "systolic", "diastolic", "temperature")
+
+# Derived feature columns, per window
+FEATURE_COLUMNS = tuple(f"{vital}_{kind}" for vital in VITALS for kind in ("mean", "slope", "delta"))
+
+PART_TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S%f"
+
+
+def vital_frame(raw):
+    """
+    Normalize raw readings to one numeric column per vital, sorted by patient and time.
+
+    Args:
+    - raw: A DataFrame with patient_id, timestamp, heart_rate, blood_pressure (as
+      "120/80" strings or systolic numbers) and temperature columns.
+
+    Returns:
+    A DataFrame with patient_id, timestamp and the VITALS columns. Readings without a
+    patient_id are dropped, as they belong to no patient's history.
+    """
+    raw = raw[raw["patient_id"].notna()]
+    blood_pressure = raw["blood_pressure"].astype(str).str.partition("/")
+    frame = pd.DataFrame({
+        "patient_id": raw["patient_id"].astype(str),
+        "timestamp": pd.to_datetime(raw["timestamp"]),
+        "heart_rate": pd.to_numeric(raw["heart_rate"], errors="coerce"),
+        "systolic": pd.to_numeric(blood_pressure[0], errors="coerce"),
+        "diastolic": pd.to_numeric(blood_pressure[2], errors="coerce"),
+        "temperature": pd.to_numeric(raw["temperature"], errors="coerce"),
+    })
+    return frame.sort_values(["patient_id", "timestamp"], kind="stable").reset_index(drop=True)
+
+
+def compute_features(vitals, window):
+    """
+    Compute rolling features over a time window for every reading.
+
+    For each vital v: v_mean is the mean over the window ending at the reading, v_delta the
+    change since the patient's previous reading and v_slope the least-squares trend over
+    the window, per hour.
+
+    Args:
+    - vitals: A frame as returned by vital_frame.
+    - window: A pandas offset such as "1h".
+
+    Returns:
+    The vitals frame with the feature columns added.
+    """
+    vitals = vitals.reset_index(drop=True)
+    # Hours since each patient's first reading here; the slope does not depend on the origin
+    hours = (vitals["timestamp"] - vitals.groupby("patient_id")["timestamp"].transform("min")).dt.total_seconds() / 3600
+
+    # Rolling sums of x, t, t^2 and t*x over the readings where the vital is present give
+    # the mean and the regression slope in one pass
+    sums = {}
+    for vital in VITALS:
+        value = vitals[vital]
+        present = value.notna()
+        t = hours.where(present)
+        sums.update({f"{vital}:n": present.astype(float), f"{vital}:x": value, f"{vital}:t": t,
+                     f"{vital}:tt": t * t, f"{vital}:tx": t * value})
+    sums = pd.DataFrame(sums).assign(patient_id=vitals["patient_id"], timestamp=vitals["timestamp"])
+    rolled = sums.set_index("timestamp").groupby("patient_id", sort=False).rolling(window).sum()
+    # Rows come back grouped by patient in time order, which is the order of vitals
+    rolled = rolled.reset_index(drop=True)
+
+    features = vitals.copy()
+    deltas = vitals.groupby("patient_id", sort=False)[list(VITALS)].diff()
+    for vital in VITALS:
+        n, x, t, tt, tx = (rolled[f"{vital}:{name}"].to_numpy() for name in ("n", "x", "t", "tt", "tx"))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            features[f"{vital}_mean"] = np.where(n > 0, x / n, np.nan)
+            denominator = n * tt - t * t
+            features[f"{vital}_slope"] = np.where((n > 1) & (denominator > 1e-12), (n * tx - t * x) / denominator, np.nan)
+        features[f"{vital}_delta"] = deltas[vital].to_numpy()
+    return features
+
+
+def feature_matrix(features):
+    """
+    Select the derived feature columns for a model, with missing deltas and slopes (e.g. a
+    patient's first reading) treated as no change.
+    """
+    return features[list(FEATURE_COLUMNS)].fillna(0.0)
+
+
+class FeatureStore:
+    """
+    Cached derived features keyed by (patient, window, feature version), updated incrementally.
+    """
+
+    def __init__(self, root=FEATURE_STORE_DIR, windows=FEATURE_WINDOWS, version=FEATURE_VERSION,
+                 compact_parts=FEATURE_COMPACT_PARTS):
+        self.root = root
+        self.windows = tuple(windows)
+        self.version = version
+        self.compact_parts = compact_parts
+
+    def patient_dir(self, patient_id, window):
+        return os.path.join(self.root, f"v{self.version}", window, quote(str(patient_id), safe=""))
+
+    def parts(self, patient_id, window):
+        return sorted(glob.glob(os.path.join(self.patient_dir(patient_id, window), "part-*.parquet")))
+
+    def read_patient(self, patient_id, window, since=None):
+        # Parts are named by their first timestamp, so only the ones reaching past since are
+        # read. The last reading before since is kept too: deltas are taken against it.
+        parts = self.parts(patient_id, window)
+        if since is not None:
+            first = [pd.to_datetime(os.path.basename(part).split("-")[1], format=PART_TIMESTAMP_FORMAT) for part in parts]
+            start = max([i for i, timestamp in enumerate(first) if timestamp <= since], default=0)
+            parts = parts[start:]
+        if not parts:
+            return None
+        frame = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+        if since is None:
+            return frame
+        return frame.iloc[max(frame["timestamp"].searchsorted(since) - 1, 0):].reset_index(drop=True)
+
+    def write_part(self, patient_id, window, features):
+        directory = self.patient_dir(patient_id, window)
+        os.makedirs(directory, exist_ok=True)
+        # The sequence number keeps parts starting at the same timestamp apart, in arrival order
+        sequence = len(self.parts(patient_id, window))
+        name = f"part-{features['timestamp'].iloc[0].strftime(PART_TIMESTAMP_FORMAT)}-{sequence:06d}.parquet"
+        path = os.path.join(directory, name)
+        features.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+    def compact(self, patient_id, window):
+        """
+        Merge a patient's parts for a window into one, replacing the first part in place.
+        """
+        parts = self.parts(patient_id, window)
+        if len(parts) < 2:
+            return
+        merged = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+        merged.to_parquet(parts[0] + ".tmp", index=False)
+        os.replace(parts[0] + ".tmp", parts[0])
+        for part in parts[1:]:
+            os.remove(part)
+
+    def update(self, raw):
+        """
+        Add new readings, computing features for them from the cached history in each window.
+
+        Readings older than a patient's newest cached reading cause that patient's features
+        for the window to be recomputed from scratch.
+
+        Args:
+        - raw: A DataFrame of raw readings, as accepted by vital_frame.
+
+        Returns:
+        The number of readings added.
+        """
+        vitals = vital_frame(raw)
+        for patient_id, new in vitals.groupby("patient_id", sort=False):
+            for window in self.windows:
+                start = new["timestamp"].iloc[0]
+                history = self.read_patient(patient_id, window, start - pd.Timedelta(window))
+                if history is not None and len(history) and history["timestamp"].iloc[-1] > start:
+                    # Late readings: rebuild this patient's features from all cached vitals
+                    history = self.read_patient(patient_id, window)[["patient_id", "timestamp", *VITALS]]
+                    combined = pd.concat([history, new], ignore_index=True).sort_values("timestamp", kind="stable")
+                    for part in self.parts(patient_id, window):
+                        os.remove(part)
+                    self.write_part(patient_id, window, compute_features(combined, window))
+                    continue
+                combined = new
+                if history is not None:
+                    combined = pd.concat([history[["patient_id", "timestamp", *VITALS]], new], ignore_index=True)
+                features = compute_features(combined, window)
+                self.write_part(patient_id, window, features.iloc[len(combined) - len(new):])
+                if len(self.parts(patient_id, window)) > self.compact_parts:
+                    self.compact(patient_id, window)
+        return len(vitals)
+
+    def read(self, window, patient_ids=None, start=None, end=None):
+        """
+        Fetch cached features for training, optionally restricted to patients and a time range.
+
+        Returns:
+        A DataFrame of readings with their features, sorted by patient and time.
+        """
+        root = os.path.join(self.root, f"v{self.version}", window)
+        if patient_ids is not None:
+            directories = [self.patient_dir(patient_id, window) for patient_id in patient_ids]
+        else:
+            directories = sorted(glob.glob(os.path.join(root, "*")))
+        frames = []
+        for directory in directories:
+            for part in sorted(glob.glob(os.path.join(directory, "part-*.parquet"))):
+                frame = pd.read_parquet(part)
+                if start is not None:
+                    frame = frame[frame["timestamp"] >= start]
+                if end is not None:
+                    frame = frame[frame["timestamp"] < end]
+                frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=["patient_id", "timestamp", *VITALS])
+        return pd.concat(frames, ignore_index=True)
+
+    def latest(self, patient_id, window):
+        """
+        Fetch a patient's most recent features for inference, or None if there are none.
+        """
+        parts = self.parts(patient_id, window)
+        if not parts:
+            return None
+        return pd.read_parquet(parts[-1]).iloc[-1]
@@ -0,0 +1,2 @@
+from ai.models.health_monitoring_model import HealthMonitoringModel
+from ai.models.registry import ModelRegistry, model_registry
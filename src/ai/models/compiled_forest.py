@@ -0,0 +1,117 @@
+import json
+import os
+
+import numpy as np
+
+META_FILE = "forest.json"
+ARRAYS = ("feature", "threshold", "left", "right", "missing_left", "value", "roots")
+
+
+class CompiledForest:
+    """
+    A random forest classifier flattened into contiguous NumPy node arrays.
+
+    The nodes of every tree are concatenated, with child indices pointing into the
+    concatenation, so a batch is scored by advancing all (sample, tree) pairs one level
+    per step instead of walking each tree separately. Predictions are bit-identical to
+    RandomForestClassifier: inputs are cast to float32 as sklearn does, leaf probabilities
+    are normalized the same way and trees are summed in the same order.
+    """
+
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots, classes, depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.depth = depth
+        self.is_leaf = left == np.arange(len(left))
+
+    @classmethod
+    def from_forest(cls, forest):
+        """
+        Flatten a trained single-output RandomForestClassifier.
+        """
+        if getattr(forest, "n_outputs_", 1) != 1:
+            raise ValueError("Only single-output forests can be compiled")
+        feature, threshold, left, right, missing_left, value, roots = [], [], [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            leaf = tree.children_left == -1
+            roots.append(offset)
+            # Leaves test feature 0 so gathers stay in bounds; their children point to themselves
+            feature.append(np.where(leaf, 0, tree.feature))
+            threshold.append(tree.threshold)
+            nodes = np.arange(tree.node_count)
+            left.append(np.where(leaf, nodes, tree.children_left) + offset)
+            right.append(np.where(leaf, nodes, tree.children_right) + offset)
+            missing_left.append(getattr(tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=np.uint8)))
+            # DecisionTreeClassifier.predict_proba normalizes the leaf values row by row
+            proba = tree.value[:, 0, :forest.n_classes_]
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            value.append(proba / normalizer)
+            offset += tree.node_count
+        depth = max(estimator.tree_.max_depth for estimator in forest.estimators_)
+        return cls(np.concatenate(feature).astype(np.intp), np.concatenate(threshold).astype(np.float64),
+                   np.concatenate(left).astype(np.intp), np.concatenate(right).astype(np.intp),
+                   np.concatenate(missing_left).astype(bool), np.concatenate(value).astype(np.float64),
+                   np.asarray(roots, dtype=np.intp), np.asarray(forest.classes_), depth)
+
+    def apply(self, X):
+        """
+        Return the leaf each sample reaches in each tree, as an (n_samples, n_trees) array.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        n_samples, n_features = X.shape
+        n_trees = len(self.roots)
+        values = X.ravel()
+        nodes = np.tile(self.roots, n_samples)
+
+        # Advance every (sample, tree) pair one level per step, carrying only the pairs that
+        # have not reached a leaf yet, along with the offset of their sample's row in X
+        active = np.flatnonzero(~self.is_leaf.take(nodes))
+        row_offsets = (active // n_trees) * n_features
+        while len(active):
+            current = nodes.take(active)
+            value = values.take(row_offsets + self.feature.take(current))
+            go_left = (value <= self.threshold.take(current)) | (np.isnan(value) & self.missing_left.take(current))
+            current = np.where(go_left, self.left.take(current), self.right.take(current))
+            nodes[active] = current
+            inner = ~self.is_leaf.take(current)
+            active = active[inner]
+            row_offsets = row_offsets[inner]
+        return nodes.reshape(n_samples, n_trees)
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        proba = np.zeros((len(leaves), self.value.shape[1]))
+        # Summed tree by tree, in the forest's order, to match sklearn's float rounding
+        for tree in range(leaves.shape[1]):
+            proba += self.value[leaves[:, tree]]
+        proba /= leaves.shape[1]
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+    def save(self, directory):
+        """
+        Save the node arrays as .npy files that load() can memory-map.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, META_FILE), "w") as f:
+            json.dump({"classes": self.classes_.tolist(), "depth": self.depth}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAYS}
+        return cls(classes=np.asarray(meta["classes"]), depth=meta["depth"], **arrays)
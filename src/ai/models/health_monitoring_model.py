@@ -1,17 +1,73 @@
+import sys
+
+import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import SGDClassifier
 from sklearn.metrics import accuracy_score, classification_report
 from sklearn.model_selection import train_test_split
 
+from ai.features import feature_matrix
+from ai.models.compiled_forest import CompiledForest
+from ai.models.registry import model_registry
+
+# Registry name of the health-status classifier
+MODEL_NAME = "health_monitoring"
+
+# Column holding the health-status label in training data
+LABEL_COLUMN = "label"
+
+# Rows read per chunk when training out of core
+TRAIN_CHUNK_ROWS = 100000
+
+# Held-out rows kept in memory to evaluate out-of-core training
+MAX_EVAL_ROWS = 100000
+
+# Chunks carried over at most while waiting for every class to appear in a forest's batch
+MAX_PENDING_CHUNKS = 8
+
+# Quantiles of each training feature saved with a model, as the reference for drift monitoring
+REFERENCE_QUANTILES = np.linspace(0, 1, 101)
+
+# Batches up to this size are scored by the compiled forest; sklearn is faster on larger ones
+COMPILED_MAX_BATCH = 256
+
+
+def peak_memory_mb():
+    """
+    Return the peak resident memory of this process so far, in MiB, or None on Windows,
+    which has no resource module.
+    """
+    if sys.platform == "win32":
+        return None
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
 
 class HealthMonitoringModel:
-    def __init__(self, data_path):
+    def __init__(self, data_path=None):
         self.data_path = data_path
         self.model = None
+        self.features = None
+        self.metrics = None
+        self.version = None
+        self.compiled = None
+        self.reference = None
 
     def load_data(self):
-        # Load the health data from a CSV file
-        data = pd.read_csv(self.data_path)
+        # Load the health data from a CSV file, or a Parquet file / Arrow stream exported by the backend
+        if self.data_path.endswith(".parquet"):
+            data = pd.read_parquet(self.data_path)
+        elif self.data_path.endswith(".arrows"):
+            import pyarrow as pa
+
+            with pa.memory_map(self.data_path) as source:
+                data = pa.ipc.open_stream(source).read_pandas()
+        else:
+            data = pd.read_csv(self.data_path)
 
         # Preprocess the data as necessary
         # ...
@@ -22,9 +78,11 @@ class HealthMonitoringModel:
 
         return X, y
 
-    def train_model(self):
-        # Load the data
-        X, y = self.load_data()
+    def train_model(self, X=None, y=None):
+        # Load the data, unless it was passed in
+        if X is None:
+            X, y = self.load_data()
+        X = pd.DataFrame(X)
 
         # Split the data into training and testing sets
         X_train, X_test, y_train, y_test = train_test_split(
@@ -40,11 +98,241 @@ class HealthMonitoringModel:
         accuracy = accuracy_score(y_test, y_pred)
         print(classification_report(y_test, y_pred))
 
+        # Remember the feature schema and metrics to store alongside the model
+        self.features = [{"name": str(name), "dtype": str(dtype)} for name, dtype in X.dtypes.items()]
+        self.metrics = {"accuracy": accuracy, "train_rows": len(X_train), "test_rows": len(X_test)}
+        self.reference = np.quantile(X_train.to_numpy(np.float64), REFERENCE_QUANTILES, axis=0)
+
+        return accuracy
+
+    def iter_frames(self, columns, dtypes=None, chunk_size=TRAIN_CHUNK_ROWS):
+        """
+        Stream selected columns of the data file as DataFrames of at most chunk_size rows.
+
+        Args:
+        - columns: The columns to read.
+        - dtypes: A dictionary of column dtypes, applied while parsing CSV files.
+        - chunk_size: The number of rows per chunk.
+
+        Returns:
+        A generator of DataFrames.
+        """
+        if self.data_path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            for batch in pq.ParquetFile(self.data_path).iter_batches(batch_size=chunk_size, columns=columns):
+                yield batch.to_pandas().astype(dtypes or {})
+        elif self.data_path.endswith(".arrows"):
+            import pyarrow as pa
+
+            with pa.memory_map(self.data_path) as source:
+                for batch in pa.ipc.open_stream(source):
+                    yield (batch if columns is None else batch.select(columns)).to_pandas().astype(dtypes or {})
+        else:
+            yield from pd.read_csv(self.data_path, usecols=columns, dtype=dtypes, chunksize=chunk_size)
+
+    def feature_columns(self):
+        # Every column but the label, as in load_data
+        if self.data_path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            columns = pq.read_schema(self.data_path).names
+        elif self.data_path.endswith(".arrows"):
+            import pyarrow as pa
+
+            with pa.memory_map(self.data_path) as source:
+                columns = pa.ipc.open_stream(source).schema.names
+        else:
+            columns = list(pd.read_csv(self.data_path, nrows=0).columns)
+        return [column for column in columns if column != LABEL_COLUMN]
+
+    def scan_classes(self, chunk_size=TRAIN_CHUNK_ROWS):
+        # Reading the label column alone is cheap next to the full data
+        classes = set()
+        for chunk in self.iter_frames([LABEL_COLUMN], chunk_size=chunk_size):
+            classes.update(chunk[LABEL_COLUMN].dropna().unique().tolist())
+        return sorted(classes)
+
+    def train_model_chunked(self, learner="forest", chunk_size=TRAIN_CHUNK_ROWS, features=None, classes=None,
+                            trees_per_chunk=10, test_size=0.2, max_eval_rows=MAX_EVAL_ROWS, random_state=42):
+        """
+        Train on a data file too large for memory, reading it in chunks.
+
+        Features are parsed as float32 and labels as a categorical, so a chunk takes a
+        fraction of the memory of pd.read_csv's default float64/object columns.
+
+        Args:
+        - learner: "forest" to grow trees_per_chunk more trees of a warm-started random
+          forest on every chunk, or "sgd" to update a logistic regression with partial_fit.
+        - chunk_size: The number of rows read at a time.
+        - features: The feature columns; defaults to every column but the label.
+        - classes: The label values; found with a pass over the label column if not given.
+        - trees_per_chunk: The number of trees grown per chunk by the forest learner.
+        - test_size: The fraction of each chunk held out for evaluation.
+        - max_eval_rows: The most held-out rows kept for evaluation.
+        - random_state: The seed for the held-out split and the learner.
+
+        Returns:
+        The accuracy on the held-out rows.
+        """
+        features = features or self.feature_columns()
+        classes = list(classes) if classes is not None else self.scan_classes(chunk_size)
+        dtypes = dict({feature: np.float32 for feature in features}, **{LABEL_COLUMN: pd.CategoricalDtype(classes)})
+        if learner == "forest":
+            self.model = RandomForestClassifier(n_estimators=trees_per_chunk, warm_start=True,
+                                                random_state=random_state)
+        elif learner == "sgd":
+            self.model = SGDClassifier(loss="log_loss", random_state=random_state)
+        else:
+            raise ValueError(f"Unknown learner: {learner}")
+
+        rng = np.random.default_rng(random_state)
+        eval_X, eval_y = [], []
+        eval_rows = train_rows = chunks = 0
+        largest_chunk_mb = 0.0
+        pending = None
+        pending_chunks = 0
+        for chunk in self.iter_frames(features + [LABEL_COLUMN], dtypes, chunk_size):
+            chunk = chunk.dropna(subset=[LABEL_COLUMN])
+            largest_chunk_mb = max(largest_chunk_mb, chunk.memory_usage(deep=True).sum() / (1024 * 1024))
+            held_out = rng.random(len(chunk)) < test_size
+            if eval_rows < max_eval_rows:
+                kept = chunk[held_out].iloc[:max_eval_rows - eval_rows]
+                eval_X.append(kept[features].to_numpy(np.float32))
+                eval_y.append(kept[LABEL_COLUMN].to_numpy())
+                eval_rows += len(kept)
+            train = chunk[~held_out]
+
+            if learner == "sgd":
+                self.model.partial_fit(train[features].to_numpy(np.float32), train[LABEL_COLUMN].to_numpy(),
+                                       classes=classes)
+            else:
+                # Every batch of trees must see every class, so short chunks are carried over
+                pending = train if pending is None else pd.concat([pending, train])
+                pending_chunks += 1
+                if pending[LABEL_COLUMN].nunique() < len(classes):
+                    if pending_chunks >= MAX_PENDING_CHUNKS:
+                        raise ValueError(f"No {MAX_PENDING_CHUNKS} consecutive chunks held every class; "
+                                         "pass a larger chunk_size")
+                    continue
+                if hasattr(self.model, "estimators_"):
+                    self.model.n_estimators += trees_per_chunk
+                self.model.fit(pending[features].to_numpy(np.float32), pending[LABEL_COLUMN].to_numpy())
+                train, pending, pending_chunks = pending, None, 0
+            train_rows += len(train)
+            chunks += 1
+
+        if train_rows == 0:
+            raise ValueError("No chunk held every class; pass a larger chunk_size")
+        eval_X = np.concatenate(eval_X) if eval_X else np.empty((0, len(features)), dtype=np.float32)
+        eval_y = np.concatenate(eval_y) if eval_y else np.empty(0)
+        accuracy = None
+        if eval_rows:
+            y_pred = self.model.predict(eval_X)
+            accuracy = accuracy_score(eval_y, y_pred)
+            print(classification_report(eval_y, y_pred))
+
+        self.features = [{"name": feature, "dtype": "float32"} for feature in features]
+        if eval_rows:
+            self.reference = np.quantile(eval_X.astype(np.float64), REFERENCE_QUANTILES, axis=0)
+        self.metrics = {"accuracy": accuracy, "train_rows": train_rows, "test_rows": eval_rows, "chunks": chunks,
+                        "learner": learner, "largest_chunk_mb": largest_chunk_mb, "peak_memory_mb": peak_memory_mb()}
         return accuracy
 
+    def train_from_store(self, store, window, labels):
+        """
+        Train on derived features from the feature store instead of raw readings.
+
+        Args:
+        - store: The FeatureStore.
+        - window: The feature window to train on, e.g. "1h".
+        - labels: A DataFrame with patient_id, timestamp and label columns.
+
+        Returns:
+        The accuracy on the held-out rows.
+        """
+        labels = labels.assign(patient_id=labels["patient_id"].astype(str),
+                               timestamp=pd.to_datetime(labels["timestamp"]))
+        data = store.read(window, patient_ids=labels["patient_id"].unique()).merge(
+            labels[["patient_id", "timestamp", LABEL_COLUMN]], on=["patient_id", "timestamp"])
+        return self.train_model(feature_matrix(data), data[LABEL_COLUMN])
+
+    def predict_latest(self, store, window, patient_ids):
+        """
+        Predict the health status of patients from their most recent cached features.
+
+        Returns:
+        A dictionary mapping each patient with cached features to its prediction.
+        """
+        latest = [store.latest(patient_id, window) for patient_id in patient_ids]
+        latest = pd.DataFrame([row for row in latest if row is not None])
+        if latest.empty:
+            return {}
+        return dict(zip(latest["patient_id"], self.predict(feature_matrix(latest)).tolist()))
+
+    def compile(self):
+        """
+        Flatten the trained forest into NumPy node arrays for low-latency scoring of small batches.
+        """
+        if self.model is None:
+            raise ValueError("Model not trained")
+        self.compiled = CompiledForest.from_forest(self.model)
+        return self.compiled
+
+    def save(self, registry=model_registry, name=MODEL_NAME):
+        """
+        Save the trained model to the registry as its new current version.
+
+        Returns:
+        The version number.
+        """
+        if self.model is None:
+            raise ValueError("Model not trained")
+        reference = self.reference.tolist() if self.reference is not None else None
+        # Forests are saved compiled too, so serving processes memory-map their nodes
+        compiled = self.compiled
+        if compiled is None and isinstance(self.model, RandomForestClassifier) and self.model.n_outputs_ == 1:
+            compiled = CompiledForest.from_forest(self.model)
+        self.version = registry.save(self.model, name, self.features, self.metrics, compiled=compiled,
+                                     data_path=self.data_path, reference_quantiles=reference)
+        return self.version
+
+    @classmethod
+    def from_registry(cls, registry=model_registry, name=MODEL_NAME, version=None):
+        """
+        Fetch a trained model from the registry instead of retraining it.
+
+        Args:
+        - registry: The model registry.
+        - name: The model name.
+        - version: The version to load; defaults to the current one, cached in memory.
+
+        Returns:
+        A HealthMonitoringModel ready to predict.
+        """
+        if version is None:
+            model, metadata = registry.current(name)
+        else:
+            model, metadata = registry.load(name, version)
+        instance = cls(metadata.get("data_path"))
+        instance.model = model
+        instance.features = metadata["features"]
+        instance.metrics = metadata["metrics"]
+        instance.version = metadata["version"]
+        instance.compiled = registry.compiled(name, instance.version)
+        if metadata.get("reference_quantiles") is not None:
+            instance.reference = np.asarray(metadata["reference_quantiles"])
+        return instance
+
     def predict(self, X):
         # Make predictions on new data using the trained model
         if self.model is None:
             raise ValueError("Model not trained")
 
+        # Put DataFrame columns in the order the model was trained with
+        if self.features is not None and isinstance(X, pd.DataFrame):
+            X = X[[feature["name"] for feature in self.features]]
+
+        if self.compiled is not None and len(X) <= COMPILED_MAX_BATCH:
+            return self.compiled.predict(X)
         return self.model.predict(X)
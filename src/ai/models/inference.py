@@ -0,0 +1,249 @@
+"""
+Micro-batched inference for the health-status classifier.
+
+Callers submit one reading at a time; a worker thread gathers the readings that arrive
+within a short window into one batch and runs the model once for the whole batch, which
+costs little more than a single-row prediction for a forest. Run an HTTP endpoint with:
+
+    python -m ai.models.inference --port 5100
+"""
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+from sklearn.ensemble import RandomForestClassifier
+
+from ai.models.compiled_forest import CompiledForest
+from ai.models.health_monitoring_model import COMPILED_MAX_BATCH, HealthMonitoringModel
+from ai.models.monitoring import ModelMonitor
+
+# A batch is run as soon as it holds this many readings...
+MAX_BATCH_SIZE = int(os.environ.get("HEALTHGUARD_INFERENCE_MAX_BATCH", 256))
+
+# ...or this many milliseconds after its first reading arrived
+MAX_WAIT_MS = float(os.environ.get("HEALTHGUARD_INFERENCE_MAX_WAIT_MS", 2))
+
+# Recent request latencies kept for the percentile statistics
+LATENCY_SAMPLES = 10000
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingPredictor:
+    """
+    Gathers concurrent prediction requests into batches for a single model call each.
+
+    Args:
+    - model_source: A callable returning the HealthMonitoringModel to use. It is called once
+      per batch, so a registry-backed source picks up new current versions without a restart.
+    - max_batch_size: The largest number of readings per batch.
+    - max_wait_ms: How long the first reading of a batch may wait for others.
+    - method: The model method to run, "predict" or "predict_proba".
+    - monitor: The ModelMonitor recording latency, inputs and predictions per model version.
+    """
+
+    def __init__(self, model_source=HealthMonitoringModel.from_registry, max_batch_size=MAX_BATCH_SIZE,
+                 max_wait_ms=MAX_WAIT_MS, method="predict", monitor=None):
+        self.model_source = model_source
+        self.monitor = ModelMonitor() if monitor is None else monitor
+        self.referenced = set()
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.method = method
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.predictions = 0
+        self.errors = 0
+        self.batch_sizes = deque(maxlen=LATENCY_SAMPLES)
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.compiled = (None, None)
+        self.running = True
+        self.worker = threading.Thread(target=self.run, name="healthguard-inference", daemon=True)
+        self.worker.start()
+
+    def submit(self, reading):
+        """
+        Queue a reading for prediction.
+
+        Args:
+        - reading: A dictionary keyed by feature name, or a sequence of feature values in
+          the model's feature order.
+
+        Returns:
+        A Future resolving to the prediction for the reading.
+        """
+        future = Future()
+        self.requests.put((time.perf_counter(), reading, future))
+        return future
+
+    def predict(self, reading, timeout=None):
+        """
+        Predict a single reading, waiting for the batch it joins to run.
+        """
+        return self.submit(reading).result(timeout)
+
+    def next_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while self.running:
+            # Requests cancelled while queued are dropped; the others can no longer be cancelled
+            batch = [request for request in self.next_batch()
+                     if request is not None and request[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                model = self.model_source()
+            except Exception as e:
+                self.fail(batch, e)
+                continue
+
+            # Malformed readings fail on their own instead of failing the whole batch
+            names = [feature["name"] for feature in model.features] if model.features else None
+            accepted, rows = [], []
+            for request in batch:
+                try:
+                    rows.append(self.feature_row(request[1], names))
+                    accepted.append(request)
+                except (KeyError, TypeError, ValueError) as e:
+                    self.fail([request], e)
+            if not accepted:
+                continue
+            started = time.perf_counter()
+            try:
+                X = np.vstack(rows)
+                results = self.run_model(model, X, names)
+            except Exception as e:
+                self.fail(accepted, e)
+                continue
+
+            finished = time.perf_counter()
+            for (submitted, reading, future), result in zip(accepted, results):
+                future.set_result(result)
+            with self.lock:
+                self.batches += 1
+                self.predictions += len(accepted)
+                self.batch_sizes.append(len(accepted))
+                self.latencies.extend(finished - submitted for submitted, reading, future in accepted)
+            try:
+                self.observe(model, X, results, finished - started, names)
+            except Exception:
+                # Monitoring must never stop the worker serving predictions
+                logger.exception("Failed to record inference batch for model version %s", model.version)
+
+    def fail(self, requests, error):
+        with self.lock:
+            self.errors += len(requests)
+        for submitted, reading, future in requests:
+            future.set_exception(error)
+
+    @staticmethod
+    def feature_row(reading, names):
+        if isinstance(reading, dict):
+            if names is None:
+                raise ValueError("The model has no feature names; send feature values in order")
+            reading = [reading[name] for name in names]
+        row = np.asarray(reading, dtype=np.float64)
+        if row.ndim != 1 or (names is not None and len(row) != len(names)):
+            raise ValueError("Wrong number of features")
+        return row
+
+    def run_model(self, model, X, names):
+        # One call for the whole batch. Forests are compiled once per model version for
+        # small batches; otherwise a named frame matches how the model was fitted.
+        estimator = model.model
+        if isinstance(estimator, RandomForestClassifier) and len(X) <= COMPILED_MAX_BATCH:
+            if self.compiled[0] is not estimator:
+                self.compiled = (estimator, model.compiled or CompiledForest.from_forest(estimator))
+            estimator = self.compiled[1]
+        elif names is not None:
+            X = pd.DataFrame(X, columns=names)
+        if self.method == "predict_proba":
+            return estimator.predict_proba(X).tolist()
+        return estimator.predict(X).tolist()
+
+    def observe(self, model, X, results, latency_seconds, names):
+        if model.version not in self.referenced and model.reference is not None:
+            self.monitor.set_reference(model.version, model.reference, names)
+            self.referenced.add(model.version)
+        predictions = results
+        if self.method == "predict_proba":
+            predictions = model.model.classes_.take(np.argmax(results, axis=1))
+        self.monitor.record(model.version, X, predictions, latency_seconds, names)
+
+    def close(self):
+        self.running = False
+        self.requests.put(None)
+        self.worker.join()
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            return {
+                "batches": self.batches,
+                "predictions": self.predictions,
+                "errors": self.errors,
+                "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+                "latency_ms": {
+                    "p50": float(np.percentile(latencies, 50)),
+                    "p95": float(np.percentile(latencies, 95)),
+                    "p99": float(np.percentile(latencies, 99)),
+                } if len(latencies) else None,
+            }
+
+
+def create_inference_app(predictor):
+    """
+    Create a Flask app serving predictions; each request thread joins the shared batches.
+    """
+    from flask import Flask, jsonify, request
+
+    app = Flask(__name__)
+
+    @app.route('/predict', methods=['POST'])
+    def predict():
+        data = request.get_json(silent=True)
+        if not isinstance(data, (dict, list)):
+            return jsonify({"error": "Invalid request data"}), 400
+        try:
+            if isinstance(data, dict) and "readings" in data:
+                futures = [predictor.submit(reading) for reading in data["readings"]]
+                return jsonify({"predictions": [future.result() for future in futures]})
+            return jsonify({"prediction": predictor.predict(data)})
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid reading: {e}"}), 400
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return jsonify(dict(predictor.stats(), models=predictor.monitor.report()))
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve micro-batched health-status predictions")
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--proba", action="store_true", help="return class probabilities")
+    args = parser.parse_args()
+    predictor = BatchingPredictor(max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                                  method="predict_proba" if args.proba else "predict")
+    create_inference_app(predictor).run(host="0.0.0.0", port=args.port, threaded=True)
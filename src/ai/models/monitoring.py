@@ -0,0 +1,241 @@
+"""
+Post-deployment monitoring of the health-status classifier.
+
+Per model version, the monitor keeps the latencies and batch sizes of the most recent
+calls, a histogram of every input feature and counts of each predicted class. Feature
+histograms count values over bins cut at the quantiles of a reference distribution,
+normally the training data of the version, with older counts decaying exponentially so
+the statistics follow what the model sees now rather than its whole uptime. Memory stays
+bounded however long a server runs and no raw input is retained. Drift is scored as the
+population stability index of each feature's recent histogram against the reference.
+"""
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+# Most recent latencies and batch sizes kept for their quantiles
+SKETCH_SIZE = 2048
+
+# Quantile bins of the reference distribution that feature values are counted in
+HISTOGRAM_BINS = 100
+
+# Predictions after which a feature value's weight in its histogram has halved
+HALF_LIFE = 10000
+
+# Versions tracked at once; the least recently recorded one is dropped beyond this
+MAX_VERSIONS = 8
+
+# Quantile bins of the reference distribution used to score drift
+DRIFT_BINS = 10
+
+# Population stability index above which a feature is reported as drifted
+DRIFT_THRESHOLD = 0.2
+
+
+class QuantileSketch:
+    """
+    The most recent values of a stream, in a ring buffer, for approximate quantiles.
+    """
+
+    def __init__(self, size=SKETCH_SIZE):
+        self.size = size
+        self.samples = np.empty(size)
+        self.count = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        # Only the last size values of a large batch can survive in the buffer
+        positions = (self.count + np.arange(len(values)))[-self.size:] % self.size
+        self.samples[positions] = values[-self.size:]
+        self.count += len(values)
+
+    def values(self):
+        return self.samples[:min(self.count, self.size)]
+
+    def quantiles(self, q):
+        if not self.count:
+            return None
+        return np.quantile(self.values(), q)
+
+
+class FeatureHistogram:
+    """
+    Exponentially decayed counts of a feature's values over the quantile bins of a
+    reference sample, for approximate recent quantiles and drift.
+
+    Bins are cut at HISTOGRAM_BINS quantiles of the reference, which include its
+    DRIFT_BINS quantiles, so every bin lies within one drift bin.
+    """
+
+    def __init__(self, reference, bins=HISTOGRAM_BINS, drift_bins=DRIFT_BINS, half_life=HALF_LIFE):
+        reference = np.asarray(reference, dtype=np.float64)
+        reference = reference[~np.isnan(reference)]
+        # Rounded so the drift quantiles are computed at exactly the same probabilities as
+        # the matching histogram ones
+        drift_levels = np.round(np.linspace(0, 1, drift_bins + 1)[1:-1], 12)
+        levels = np.union1d(drift_levels, np.round(np.linspace(0, 1, bins + 1)[1:-1], 12))
+        drift_edges = np.unique(np.quantile(reference, drift_levels))
+        self.edges = np.unique(np.quantile(reference, levels))
+        # Drift bin of each bin, from the bin's lower edge
+        self.groups = np.searchsorted(drift_edges, np.concatenate([[-np.inf], self.edges]), side="right")
+        self.expected = self.group(self.bin_counts(reference))
+        self.counts = np.zeros(len(self.edges) + 1)
+        self.decay = 0.5 ** (1 / half_life)
+        self.count = 0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    def bin_counts(self, values):
+        return np.bincount(np.searchsorted(self.edges, values, side="right"), minlength=len(self.edges) + 1)
+
+    def group(self, counts):
+        return np.bincount(self.groups, weights=counts, minlength=self.groups[-1] + 1)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self.counts *= self.decay ** len(values)
+        self.counts += self.bin_counts(values)
+        self.count += len(values)
+
+    def quantiles(self, q):
+        """
+        Interpolate quantiles of the recent values within their bins, the outer bins being
+        bounded by the smallest and largest values seen.
+        """
+        if not self.count:
+            return None
+        bounds = np.concatenate([[self.minimum], np.clip(self.edges, self.minimum, self.maximum), [self.maximum]])
+        cumulative = np.concatenate([[0], np.cumsum(self.counts)]) / self.counts.sum()
+        return np.interp(q, cumulative, bounds)
+
+    def drift(self):
+        return population_stability_index(self.expected, self.group(self.counts))
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        p5, p50, p95 = self.quantiles([0.05, 0.5, 0.95]).tolist()
+        return {"count": self.count, "min": self.minimum, "p5": p5, "p50": p50, "p95": p95, "max": self.maximum}
+
+
+def population_stability_index(expected, actual):
+    """
+    Score how far a distribution has shifted from a reference one, given their counts over
+    the same bins; 0 means no shift.
+    """
+    # Floor empty bins so a bin missing on one side does not make the index infinite
+    expected = np.maximum(expected / expected.sum(), 1e-4)
+    actual = np.maximum(actual / actual.sum(), 1e-4)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+class VersionStats:
+    def __init__(self, features):
+        self.features = list(features)
+        self.latencies = QuantileSketch()
+        self.batch_sizes = QuantileSketch()
+        # Feature histograms, binned once a reference is set
+        self.histograms = None
+        self.classes = Counter()
+        self.batches = 0
+        self.predictions = 0
+
+
+class ModelMonitor:
+    """
+    Bounded-memory performance and drift statistics per model version.
+    """
+
+    def __init__(self, max_versions=MAX_VERSIONS):
+        self.max_versions = max_versions
+        self.lock = threading.Lock()
+        self.versions = OrderedDict()
+
+    def stats(self, version, n_features, features=None):
+        stats = self.versions.get(version)
+        if stats is None:
+            stats = self.versions[version] = VersionStats(features or [str(i) for i in range(n_features)])
+            while len(self.versions) > self.max_versions:
+                self.versions.popitem(last=False)
+        self.versions.move_to_end(version)
+        return stats
+
+    def record(self, version, X, predictions, latency_seconds, features=None):
+        """
+        Record one model call.
+
+        Args:
+        - version: The model version that ran, or None for an unregistered model.
+        - X: The (n_samples, n_features) inputs.
+        - predictions: The predicted class of each sample.
+        - latency_seconds: How long the call took.
+        - features: The feature names, in column order.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        with self.lock:
+            stats = self.stats(version, X.shape[1], features)
+            stats.latencies.add([latency_seconds * 1000])
+            stats.batch_sizes.add([len(X)])
+            for column, histogram in enumerate(stats.histograms or ()):
+                histogram.add(X[:, column])
+            stats.classes.update(np.asarray(predictions).tolist())
+            stats.batches += 1
+            stats.predictions += len(X)
+
+    def set_reference(self, version, X, features=None):
+        """
+        Record the distribution drift is measured against, e.g. a version's training data,
+        and start counting the version's feature values over its quantile bins.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        with self.lock:
+            stats = self.stats(version, X.shape[1], features)
+            stats.histograms = [FeatureHistogram(X[:, column]) for column in range(X.shape[1])]
+
+    def drift(self, version):
+        """
+        Score each feature's recent drift from the version's reference distribution.
+
+        Returns:
+        A dictionary mapping feature names to population stability indexes, or None if the
+        version has no reference.
+        """
+        with self.lock:
+            stats = self.versions.get(version)
+            if stats is None or stats.histograms is None:
+                return None
+            return {name: histogram.drift() for name, histogram in zip(stats.features, stats.histograms)
+                    if histogram.count}
+
+    def report(self):
+        """
+        Summarize every tracked version, most recently recorded last.
+        """
+        versions = list(self.versions)
+        report = {}
+        for version in versions:
+            drift = self.drift(version)
+            with self.lock:
+                stats = self.versions.get(version)
+                if stats is None:
+                    continue
+                latency = stats.latencies.quantiles([0.5, 0.95, 0.99])
+                report[str(version)] = {
+                    "batches": stats.batches,
+                    "predictions": stats.predictions,
+                    "mean_batch_size": stats.predictions / stats.batches if stats.batches else 0.0,
+                    "latency_ms": dict(zip(("p50", "p95", "p99"), latency.tolist())) if latency is not None else None,
+                    "class_rates": {str(label): count / stats.predictions for label, count in stats.classes.items()},
+                    "features": {name: histogram.summary()
+                                 for name, histogram in zip(stats.features, stats.histograms or ())},
+                    "drift": drift,
+                    "drifted": sorted(name for name, score in (drift or {}).items() if score > DRIFT_THRESHOLD),
+                }
+        return report
@@ -0,0 +1,171 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+
+import joblib
+
+from ai.models.compiled_forest import CompiledForest
+
+# Root directory of the model registry, by default under the repository's models directory
+# whatever the working directory
+MODEL_REGISTRY_DIR = os.environ.get(
+    "HEALTHGUARD_MODEL_REGISTRY_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "models", "registry"))
+
+MODEL_FILE = "model.joblib"
+METADATA_FILE = "metadata.json"
+COMPILED_DIR = "compiled"
+CURRENT_FILE = "CURRENT"
+
+
+class ModelRegistry:
+    """
+    Versioned storage of trained models on disk.
+
+    Each model name has numbered versions, stored as <root>/<name>/<version>/ with the
+    estimator and a metadata file holding its feature schema and evaluation metrics, and a
+    CURRENT file naming the version serving code should use.
+
+    Unpickled estimators live in process memory: sklearn trees copy their node arrays when
+    they are restored. A version can therefore also carry a CompiledForest, saved as .npy
+    node arrays that are memory-mapped on load, so processes serving the same version
+    share one copy of the nodes through the page cache.
+    """
+
+    def __init__(self, root=MODEL_REGISTRY_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.loaded = {}
+        self.loaded_compiled = {}
+
+    def model_dir(self, name, version=None):
+        path = os.path.join(self.root, name)
+        return path if version is None else os.path.join(path, str(version))
+
+    def versions(self, name):
+        """
+        List the saved versions of a model, oldest first.
+        """
+        if not os.path.isdir(self.model_dir(name)):
+            return []
+        return sorted(int(entry) for entry in os.listdir(self.model_dir(name)) if entry.isdigit())
+
+    def save(self, estimator, name, features, metrics=None, make_current=True, compiled=None, **extra):
+        """
+        Save a trained estimator as the next version of a model.
+
+        Args:
+        - estimator: The trained estimator.
+        - name: The model name.
+        - features: The feature schema, a list of {"name": ..., "dtype": ...} dictionaries
+          in the order the estimator expects them.
+        - metrics: A dictionary of evaluation metrics.
+        - make_current: Whether serving code should switch to this version.
+        - compiled: An optional CompiledForest of the estimator, saved for memory-mapped scoring.
+        - **extra: Additional JSON-serializable metadata.
+
+        Returns:
+        The new version number.
+        """
+        os.makedirs(self.model_dir(name), exist_ok=True)
+        with self.lock:
+            versions = self.versions(name)
+            version = versions[-1] + 1 if versions else 1
+            metadata = dict(extra, name=name, version=version, features=list(features), metrics=metrics or {},
+                            estimator=type(estimator).__name__, created_at=datetime.utcnow().isoformat())
+
+            # Write into a temporary directory first so a version is either complete or absent
+            staging = tempfile.mkdtemp(prefix=".staging-", dir=self.model_dir(name))
+            try:
+                joblib.dump(estimator, os.path.join(staging, MODEL_FILE))
+                if compiled is not None:
+                    compiled.save(os.path.join(staging, COMPILED_DIR))
+                with open(os.path.join(staging, METADATA_FILE), "w") as f:
+                    json.dump(metadata, f, indent=2)
+                os.rename(staging, self.model_dir(name, version))
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+        if make_current:
+            self.set_current(name, version)
+        return version
+
+    def set_current(self, name, version):
+        """
+        Point serving code at a saved version, e.g. to roll back.
+        """
+        if not os.path.isdir(self.model_dir(name, version)):
+            raise ValueError(f"Model {name} has no version {version}")
+        pointer = os.path.join(self.model_dir(name), CURRENT_FILE)
+        with open(pointer + ".tmp", "w") as f:
+            f.write(str(version))
+        os.replace(pointer + ".tmp", pointer)
+
+    def current_version(self, name):
+        try:
+            with open(os.path.join(self.model_dir(name), CURRENT_FILE)) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return None
+
+    def metadata(self, name, version):
+        with open(os.path.join(self.model_dir(name, version), METADATA_FILE)) as f:
+            return json.load(f)
+
+    def load(self, name, version=None, mmap=True):
+        """
+        Load a saved version of a model, bypassing the in-process cache.
+
+        Args:
+        - name: The model name.
+        - version: The version to load; defaults to the current one.
+        - mmap: Whether joblib memory-maps the estimator's arrays read-only; this helps
+          estimators keeping plain NumPy arrays, not sklearn trees, which copy theirs.
+
+        Returns:
+        An (estimator, metadata) tuple.
+        """
+        version = self.current_version(name) if version is None else version
+        if version is None:
+            raise LookupError(f"No current version of model {name}")
+        estimator = joblib.load(os.path.join(self.model_dir(name, version), MODEL_FILE),
+                                mmap_mode="r" if mmap else None)
+        return estimator, self.metadata(name, version)
+
+    def compiled(self, name, version, mmap=True):
+        """
+        Load the CompiledForest saved with a version, memory-mapped read-only, or None if it has none.
+        """
+        directory = os.path.join(self.model_dir(name, version), COMPILED_DIR)
+        with self.lock:
+            cached = self.loaded_compiled.get(name)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+        if not os.path.isdir(directory):
+            return None
+        forest = CompiledForest.load(directory, mmap_mode="r" if mmap else None)
+        with self.lock:
+            self.loaded_compiled[name] = (version, forest)
+        return forest
+
+    def current(self, name):
+        """
+        Fetch the current version of a model, loading it only when the version changed.
+
+        Returns:
+        An (estimator, metadata) tuple.
+        """
+        version = self.current_version(name)
+        if version is None:
+            raise LookupError(f"No current version of model {name}")
+        with self.lock:
+            cached = self.loaded.get(name)
+            if cached is None or cached[1]["version"] != version:
+                cached = self.loaded[name] = self.load(name, version)
+            return cached
+
+
+model_registry = ModelRegistry()
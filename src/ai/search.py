@@ -0,0 +1,189 @@
+"""
+Parallel hyperparameter search over the model factories in ai.algorithms.
+
+Every (algorithm, parameters) configuration is cross-validated fold by fold in a process
+pool. The training data is written once to .npy files that the workers memory-map
+read-only, so it is neither pickled per task nor copied per process. After each round of
+folds, configurations whose mean score trails the best one by more than a margin are
+dropped. Fold scores are cached on disk, keyed by the data, the configuration and the
+fold, so a rerun only evaluates what has not been evaluated before.
+"""
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.model_selection import StratifiedKFold
+
+from ai.algorithms import logistic_regression, random_forest_classifier, support_vector_machine
+
+# Model factories available to the search, by name
+FACTORIES = {
+    "logistic_regression": logistic_regression,
+    "random_forest_classifier": random_forest_classifier,
+    "support_vector_machine": support_vector_machine,
+}
+
+# Default parameter grids per factory
+DEFAULT_GRIDS = {
+    "logistic_regression": {"C": [0.01, 0.1, 1.0, 10.0], "max_iter": [1000]},
+    "random_forest_classifier": {"n_estimators": [50, 100, 200], "max_depth": [None, 8, 16], "random_state": [42]},
+    "support_vector_machine": {"C": [0.1, 1.0, 10.0], "kernel": ["rbf", "linear"]},
+}
+
+# Directory holding the memory-mapped data and the fold result cache
+SEARCH_CACHE_DIR = os.environ.get("HEALTHGUARD_SEARCH_CACHE_DIR", "models/search")
+
+RESULTS_FILE = "fold_results.jsonl"
+
+# Training data and fold splits of a worker process, set up once by init_worker
+worker_state = {}
+
+
+def expand_grid(grid):
+    """
+    Expand a parameter grid into the list of parameter dictionaries it describes.
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def data_fingerprint(X, y):
+    digest = hashlib.blake2b(digest_size=16)
+    for array in (X, y):
+        digest.update(str((array.dtype, array.shape)).encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def fold_key(fingerprint, algorithm, params, fold, folds, random_state):
+    payload = json.dumps([fingerprint, algorithm, params, fold, folds, random_state], sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def init_worker(x_path, y_path, folds, random_state):
+    # Memory-map the data read-only; the page cache is shared by every worker
+    X = np.load(x_path, mmap_mode="r")
+    y = np.load(y_path, mmap_mode="r")
+    worker_state["X"] = X
+    worker_state["y"] = y
+    worker_state["splits"] = list(StratifiedKFold(folds, shuffle=True, random_state=random_state).split(X, y))
+
+
+def evaluate_fold(algorithm, params, fold):
+    """
+    Fit a configuration on one fold's training rows and score it on the fold's test rows.
+    """
+    X, y = worker_state["X"], worker_state["y"]
+    train, test = worker_state["splits"][fold]
+    model = FACTORIES[algorithm](**params)
+    model.fit(X[train], y[train])
+    return float(model.score(X[test], y[test]))
+
+
+class FoldCache:
+    """
+    Fold scores persisted as JSON lines, appended to as folds complete.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, RESULTS_FILE)
+        self.scores = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A run interrupted mid-write leaves at most one torn line
+                        continue
+                    self.scores[entry["key"]] = entry["score"]
+
+    def get(self, key):
+        return self.scores.get(key)
+
+    def put(self, key, score, **details):
+        self.scores[key] = score
+        with open(self.path, "a") as f:
+            f.write(json.dumps(dict(details, key=key, score=score), default=str) + "\n")
+
+
+def search(X, y, grids=None, folds=5, margin=0.05, n_jobs=None, cache_dir=SEARCH_CACHE_DIR, random_state=42):
+    """
+    Cross-validate every configuration of the given grids and rank them by mean score.
+
+    Args:
+    - X: The feature matrix.
+    - y: The labels.
+    - grids: A dictionary mapping factory names in FACTORIES to parameter grids;
+      defaults to DEFAULT_GRIDS.
+    - folds: The number of cross-validation folds.
+    - margin: After each fold, configurations whose mean score is more than this below
+      the best mean score are stopped.
+    - n_jobs: The number of worker processes; defaults to the number of CPUs.
+    - cache_dir: The directory for the memory-mapped data and the fold result cache.
+    - random_state: The seed of the fold splits.
+
+    Returns:
+    A list of result dictionaries, best first, with the algorithm, parameters, fold scores,
+    mean score and whether the configuration was stopped early.
+    """
+    X = np.ascontiguousarray(X)
+    # Labels are encoded as integers: object arrays, e.g. of strings, cannot be memory-mapped
+    classes, y = np.unique(np.asarray(y), return_inverse=True)
+    grids = DEFAULT_GRIDS if grids is None else grids
+    for algorithm in grids:
+        if algorithm not in FACTORIES:
+            raise ValueError(f"Unknown algorithm: {algorithm}")
+
+    # Write the data once, named by its fingerprint so unchanged data is not rewritten
+    fingerprint = data_fingerprint(X, y)
+    os.makedirs(cache_dir, exist_ok=True)
+    x_path = os.path.join(cache_dir, f"{fingerprint}-X.npy")
+    y_path = os.path.join(cache_dir, f"{fingerprint}-y.npy")
+    for path, array in ((x_path, X), (y_path, y)):
+        if not os.path.exists(path):
+            # A temporary file of its own, so concurrent searches on the same data never share one
+            fd, temporary = tempfile.mkstemp(suffix=".npy", dir=cache_dir)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, array)
+                os.replace(temporary, path)
+            except BaseException:
+                os.remove(temporary)
+                raise
+    cache = FoldCache(cache_dir)
+
+    results = [{"algorithm": algorithm, "params": params, "scores": [], "stopped_early": False}
+               for algorithm, grid in grids.items() for params in expand_grid(grid)]
+    with ProcessPoolExecutor(n_jobs, initializer=init_worker,
+                             initargs=(x_path, y_path, folds, random_state)) as executor:
+        active = results
+        for fold in range(folds):
+            pending = {}
+            for result in active:
+                key = fold_key(fingerprint, result["algorithm"], result["params"], fold, folds, random_state)
+                score = cache.get(key)
+                if score is None:
+                    pending[key] = (result, executor.submit(evaluate_fold, result["algorithm"], result["params"], fold))
+                else:
+                    result["scores"].append(score)
+            for key, (result, future) in pending.items():
+                score = future.result()
+                cache.put(key, score, algorithm=result["algorithm"], params=result["params"], fold=fold)
+                result["scores"].append(score)
+
+            # Stop configurations that are clearly worse than the best so far
+            best = max(np.mean(result["scores"]) for result in active)
+            for result in active:
+                if np.mean(result["scores"]) < best - margin:
+                    result["stopped_early"] = True
+            active = [result for result in active if not result["stopped_early"]]
+
+    for result in results:
+        result["mean_score"] = float(np.mean(result["scores"]))
+    # Configurations that completed every fold rank ahead of those stopped early
+    return sorted(results, key=lambda result: (result["stopped_early"], -result["mean_score"]))
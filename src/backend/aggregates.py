@@ -0,0 +1,349 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from sqlalchemy import Float, cast, func, literal, null, select, union_all
+
+from database import HealthData, HealthDataAggregate, session_factory
+from retention import diastolic, systolic
+
+# Rolling windows maintained for every patient, in seconds
+AGGREGATE_WINDOWS = tuple(int(window) for window in
+                          os.environ.get("HEALTHGUARD_AGGREGATE_WINDOWS", "300,3600,86400").split(","))
+
+# Each window is split into this many buckets; the window slides one bucket at a time
+WINDOW_BUCKETS = int(os.environ.get("HEALTHGUARD_WINDOW_BUCKETS", 12))
+
+# Vitals tracked by the rolling aggregates
+AGGREGATE_VITALS = ("heart_rate", "systolic", "diastolic", "temperature")
+
+# Maximum number of patients whose aggregates are kept in memory; the least recently used go first
+AGGREGATE_PATIENTS = int(os.environ.get("HEALTHGUARD_AGGREGATE_PATIENTS", 10000))
+
+# Seconds after which a patient's aggregates are rebuilt from the database; 0 keeps them
+# until evicted. Set it when several processes ingest readings for the same patients.
+AGGREGATE_TTL = float(os.environ.get("HEALTHGUARD_AGGREGATE_TTL", 0))
+
+# Rows fetched per round trip when refilling a patient's windows
+LOAD_BATCH_SIZE = 1000
+
+
+class RunningStats:
+    """
+    Count, mean, variance (Welford), min and max of a stream of values in O(1) memory.
+    """
+
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @classmethod
+    def from_sums(cls, count, total, squares, minimum, maximum):
+        """
+        Build the statistics of values known by their count, sum, sum of squares, min and max.
+        """
+        stats = cls()
+        if count:
+            stats.count = int(count)
+            stats.mean = total / count
+            stats.m2 = max(squares - total * total / count, 0.0)
+            stats.min = minimum
+            stats.max = maximum
+        return stats
+
+    def merge(self, other):
+        """
+        Fold another RunningStats into this one (Chan et al. parallel variance).
+        """
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def summary(self):
+        variance = self.m2 / (self.count - 1) if self.count > 1 else 0.0
+        return {
+            "count": self.count,
+            "mean": self.mean if self.count else None,
+            "variance": variance,
+            "std": math.sqrt(variance),
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+
+class WindowedStats:
+    """
+    RunningStats over a sliding time window, kept as a fixed number of time buckets.
+
+    Readings older than the window are ignored, and a summary merges at most
+    WINDOW_BUCKETS + 1 buckets regardless of how many readings were added.
+    """
+
+    __slots__ = ("bucket_seconds", "buckets", "size", "newest")
+
+    def __init__(self, window_seconds, buckets=WINDOW_BUCKETS):
+        self.bucket_seconds = window_seconds / buckets
+        self.size = buckets
+        self.buckets = {}
+        self.newest = None
+
+    def add(self, epoch_seconds, value):
+        index = int(epoch_seconds // self.bucket_seconds)
+        if self.newest is not None and index <= self.newest - self.size:
+            return
+        stats = self.buckets.get(index)
+        if stats is None:
+            stats = self.buckets[index] = RunningStats()
+            if self.newest is None or index > self.newest:
+                self.newest = index
+                for stale in [bucket for bucket in self.buckets if bucket <= index - self.size]:
+                    del self.buckets[stale]
+        stats.add(value)
+
+    def summary(self, now_seconds):
+        current = int(now_seconds // self.bucket_seconds)
+        total = RunningStats()
+        for index, stats in self.buckets.items():
+            if current - self.size < index <= current:
+                total.merge(stats)
+        return total.summary()
+
+
+class PatientAggregates:
+    """
+    All-time and windowed statistics plus the last reading for one patient.
+
+    The all-time statistics cover every reading still stored: raw readings and the
+    per-minute and per-hour aggregates older ones are downsampled into, until those expire
+    (see retention.py). Diastolic pressure is not downsampled, so its all-time statistics
+    only cover the raw readings, the last HEALTHGUARD_RAW_RETENTION_DAYS.
+    """
+
+    def __init__(self, windows=AGGREGATE_WINDOWS):
+        self.loaded_at = time.monotonic()
+        self.last = None
+        self.all_time = {vital: RunningStats() for vital in AGGREGATE_VITALS}
+        self.windows = {window: {vital: WindowedStats(window) for vital in AGGREGATE_VITALS}
+                        for window in windows}
+
+    def add(self, timestamp, reading):
+        if self.last is None or timestamp >= self.last["timestamp"]:
+            self.last = dict(reading, timestamp=timestamp)
+        values = vital_values(reading)
+        for vital, value in values:
+            self.all_time[vital].add(value)
+        self.add_to_windows(timestamp, values)
+
+    def add_to_windows(self, timestamp, values):
+        epoch_seconds = timestamp.timestamp()
+        for vital, value in values:
+            for window_stats in self.windows.values():
+                window_stats[vital].add(epoch_seconds, value)
+
+    def summary(self, now):
+        now_seconds = now.timestamp()
+        return {
+            "last": self.last,
+            "all_time": {vital: stats.summary() for vital, stats in self.all_time.items()},
+            "windows": {str(window): {vital: stats.summary(now_seconds) for vital, stats in window_stats.items()}
+                        for window, window_stats in self.windows.items()},
+        }
+
+
+def vital_values(reading):
+    """
+    Extract the numeric vitals from a reading, splitting "120/80" blood pressure.
+
+    Returns:
+    A list of (vital, value) pairs for the vitals present and numeric.
+    """
+    values = []
+    for vital in ("heart_rate", "temperature"):
+        value = reading.get(vital)
+        if isinstance(value, (int, float)):
+            values.append((vital, float(value)))
+    blood_pressure = reading.get("blood_pressure")
+    try:
+        if isinstance(blood_pressure, str) and "/" in blood_pressure:
+            systolic, diastolic = blood_pressure.split("/", 1)
+            values.append(("systolic", float(systolic)))
+            values.append(("diastolic", float(diastolic)))
+        elif blood_pressure is not None:
+            values.append(("systolic", float(blood_pressure)))
+    except ValueError:
+        pass
+    return values
+
+
+def vital_sums(count, total, squares, minimum, maximum):
+    return [count, cast(total, Float), cast(squares, Float), cast(minimum, Float), cast(maximum, Float)]
+
+
+def stored_vital_sums(patient_id, dialect_name):
+    """
+    Build a statement summing a patient's stored vitals: one row for the raw readings and
+    one for the downsampled aggregates, each with the count, sum, sum of squares, min and
+    max of every AGGREGATE_VITALS vital in turn.
+    """
+    raw_values = {
+        "heart_rate": HealthData.heart_rate,
+        "systolic": systolic(HealthData.blood_pressure, dialect_name),
+        "diastolic": diastolic(HealthData.blood_pressure, dialect_name),
+        "temperature": HealthData.temperature,
+    }
+    raw = select(*[column for vital in AGGREGATE_VITALS for column in vital_sums(
+        func.count(raw_values[vital]), func.sum(raw_values[vital]), func.sum(raw_values[vital] * raw_values[vital]),
+        func.min(raw_values[vital]), func.max(raw_values[vital]))]).where(HealthData.patient_id == patient_id)
+
+    downsampled_columns = []
+    for vital in AGGREGATE_VITALS:
+        if vital == "diastolic":
+            downsampled_columns += vital_sums(literal(0), null(), null(), null(), null())
+            continue
+        downsampled_columns += vital_sums(
+            func.coalesce(func.sum(HealthDataAggregate.count), 0),
+            func.sum(getattr(HealthDataAggregate, f"{vital}_sum")),
+            func.sum(getattr(HealthDataAggregate, f"{vital}_sum_squares")),
+            func.min(getattr(HealthDataAggregate, f"{vital}_min")),
+            func.max(getattr(HealthDataAggregate, f"{vital}_max")))
+    downsampled = select(*downsampled_columns).where(HealthDataAggregate.patient_id == patient_id)
+    return union_all(raw, downsampled)
+
+
+def load_patient_aggregates(patient_id, windows, now):
+    """
+    Rebuild a patient's aggregates from the database without reading their whole history.
+
+    The all-time statistics are summed by the database, in one statement so that a
+    concurrent compaction is not seen half done. Only the raw readings within the longest
+    window are read, to refill the windows, and the last reading is the newest raw one.
+
+    Returns:
+    A PatientAggregates, or None if the patient has no stored readings.
+    """
+    session = session_factory()
+    aggregates = PatientAggregates(windows)
+    for row in session.execute(stored_vital_sums(patient_id, session.get_bind().dialect.name)):
+        for position, vital in enumerate(AGGREGATE_VITALS):
+            aggregates.all_time[vital].merge(RunningStats.from_sums(*row[position * 5:position * 5 + 5]))
+
+    query = session.query(HealthData.patient_id, HealthData.heart_rate, HealthData.blood_pressure,
+                          HealthData.temperature, HealthData.timestamp).filter(HealthData.patient_id == patient_id)
+    newest = query.order_by(HealthData.timestamp.desc(), HealthData.id.desc()).first()
+    if newest is None and not aggregates.all_time["heart_rate"].count:
+        return None
+    aggregates.last = dict(newest._mapping) if newest is not None else None
+    if windows:
+        recent = query.filter(HealthData.timestamp >= now - timedelta(seconds=max(windows)))
+        for row in recent.order_by(HealthData.timestamp, HealthData.id).yield_per(LOAD_BATCH_SIZE):
+            aggregates.add_to_windows(row.timestamp, vital_values(row._mapping))
+    return aggregates
+
+
+class RollingAggregates:
+    """
+    Per-patient rolling statistics, updated incrementally as readings are ingested.
+
+    The aggregates are a cache over the stored readings: a patient seen for the first time,
+    evicted, or whose readings were deleted is rebuilt from the database on the next
+    summary, and readings ingested meanwhile are left to that rebuild. A rebuild reads the
+    database's sums of the patient's readings and the raw readings within the longest
+    window, never their whole history. A reading committed while its patient is being
+    rebuilt can be counted twice or missed until the next rebuild.
+
+    Args:
+    - windows: The rolling windows, in seconds.
+    - max_patients: The number of patients kept in memory.
+    - ttl: Seconds after which a patient is rebuilt, or 0 to keep patients until evicted.
+    - loader: A function rebuilding a patient's PatientAggregates from the database, given
+      the patient_id, the windows and the current time, or returning None for an unknown
+      patient.
+    """
+
+    def __init__(self, windows=AGGREGATE_WINDOWS, max_patients=AGGREGATE_PATIENTS, ttl=AGGREGATE_TTL,
+                 loader=load_patient_aggregates):
+        self.windows = windows
+        self.max_patients = max_patients
+        self.ttl = ttl
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.patients = OrderedDict()
+        self.evictions = 0
+
+    def add(self, patient_id, timestamp, reading):
+        if patient_id is None:
+            return
+        with self.lock:
+            aggregates = self.patients.get(patient_id)
+            if aggregates is not None:
+                aggregates.add(timestamp, reading)
+
+    def add_many(self, rows):
+        """
+        Add readings given as dictionaries with patient_id and timestamp keys.
+        """
+        for row in rows:
+            self.add(row["patient_id"], row["timestamp"], row)
+
+    def invalidate(self, *patient_ids):
+        """
+        Drop the aggregates of the given patients, e.g. after their readings were deleted.
+        """
+        with self.lock:
+            for patient_id in patient_ids:
+                self.patients.pop(patient_id, None)
+
+    def load(self, patient_id, now):
+        aggregates = self.loader(patient_id, self.windows, now)
+        if aggregates is None:
+            return None
+        with self.lock:
+            self.patients[patient_id] = aggregates
+            while len(self.patients) > self.max_patients:
+                self.patients.popitem(last=False)
+                self.evictions += 1
+        return aggregates
+
+    def summary(self, patient_id, now):
+        with self.lock:
+            aggregates = self.patients.get(patient_id)
+            if aggregates is not None and self.ttl and time.monotonic() - aggregates.loaded_at > self.ttl:
+                aggregates = None
+            if aggregates is not None:
+                self.patients.move_to_end(patient_id)
+                return aggregates.summary(now)
+        aggregates = self.load(patient_id, now)
+        if aggregates is None:
+            return None
+        with self.lock:
+            return aggregates.summary(now)
+
+    def stats(self):
+        with self.lock:
+            return {"patients": len(self.patients), "max_patients": self.max_patients, "ttl": self.ttl,
+                    "evictions": self.evictions}
+
+
+rolling_aggregates = RollingAggregates()
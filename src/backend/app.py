@@ -1,8 +1,41 @@
-from flask import Flask, request, jsonify
+import atexit
+import base64
+import json
+from flask import Flask, Response, request, jsonify
 from datetime import datetime
-from database import session_factory, HealthData
+from sqlalchemy import and_, insert, or_
+from aggregates import rolling_aggregates
+from cache import latest_reading_cache
+from database import engine, init_db, session_factory, pool_status, HealthData
+from export import EXPORT_FORMATS, export_query, pa, record_batches, stream_export
+from ingest_log import INGEST_LOG_DIR, IngestLog
+from metrics import request_metrics
+from retention import COMPACTION_INTERVAL, start_compaction_thread
+from serializers import (HEALTH_DATA_COLUMNS, RESPONSE_FORMATS, json_response, serialize_health_data,
+                         serialize_health_data_rows)
+from streaming import event_stream, vitals_broker
+from validation import validate_health_data_batch
+from sync import (CARE_PLAN_PAGE_SIZE, SyncConflict, apply_chunk, care_plans_since, compress_response, decode_chunk,
+                  load_watermark, save_care_plan)
+
+# Page size limits for the history endpoint
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Number of rows sent to the database per executemany call during batch ingestion
+INSERT_CHUNK_SIZE = 5000
 
 app = Flask(__name__)
+request_metrics.install(app, engine)
+
+# Optional durable ingest log with group commits; its readings become visible in the
+# database once applied, at which point cached latest readings are refreshed
+ingest_log = None
+if INGEST_LOG_DIR:
+    # Recovery replays the log into the database, so its tables must exist first
+    init_db()
+    ingest_log = IngestLog(INGEST_LOG_DIR, on_applied=lambda rows: invalidate_ingested(rows))
+    atexit.register(ingest_log.close)
 
 # Create a route for the root endpoint
 @app.route('/')
@@ -12,70 +45,412 @@ def index():
 # Create a route for the health data endpoint
 @app.route('/health', methods=['GET'])
 def get_health_data():
-    # Retrieve the most recent health data from the database
-    data = session_factory().query(HealthData).order_by(HealthData.timestamp.desc()).first()
+    # Serve the most recent health data from the cache when possible
+    patient_id = request.args.get('patient_id')
+    health_data = latest_reading_cache.get(patient_id)
+    if health_data is not None:
+        return jsonify(health_data)
+
+    # Retrieve the most recent health data from the database, optionally for a single patient;
+    # the generation taken first keeps a concurrent write from being overwritten by this read
+    generation = latest_reading_cache.generation(patient_id)
+    query = session_factory().query(HealthData)
+    if patient_id is not None:
+        query = query.filter(HealthData.patient_id == patient_id)
+    data = query.order_by(HealthData.timestamp.desc()).first()
     if data is None:
         return jsonify({"error": "No health data found"}), 404
 
     # Serialize the health data as JSON
-    health_data = {
-        "heart_rate": data.heart_rate,
-        "blood_pressure": data.blood_pressure,
-        "temperature": data.temperature,
-        "timestamp": data.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-    }
+    health_data = serialize_health_data(data)
+    latest_reading_cache.fill(patient_id, health_data, generation)
     return jsonify(health_data)
 
+def encode_cursor(timestamp, row_id):
+    """
+    Encode the position of the last returned row as an opaque keyset cursor.
+
+    Args:
+    - timestamp: The timestamp of the last returned row.
+    - row_id: The primary key of the last returned row.
+
+    Returns:
+    A URL-safe cursor string.
+    """
+    raw = f"{timestamp.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+    """
+    Decode a keyset cursor produced by encode_cursor.
+
+    Args:
+    - cursor: The cursor string sent by the client.
+
+    Returns:
+    A (timestamp, row_id) tuple.
+
+    Raises:
+    - ValueError: If the cursor is malformed.
+    """
+    timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+# Create a route for a patient's health data history over a time window
+@app.route('/health/history', methods=['GET'])
+def get_health_data_history():
+    # Validate the request arguments
+    patient_id = request.args.get('patient_id')
+    if not patient_id:
+        return jsonify({"error": "patient_id is required"}), 400
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = datetime.fromisoformat(start) if start else None
+        end = datetime.fromisoformat(end) if end else None
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        cursor = request.args.get('cursor')
+        cursor = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "Invalid request arguments"}), 400
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    response_format = request.args.get('format', 'rows')
+    if response_format not in RESPONSE_FORMATS:
+        return jsonify({"error": "Invalid response format"}), 400
+
+    # Range scan on the (patient_id, timestamp, id) index, resuming after the cursor row.
+    # Plain column tuples are selected to skip ORM object construction; the id comes last
+    # so the serializer, which zips against the rendered fields, leaves it out.
+    query = session_factory().query(*HEALTH_DATA_COLUMNS, HealthData.id)
+    query = query.filter(HealthData.patient_id == patient_id)
+    if start is not None:
+        query = query.filter(HealthData.timestamp >= start)
+    if end is not None:
+        query = query.filter(HealthData.timestamp < end)
+    if cursor is not None:
+        cursor_timestamp, cursor_id = cursor
+        query = query.filter(or_(HealthData.timestamp > cursor_timestamp,
+                                 and_(HealthData.timestamp == cursor_timestamp,
+                                      HealthData.id > cursor_id)))
+    rows = query.order_by(HealthData.timestamp, HealthData.id).limit(limit + 1).all()
+
+    # Fetch one extra row to know whether another page exists
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+    health_data = serialize_health_data_rows(rows, response_format)
+    return json_response({"data": health_data, "next_cursor": next_cursor})
+
+# Create a route exporting health data as a Parquet file or an Arrow IPC stream
+@app.route('/health/export', methods=['GET'])
+def export_health_data():
+    if pa is None:
+        return jsonify({"error": "Columnar export requires pyarrow"}), 501
+    export_format = request.args.get('format', 'parquet')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Invalid export format"}), 400
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = datetime.fromisoformat(start) if start else None
+        end = datetime.fromisoformat(end) if end else None
+    except ValueError:
+        return jsonify({"error": "Invalid request arguments"}), 400
+
+    # Rows are streamed from a server-side cursor and encoded one batch at a time
+    query = export_query(request.args.getlist('patient_id'), start, end)
+    extension = "parquet" if export_format == "parquet" else "arrows"
+    return Response(stream_export(record_batches(query), export_format), mimetype=EXPORT_FORMATS[export_format],
+                    headers={"Content-Disposition": f"attachment; filename=health_data.{extension}"})
+
 # Create a route for updating health data
 @app.route('/health', methods=['POST'])
 def update_health_data():
-    # Validate the request data
+    # Validate and normalize the request data
     data = request.get_json()
-    if not data or 'heart_rate' not in data or 'blood_pressure' not in data or 'temperature' not in data:
-        return jsonify({"error": "Invalid request data"}), 400
+    index, row, error = next(validate_health_data_batch([(0, data)], datetime.utcnow()))
+    if error is not None:
+        return jsonify({"error": error}), 400
+
+    health_data, status = ingest_reading(row)
+    return jsonify(health_data), status
 
+def ingest_reading(row):
+    """
+    Store one validated reading and feed it to the live streams, rolling aggregates and
+    latest-reading cache. Shared by the Flask and ASGI servers.
+
+    Args:
+    - row: A dictionary of HealthData column values, as produced by validation.
+
+    Returns:
+    A (serialized reading, status) tuple: 202 once durable in the ingest log, 201 once committed.
+    """
     # Create a new health data object
-    health_data = HealthData(heart_rate=data['heart_rate'],
-                             blood_pressure=data['blood_pressure'],
-                             temperature=data['temperature'],
-                             timestamp=datetime.utcnow())
+    health_data = HealthData(**row)
 
-    # Add the health data object to the database session
-    session_factory().add(health_data)
+    if ingest_log is not None:
+        # Acknowledge once the reading is durable in the ingest log; the writer commits it shortly
+        ingest_log.append([row])
+        status = 202
+    else:
+        # Add the health data object to the current thread's database session
+        session = session_factory()
+        session.add(health_data)
 
-    # Commit the transaction
-    session_factory().commit()
+        # Commit the transaction
+        session.commit()
+        status = 201
+    publish_ingested([row])
 
     # Serialize the health data as JSON
-    health_data = {
-        "heart_rate": health_data.heart_rate,
-        "blood_pressure": health_data.blood_pressure,
-        "temperature": health_data.temperature,
-        "timestamp": health_data.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-    }
-    return jsonify(health_data), 201
+    health_data = serialize_health_data(health_data)
+
+    # Write through to the cache where the new reading is the newest; a reading dated
+    # earlier than the cached one drops the entry instead, to be refilled from the database
+    latest_reading_cache.advance(None, health_data)
+    if row['patient_id'] is not None:
+        latest_reading_cache.advance(row['patient_id'], health_data)
+    return health_data, status
+
+def publish_ingested(rows):
+    """
+    Feed newly accepted readings to the live streams and the rolling aggregates.
+
+    Args:
+    - rows: A list of dictionaries of HealthData column values.
+    """
+    vitals_broker.publish(rows)
+    rolling_aggregates.add_many(rows)
+
+def invalidate_ingested(rows):
+    """
+    Drop the cached latest readings of the patients in rows.
+    """
+    latest_reading_cache.invalidate(None, *{row['patient_id'] for row in rows})
+
+def read_ndjson(stream):
+    """
+    Decode a newline-delimited JSON body line by line without buffering it whole.
+
+    Args:
+    - stream: A binary file-like object yielding lines.
+
+    Returns:
+    A generator of (index, reading) pairs; undecodable lines yield None as the reading.
+    """
+    index = 0
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield index, json.loads(line)
+        except ValueError:
+            yield index, None
+        index += 1
+
+# Create a route for a patient's rolling vital-sign statistics
+@app.route('/health/summary', methods=['GET'])
+def get_health_data_summary():
+    patient_id = request.args.get('patient_id')
+    if not patient_id:
+        return jsonify({"error": "patient_id is required"}), 400
+
+    # Served from the incrementally maintained aggregates, without touching raw rows
+    summary = rolling_aggregates.summary(patient_id, datetime.utcnow())
+    if summary is None:
+        return jsonify({"error": "No health data found"}), 404
+    return json_response(dict(summary, patient_id=patient_id))
+
+# Create a route for ingesting a batch of health data readings
+@app.route('/health/batch', methods=['POST'])
+def update_health_data_batch():
+    # Accept either a JSON array or a streamed NDJSON body
+    if request.mimetype in ('application/x-ndjson', 'application/jsonlines'):
+        items = read_ndjson(request.stream)
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            return jsonify({"error": "Invalid request data"}), 400
+        items = enumerate(data)
+
+    # In ingest log mode, append the valid rows to the log and acknowledge once durable
+    received_at = datetime.utcnow()
+    if ingest_log is not None:
+        accepted = []
+        errors = []
+        for index, row, error in validate_health_data_batch(items, received_at):
+            if error is not None:
+                errors.append({"index": index, "error": error})
+            else:
+                accepted.append(row)
+        if accepted:
+            ingest_log.append(accepted)
+        publish_ingested(accepted)
+        return jsonify({"accepted": len(accepted), "errors": errors}), 202 if accepted else 400
+
+    # Insert valid rows in chunks with executemany, all inside one transaction
+    session = session_factory()
+    inserted = 0
+    errors = []
+    chunk = []
+    accepted = []
+    try:
+        for index, row, error in validate_health_data_batch(items, received_at):
+            if error is not None:
+                errors.append({"index": index, "error": error})
+                continue
+            chunk.append(row)
+            if len(chunk) >= INSERT_CHUNK_SIZE:
+                session.execute(insert(HealthData), chunk)
+                inserted += len(chunk)
+                accepted.extend(chunk)
+                chunk = []
+        if chunk:
+            session.execute(insert(HealthData), chunk)
+            inserted += len(chunk)
+            accepted.extend(chunk)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    publish_ingested(accepted)
+
+    # Batched readings may carry older timestamps, so drop the affected cache entries
+    invalidate_ingested(accepted)
+
+    status = 201 if inserted else 400
+    return jsonify({"inserted": inserted, "errors": errors}), status
+
+# Create a route reporting a field gateway's sync watermark, from which it resumes uploading
+@app.route('/sync/gateways/<gateway_id>', methods=['GET'])
+def get_sync_gateway(gateway_id):
+    return jsonify({"gateway_id": gateway_id, "watermark": load_watermark(session_factory(), gateway_id)})
+
+# Create a route for uploading a chunk of readings a field gateway recorded offline
+@app.route('/sync/gateways/<gateway_id>/readings', methods=['POST'])
+def sync_gateway_readings(gateway_id):
+    try:
+        items = decode_chunk(request.get_data(), request.headers.get('Content-Encoding'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Readings carry the gateway's sequence number and the time they were recorded
+    received_at = datetime.utcnow()
+    entries = [(item.get('sequence') if isinstance(item, dict) else None, row, error)
+               for (index, row, error), item in zip(validate_health_data_batch(enumerate(items), received_at), items)]
+    try:
+        result, rows = apply_chunk(session_factory(), gateway_id, entries, received_at)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except SyncConflict as e:
+        return jsonify({"error": str(e), "watermark": e.watermark}), 409
+    publish_ingested(rows)
+    invalidate_ingested(rows)
+    return jsonify(result)
+
+# Create a route for storing a patient's care plan for distribution to field gateways
+@app.route('/care-plans/<patient_id>', methods=['PUT'])
+def update_care_plan(patient_id):
+    plan = request.get_json(silent=True)
+    if not isinstance(plan, dict):
+        return jsonify({"error": "Invalid request data"}), 400
+    version = save_care_plan(session_factory(), patient_id, plan, datetime.utcnow())
+    return jsonify({"patient_id": patient_id, "version": version})
+
+# Create a route for field gateways to download the care plans changed since their last sync
+@app.route('/sync/care-plans', methods=['GET'])
+def get_changed_care_plans():
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', CARE_PLAN_PAGE_SIZE)), CARE_PLAN_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "since and limit must be integers"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    plans, has_more = care_plans_since(session_factory(), since, limit, request.args.getlist('patient_id'))
+    version = plans[-1]["version"] if plans else since
+    response = json_response({"care_plans": plans, "version": version, "has_more": has_more})
+    return compress_response(response, 'gzip' in request.accept_encodings)
+
+# Create a route streaming newly committed health data as server-sent events
+@app.route('/health/stream', methods=['GET'])
+def stream_health_data():
+    # Repeat patient_id to follow several patients; omit it to follow everyone
+    subscription = vitals_broker.subscribe(request.args.getlist('patient_id'))
+    return Response(event_stream(vitals_broker, subscription),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # Create a route for deleting health data
 @app.route('/health', methods=['DELETE'])
 def delete_health_data():
     # Retrieve the most recent health data from the database
-    data = session_factory().query(HealthData).order_by(HealthData.timestamp.desc()).first()
+    session = session_factory()
+    data = session.query(HealthData).order_by(HealthData.timestamp.desc()).first()
     if data is None:
         return jsonify({"error": "No health data found"}), 404
 
     # Delete the health data object from the database session
-    session_factory().delete(data)
+    patient_id = data.patient_id
+    session.delete(data)
 
     # Commit the transaction
-    session_factory().commit()
+    session.commit()
+    latest_reading_cache.invalidate(None, patient_id)
+    rolling_aggregates.invalidate(patient_id)
 
     return jsonify({"message": "Health data deleted"})
 
-# Close the database session when the application shuts down
+# Create a route exposing request latency, database and serialization metrics
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify({
+        "routes": request_metrics.summary(),
+        "ingest_log": ingest_log.stats() if ingest_log is not None else None,
+        "db_pool": pool_status(),
+        "cache": latest_reading_cache.stats(),
+        "aggregates": rolling_aggregates.stats(),
+        "stream": vitals_broker.stats()
+    })
+
+# Create a route listing recent slow requests, with profiles when they were sampled
+@app.route('/metrics/slow', methods=['GET'])
+def get_slow_requests():
+    return jsonify(request_metrics.slow_request_samples())
+
+# Create a route exposing connection pool metrics for monitoring
+@app.route('/metrics/db-pool', methods=['GET'])
+def get_db_pool_metrics():
+    return jsonify(pool_status())
+
+# Create a route exposing live stream statistics for monitoring
+@app.route('/metrics/stream', methods=['GET'])
+def get_stream_metrics():
+    return jsonify(vitals_broker.stats())
+
+# Create a route exposing latest-reading cache statistics for monitoring
+@app.route('/metrics/cache', methods=['GET'])
+def get_cache_metrics():
+    return jsonify(latest_reading_cache.stats())
+
+# Create the database tables, e.g. before starting the app under a WSGI server
+@app.cli.command('init-db')
+def init_db_command():
+    init_db()
+
+# Return the request's database session to the registry once the request is done
 @app.teardown_appcontext
 def shutdown_session(exception=None):
-    session_factory().remove()
+    session_factory.remove()
 
 # Run the application
 if __name__ == '__main__':
+    init_db()
+    if COMPACTION_INTERVAL > 0:
+        start_compaction_thread(COMPACTION_INTERVAL)
     app.run(debug=True)
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from aggregates import rolling_aggregates
+from app import ingest_reading
+from cache import latest_reading_cache
+from database import (DATABASE_URL, POOL_MAX_OVERFLOW, POOL_PRE_PING, POOL_RECYCLE, POOL_SIZE,
+                      POOL_TIMEOUT, HealthData, init_db, session_factory)
+from serializers import dumps, serialize_health_data
+from validation import validate_health_data_batch
+
+# Async drivers used in place of the synchronous DBAPI for each backend
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+# Maximum number of requests allowed to talk to the database at the same time;
+# further requests stay connected and wait for a slot instead of exhausting the pool
+MAX_CONCURRENCY = int(os.environ.get("HEALTHGUARD_MAX_CONCURRENCY", POOL_SIZE + POOL_MAX_OVERFLOW))
+
+
+def to_async_url(url):
+    """
+    Rewrite a database URL to use the async driver for its backend.
+
+    Args:
+    - url: The synchronous database URL.
+
+    Returns:
+    A SQLAlchemy URL using an async driver.
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_async_database_engine(url):
+    """
+    Create an async engine with the same pool tuning as the synchronous backend.
+
+    Args:
+    - url: The database URL.
+
+    Returns:
+    A SQLAlchemy AsyncEngine.
+    """
+    url = to_async_url(url)
+    options = {"pool_pre_ping": POOL_PRE_PING, "pool_recycle": POOL_RECYCLE}
+    if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+        options.update(pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+    return create_async_engine(url, **options)
+
+
+async_engine = create_async_database_engine(os.environ.get("HEALTHGUARD_ASYNC_DATABASE_URL", DATABASE_URL))
+async_session_factory = async_sessionmaker(async_engine, expire_on_commit=False)
+db_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+
+async def read_body(receive):
+    """
+    Read the full request body from an ASGI receive channel.
+    """
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def send_json(send, payload, status=200):
+    """
+    Send a JSON response over an ASGI send channel.
+    """
+    body = dumps(payload)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def latest_health_data(session, patient_id=None):
+    query = select(HealthData)
+    if patient_id is not None:
+        query = query.where(HealthData.patient_id == patient_id)
+    result = await session.execute(query.order_by(HealthData.timestamp.desc()).limit(1))
+    return result.scalars().first()
+
+
+async def cache_call(method, *args):
+    # The shared cache is a SQLite file, so its calls are kept off the event loop
+    if latest_reading_cache.shared:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+
+async def get_health_data(scope, receive):
+    # Serve the most recent health data from the cache shared with the Flask route when possible
+    args = parse_qs(scope.get("query_string", b"").decode())
+    patient_id = args.get("patient_id", [None])[0]
+    health_data = await cache_call(latest_reading_cache.get, patient_id)
+    if health_data is not None:
+        return health_data, 200
+
+    # Retrieve the most recent health data from the database, optionally for a single patient;
+    # the generation taken first keeps a concurrent write from being overwritten by this read
+    generation = await cache_call(latest_reading_cache.generation, patient_id)
+    async with db_semaphore, async_session_factory() as session:
+        data = await latest_health_data(session, patient_id)
+    if data is None:
+        return {"error": "No health data found"}, 404
+    health_data = serialize_health_data(data)
+    await cache_call(latest_reading_cache.fill, patient_id, health_data, generation)
+    return health_data, 200
+
+
+async def update_health_data(scope, receive):
+    # Validate the request data
+    try:
+        data = json.loads(await read_body(receive))
+    except ValueError:
+        data = None
+    index, row, error = next(validate_health_data_batch([(0, data)], datetime.utcnow()))
+    if error is not None:
+        return {"error": error}, 400
+
+    # Stored through the same path as the Flask route, so the ingest log, cache, live
+    # streams and rolling aggregates see the reading whichever server received it
+    async with db_semaphore:
+        return await asyncio.to_thread(ingest_in_thread, row)
+
+
+def ingest_in_thread(row):
+    try:
+        return ingest_reading(row)
+    finally:
+        # Worker threads are reused, so release the thread's scoped session after each call
+        session_factory.remove()
+
+
+async def delete_health_data(scope, receive):
+    # Delete the most recent health data in the same transaction that finds it
+    async with db_semaphore, async_session_factory() as session:
+        data = await latest_health_data(session)
+        if data is None:
+            return {"error": "No health data found"}, 404
+        await session.delete(data)
+        await session.commit()
+    latest_reading_cache.invalidate(None, data.patient_id)
+    rolling_aggregates.invalidate(data.patient_id)
+    return {"message": "Health data deleted"}, 200
+
+
+async def index(scope, receive):
+    return "Welcome to the HealthGuard Refugee Initiative backend!", 200
+
+
+ROUTES = {
+    ("GET", "/"): index,
+    ("GET", "/health"): get_health_data,
+    ("POST", "/health"): update_health_data,
+    ("DELETE", "/health"): delete_health_data,
+}
+
+
+async def app(scope, receive, send):
+    """
+    ASGI entry point serving the /health contract of the Flask backend asynchronously.
+
+    Run with an ASGI server, e.g. `uvicorn asgi:app --app-dir src/backend`.
+    """
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await asyncio.to_thread(init_db)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await async_engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is None:
+        methods = [method for method, path in ROUTES if path == scope["path"]]
+        if methods:
+            await send_json(send, {"error": "Method not allowed"}, 405)
+        else:
+            await send_json(send, {"error": "Not found"}, 404)
+        return
+
+    payload, status = await handler(scope, receive)
+    if isinstance(payload, str):
+        body = payload.encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/html; charset=utf-8"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+    else:
+        await send_json(send, payload, status)
+
+
+# Run the application
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
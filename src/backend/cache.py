@@ -0,0 +1,259 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Maximum number of patients kept in the in-process cache and how long entries stay fresh
+CACHE_SIZE = int(os.environ.get("HEALTHGUARD_CACHE_SIZE", 10000))
+CACHE_TTL = float(os.environ.get("HEALTHGUARD_CACHE_TTL", 60))
+
+# Optional SQLite file shared by all worker processes on the same host
+SHARED_CACHE_PATH = os.environ.get("HEALTHGUARD_SHARED_CACHE_PATH")
+
+
+class SharedReadingStore:
+    """
+    A key/value store in a local SQLite file, shared by the worker processes on one host.
+
+    Every key carries a version bumped by each write and invalidation; invalidated keys
+    keep a row with no value, so a fill started before an invalidation can tell it happened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        connection = self.connect()
+        connection.execute("CREATE TABLE IF NOT EXISTS cached_reading "
+                           "(key TEXT PRIMARY KEY, value TEXT, expires REAL NOT NULL, version INTEGER NOT NULL)")
+        connection.commit()
+
+    def connect(self):
+        # sqlite3 connections cannot be shared between threads, so keep one per thread
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            self.local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self.connect().execute("SELECT value, expires FROM cached_reading WHERE key = ?",
+                                     (key,)).fetchone()
+        if row is None or row[0] is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def version(self, key):
+        row = self.connect().execute("SELECT version FROM cached_reading WHERE key = ?", (key,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def set(self, key, value, ttl):
+        connection = self.connect()
+        connection.execute("INSERT INTO cached_reading (key, value, expires, version) VALUES (?, ?, ?, 1) "
+                           "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires, "
+                           "version = cached_reading.version + 1",
+                           (key, json.dumps(value), time.time() + ttl))
+        connection.commit()
+
+    def fill(self, key, value, ttl, version):
+        # Store only if the key has not been written or invalidated since version was read
+        connection = self.connect()
+        if version == 0:
+            connection.execute("INSERT OR IGNORE INTO cached_reading (key, value, expires, version) "
+                               "VALUES (?, ?, ?, 0)", (key, json.dumps(value), time.time() + ttl))
+        else:
+            connection.execute("UPDATE cached_reading SET value = ?, expires = ? WHERE key = ? AND version = ?",
+                               (json.dumps(value), time.time() + ttl, key, version))
+        connection.commit()
+
+    def advance(self, key, value, ttl):
+        # Replace a live entry holding an older reading; anything else is invalidated
+        connection = self.connect()
+        updated = connection.execute(
+            "UPDATE cached_reading SET value = ?, expires = ?, version = version + 1 "
+            "WHERE key = ? AND value IS NOT NULL AND expires >= ? AND json_extract(value, '$.timestamp') <= ?",
+            (json.dumps(value), time.time() + ttl, key, time.time(), value["timestamp"])).rowcount
+        connection.commit()
+        if not updated:
+            self.delete([key])
+
+    def delete(self, keys):
+        connection = self.connect()
+        connection.executemany("INSERT INTO cached_reading (key, value, expires, version) VALUES (?, NULL, 0, 1) "
+                               "ON CONFLICT (key) DO UPDATE SET value = NULL, version = cached_reading.version + 1",
+                               [(key,) for key in keys])
+        connection.commit()
+
+    def clear(self):
+        connection = self.connect()
+        connection.execute("UPDATE cached_reading SET value = NULL, version = version + 1")
+        connection.commit()
+
+
+class LatestReadingCache:
+    """
+    An LRU cache of each patient's most recent serialized reading, with TTL expiry.
+
+    Keys are patient IDs; None stands for the newest reading across all patients. With a
+    shared path, the cache lives only in the SQLite file, so a write or invalidation in one
+    worker process is seen by all of them at once.
+
+    Reads that miss fill the cache from the database with fill(), passing the generation
+    taken before the query; the fill is dropped if the key was written or invalidated in
+    the meantime, so a slow read never replaces a newer reading with the one it found.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL, shared_path=SHARED_CACHE_PATH):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.shared = SharedReadingStore(shared_path) if shared_path else None
+        # Generation of the last write or invalidation of recently changed keys; older
+        # keys fall back to the newest generation forgotten, which only makes fills stricter
+        self.counter = 0
+        self.generations = OrderedDict()
+        self.forgotten = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def shared_key(patient_id):
+        return "latest" if patient_id is None else f"patient:{patient_id}"
+
+    def get(self, patient_id):
+        """
+        Return the cached reading for a patient, or None on a miss.
+        """
+        if self.shared:
+            value = self.shared.get(self.shared_key(patient_id))
+            with self.lock:
+                if value is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            return value
+
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(patient_id)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self.entries.move_to_end(patient_id)
+                    self.hits += 1
+                    return value
+                del self.entries[patient_id]
+            self.misses += 1
+        return None
+
+    def generation(self, patient_id):
+        """
+        Return the current generation of a patient's entry, to pass to fill().
+        """
+        if self.shared:
+            return self.shared.version(self.shared_key(patient_id))
+        with self.lock:
+            return self.generations.get(patient_id, self.forgotten)
+
+    def set(self, patient_id, value):
+        """
+        Cache the newest reading for a patient.
+        """
+        if self.shared:
+            self.shared.set(self.shared_key(patient_id), value, self.ttl)
+            return
+        with self.lock:
+            self.bump(patient_id)
+            self.store(patient_id, value, time.monotonic())
+
+    def advance(self, patient_id, value):
+        """
+        Cache a newly stored reading if the cached one is not newer, or else drop the entry.
+
+        A new reading is not necessarily a patient's newest: it may carry an older
+        timestamp. Readings are compared by their serialized "timestamp" field.
+        """
+        if self.shared:
+            self.shared.advance(self.shared_key(patient_id), value, self.ttl)
+            return
+        now = time.monotonic()
+        with self.lock:
+            self.bump(patient_id)
+            entry = self.entries.get(patient_id)
+            if entry is not None and entry[1] > now and entry[0]["timestamp"] <= value["timestamp"]:
+                self.store(patient_id, value, now)
+            else:
+                self.entries.pop(patient_id, None)
+
+    def fill(self, patient_id, value, generation):
+        """
+        Cache a reading read from the database, unless the entry changed since generation.
+        """
+        if self.shared:
+            self.shared.fill(self.shared_key(patient_id), value, self.ttl, generation)
+            return
+        with self.lock:
+            if self.generations.get(patient_id, self.forgotten) == generation:
+                self.store(patient_id, value, time.monotonic())
+
+    def bump(self, patient_id):
+        # Callers must hold the lock
+        self.counter += 1
+        self.generations[patient_id] = self.counter
+        self.generations.move_to_end(patient_id)
+        while len(self.generations) > self.max_size:
+            _, generation = self.generations.popitem(last=False)
+            self.forgotten = max(self.forgotten, generation)
+
+    def store(self, patient_id, value, now):
+        # Callers must hold the lock
+        self.entries[patient_id] = (value, now + self.ttl)
+        self.entries.move_to_end(patient_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *patient_ids):
+        """
+        Drop the cached readings for the given patients.
+        """
+        if self.shared:
+            self.shared.delete([self.shared_key(patient_id) for patient_id in patient_ids])
+            return
+        with self.lock:
+            for patient_id in patient_ids:
+                self.bump(patient_id)
+                self.entries.pop(patient_id, None)
+
+    def clear(self):
+        if self.shared:
+            self.shared.clear()
+            return
+        with self.lock:
+            # Every key's generation changes, so fills in flight are dropped
+            self.counter += 1
+            self.generations.clear()
+            self.forgotten = self.counter
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "shared": self.shared is not None,
+            }
+
+
+latest_reading_cache = LatestReadingCache()
@@ -0,0 +1,121 @@
+import os
+
+from sqlalchemy import select
+
+from database import HealthData, engine
+from serializers import HEALTH_DATA_COLUMNS, HEALTH_DATA_FIELDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow is only needed for columnar exports
+    pa = pq = None
+
+# Rows fetched from the database and written per Parquet row group or Arrow record batch
+EXPORT_BATCH_ROWS = int(os.environ.get("HEALTHGUARD_EXPORT_BATCH_ROWS", 50000))
+
+# Export formats and their media types
+EXPORT_FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def health_data_schema():
+    types = {
+        "patient_id": pa.string(),
+        "heart_rate": pa.float64(),
+        "blood_pressure": pa.string(),
+        "temperature": pa.float64(),
+        "timestamp": pa.timestamp("us"),
+    }
+    return pa.schema([(field, types[field]) for field in HEALTH_DATA_FIELDS])
+
+
+class ChunkSink:
+    """
+    A write-only file object collecting what the Arrow writers emit until it is drained.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_query(patient_ids=None, start=None, end=None):
+    """
+    Build the export query, ordered to follow the (patient_id, timestamp, id) index.
+    """
+    query = select(*HEALTH_DATA_COLUMNS)
+    if patient_ids:
+        query = query.where(HealthData.patient_id.in_(patient_ids))
+    if start is not None:
+        query = query.where(HealthData.timestamp >= start)
+    if end is not None:
+        query = query.where(HealthData.timestamp < end)
+    return query.order_by(HealthData.patient_id, HealthData.timestamp, HealthData.id)
+
+
+def record_batches(query, bind=engine, batch_rows=EXPORT_BATCH_ROWS):
+    """
+    Run the export query on a streaming cursor and convert it to Arrow record batches.
+
+    Returns:
+    A generator of pyarrow.RecordBatch, holding at most batch_rows rows in memory at a time.
+    """
+    schema = health_data_schema()
+    with bind.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=batch_rows).execute(query)
+        for rows in result.partitions(batch_rows):
+            columns = zip(*rows)
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+
+
+def stream_export(batches, export_format):
+    """
+    Encode record batches as a Parquet file or an Arrow IPC stream, chunk by chunk.
+
+    Args:
+    - batches: An iterable of pyarrow.RecordBatch with the health data schema.
+    - export_format: One of EXPORT_FORMATS.
+
+    Returns:
+    A generator of bytes, one chunk per record batch plus the file footer.
+    """
+    sink = ChunkSink()
+    schema = health_data_schema()
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    try:
+        for batch in batches:
+            writer.write_batch(batch)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    yield sink.drain()
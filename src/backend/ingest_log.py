@@ -0,0 +1,327 @@
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from database import PATIENT_ID_MAX_LENGTH, HealthData, IngestCheckpoint, engine
+from serializers import dumps
+
+# Directory holding the ingest log segments; unset keeps synchronous commits per request
+INGEST_LOG_DIR = os.environ.get("HEALTHGUARD_INGEST_LOG_DIR")
+
+# The background writer commits when this many rows are pending or this many ms have passed
+GROUP_COMMIT_ROWS = int(os.environ.get("HEALTHGUARD_GROUP_COMMIT_ROWS", 5000))
+GROUP_COMMIT_MS = float(os.environ.get("HEALTHGUARD_GROUP_COMMIT_MS", 50))
+
+# Appenders waiting for durability are released together by one fsync every this many ms
+FSYNC_INTERVAL_MS = float(os.environ.get("HEALTHGUARD_FSYNC_INTERVAL_MS", 2))
+
+# A new log segment is started once the current one grows past this size
+SEGMENT_BYTES = int(os.environ.get("HEALTHGUARD_INGEST_SEGMENT_BYTES", 64 * 1024 * 1024))
+
+CHECKPOINT_NAME = "ingest_log"
+
+# Readings the database rejects are moved to this file in the log directory, one JSON line each
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+# Seconds the writer waits before retrying after the database could not be reached
+RETRY_SECONDS = 1
+
+# Database errors that say nothing about the rows themselves, so applying them is retried
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+logger = logging.getLogger(__name__)
+
+
+def check_row(row):
+    """
+    Check that a row has the HealthData columns with values the database accepts, so a
+    malformed reading is rejected before it is logged rather than blocking the writer.
+
+    Raises:
+    - ValueError: If the row is malformed.
+    """
+    if not isinstance(row, dict) or set(row) != {"patient_id", "heart_rate", "blood_pressure", "temperature",
+                                                 "timestamp"}:
+        raise ValueError("Ingest log rows need exactly the HealthData columns")
+    patient_id = row["patient_id"]
+    if patient_id is not None and not (isinstance(patient_id, str) and len(patient_id) <= PATIENT_ID_MAX_LENGTH):
+        raise ValueError(f"patient_id must be a string of at most {PATIENT_ID_MAX_LENGTH} characters")
+    for column in ("heart_rate", "temperature"):
+        value = row[column]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{column} must be a finite number")
+    if not (isinstance(row["blood_pressure"], str) and len(row["blood_pressure"]) <= 16):
+        raise ValueError("blood_pressure must be a string of at most 16 characters")
+    if not isinstance(row["timestamp"], datetime):
+        raise ValueError("timestamp must be a datetime")
+
+
+class IngestLog:
+    """
+    A durable append-only log in front of the HealthData table.
+
+    Requests append their readings to the log and are acknowledged once the log is
+    fsynced; fsyncs are shared by all appenders that arrive within FSYNC_INTERVAL_MS.
+    A background writer inserts pending readings in group commits and records the last
+    applied sequence number in the same transaction. On startup, readings in the log
+    past that checkpoint are replayed, and fully applied segments are deleted.
+
+    When the database rejects a group commit for a reason other than being unreachable,
+    its readings are applied one at a time and those still rejected are moved to the
+    dead-letter file, so one bad reading never holds back the ones logged after it.
+    """
+
+    def __init__(self, directory, bind=engine, on_applied=None, group_commit_rows=GROUP_COMMIT_ROWS,
+                 group_commit_ms=GROUP_COMMIT_MS, fsync_interval_ms=FSYNC_INTERVAL_MS,
+                 segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.bind = bind
+        self.on_applied = on_applied
+        self.group_commit_rows = group_commit_rows
+        self.group_commit_seconds = group_commit_ms / 1000
+        self.fsync_seconds = fsync_interval_ms / 1000
+        self.segment_bytes = segment_bytes
+
+        self.lock = threading.Lock()
+        self.durable = threading.Condition(self.lock)
+        self.pending_ready = threading.Condition(self.lock)
+        self.pending = []
+        self.sequence = 0
+        self.written_sequence = 0
+        self.durable_sequence = 0
+        self.segment = None
+        self.segments = []
+        self.running = True
+        self.dead_letters = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.recover()
+        self.open_segment()
+        self.flusher = threading.Thread(target=self.run_flusher, name="healthguard-ingest-fsync", daemon=True)
+        self.writer = threading.Thread(target=self.run_writer, name="healthguard-ingest-writer", daemon=True)
+        self.flusher.start()
+        self.writer.start()
+
+    def segment_path(self, first_sequence):
+        return os.path.join(self.directory, f"ingest-{first_sequence:020d}.log")
+
+    def open_segment(self):
+        # Callers must hold the lock, except during construction
+        path = self.segment_path(self.sequence + 1)
+        self.segment = open(path, "ab")
+        self.segments.append((self.sequence + 1, path))
+
+    def append(self, rows):
+        """
+        Append readings to the log and wait until they are durable.
+
+        Args:
+        - rows: A list of dictionaries of HealthData column values.
+
+        Returns:
+        The sequence number of the last appended reading.
+
+        Raises:
+        - ValueError: If a row is malformed; nothing is appended then.
+        """
+        for row in rows:
+            check_row(row)
+        with self.lock:
+            if not self.running:
+                raise RuntimeError("Ingest log is closed")
+            for row in rows:
+                self.sequence += 1
+                self.segment.write(dumps({"sequence": self.sequence, "row": row}) + b"\n")
+                self.pending.append((self.sequence, row))
+            sequence = self.written_sequence = self.sequence
+            if len(self.pending) >= self.group_commit_rows:
+                self.pending_ready.notify()
+            while self.durable_sequence < sequence:
+                self.durable.wait()
+        return sequence
+
+    def run_flusher(self):
+        while True:
+            time.sleep(self.fsync_seconds)
+            with self.lock:
+                if self.written_sequence == self.durable_sequence:
+                    if not self.running:
+                        return
+                    continue
+                self.segment.flush()
+                os.fsync(self.segment.fileno())
+                self.durable_sequence = self.written_sequence
+                self.durable.notify_all()
+                if self.segment.tell() >= self.segment_bytes:
+                    self.segment.close()
+                    self.open_segment()
+
+    def run_writer(self):
+        while True:
+            with self.lock:
+                if self.running and len(self.pending) < self.group_commit_rows:
+                    self.pending_ready.wait(self.group_commit_seconds)
+                # Only durable readings may reach the database, so a crash can always replay them
+                ready = [entry for entry in self.pending if entry[0] <= self.durable_sequence]
+                if not ready and self.pending:
+                    self.durable.wait(self.fsync_seconds)
+                    continue
+                self.pending = self.pending[len(ready):]
+                stopping = not self.running and not self.pending
+            if ready:
+                try:
+                    self.apply_or_dead_letter(ready)
+                except Exception:
+                    # Keep the readings queued and retry; they are safe in the log meanwhile
+                    logger.exception("Error applying ingest log entries, retrying in %s s", RETRY_SECONDS)
+                    with self.lock:
+                        self.pending = ready + self.pending
+                    time.sleep(RETRY_SECONDS)
+                    continue
+            if stopping:
+                return
+
+    def apply_or_dead_letter(self, entries):
+        """
+        Apply entries in one transaction, or one at a time if the database rejects them,
+        moving the entries it still rejects to the dead-letter file.
+
+        Raises:
+        The database error if it was transient, with the entries applied so far committed.
+        """
+        try:
+            self.apply(entries)
+            return
+        except TRANSIENT_ERRORS:
+            raise
+        except Exception:
+            logger.warning("Group commit of %d ingest log entries failed, applying them one at a time",
+                           len(entries))
+        for entry in entries:
+            try:
+                self.apply([entry])
+            except TRANSIENT_ERRORS:
+                raise
+            except Exception as e:
+                self.dead_letter(entry, e)
+
+    def dead_letter(self, entry, error):
+        """
+        Move an entry to the dead-letter file and advance the checkpoint past it.
+        """
+        sequence, row = entry
+        logger.error("Moving ingest log entry %d to %s: %s", sequence, DEAD_LETTER_FILE, error)
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), "ab") as f:
+            f.write(json.dumps({"sequence": sequence, "row": row, "error": str(error),
+                                "failed_at": datetime.utcnow().isoformat()}, default=str).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with self.bind.begin() as connection:
+            self.save_checkpoint(connection, sequence)
+        self.remove_applied_segments(sequence)
+        with self.lock:
+            self.dead_letters += 1
+
+    def apply(self, entries):
+        """
+        Insert log entries and advance the checkpoint in a single transaction.
+        """
+        rows = [row for sequence, row in entries]
+        with self.bind.begin() as connection:
+            connection.execute(insert(HealthData), rows)
+            self.save_checkpoint(connection, entries[-1][0])
+        self.remove_applied_segments(entries[-1][0])
+        if self.on_applied is not None:
+            self.on_applied(rows)
+
+    @staticmethod
+    def load_checkpoint(connection):
+        sequence = connection.execute(select(IngestCheckpoint.sequence).where(
+            IngestCheckpoint.name == CHECKPOINT_NAME)).scalar()
+        return sequence or 0
+
+    @staticmethod
+    def save_checkpoint(connection, sequence):
+        updated = connection.execute(update(IngestCheckpoint).where(
+            IngestCheckpoint.name == CHECKPOINT_NAME).values(sequence=sequence)).rowcount
+        if not updated:
+            connection.execute(insert(IngestCheckpoint).values(name=CHECKPOINT_NAME, sequence=sequence))
+
+    def remove_applied_segments(self, applied_sequence):
+        # A segment is fully applied once the next segment starts at or before the checkpoint + 1
+        with self.lock:
+            while len(self.segments) > 1 and self.segments[1][0] <= applied_sequence + 1:
+                first_sequence, path = self.segments.pop(0)
+                os.remove(path)
+
+    def recover(self):
+        """
+        Replay readings logged after the database checkpoint, then drop the old segments.
+        """
+        with self.bind.connect() as connection:
+            checkpoint = self.load_checkpoint(connection)
+        self.sequence = checkpoint
+        entries = []
+        paths = sorted(glob.glob(os.path.join(self.directory, "ingest-*.log")))
+        for path in paths:
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn write at the tail of the log was never acknowledged
+                        break
+                    if not isinstance(entry, dict) or not isinstance(entry.get("sequence"), int):
+                        logger.error("Skipping ingest log line without a sequence number in %s", path)
+                        continue
+                    if entry["sequence"] > checkpoint:
+                        row = entry.get("row")
+                        try:
+                            row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+                            check_row(row)
+                        except (KeyError, TypeError, ValueError) as e:
+                            # Apply the entries before it first, so the checkpoint only moves forward
+                            self.replay(entries)
+                            entries = []
+                            self.dead_letter((entry["sequence"], row), e)
+                        else:
+                            entries.append((entry["sequence"], row))
+                    self.sequence = max(self.sequence, entry["sequence"])
+        self.replay(entries)
+        for path in paths:
+            os.remove(path)
+        self.written_sequence = self.durable_sequence = self.sequence
+
+    def replay(self, entries):
+        for start in range(0, len(entries), self.group_commit_rows):
+            self.apply_or_dead_letter(entries[start:start + self.group_commit_rows])
+
+    def close(self):
+        """
+        Stop accepting readings and apply everything still pending.
+        """
+        with self.lock:
+            self.running = False
+            self.pending_ready.notify()
+        self.writer.join()
+        self.flusher.join()
+        with self.lock:
+            self.segment.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sequence": self.sequence,
+                "durable_sequence": self.durable_sequence,
+                "pending": len(self.pending),
+                "segments": len(self.segments),
+                "dead_letters": self.dead_letters,
+            }
@@ -0,0 +1,217 @@
+import bisect
+import cProfile
+import functools
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+
+# Requests slower than this are kept as slow-request samples
+SLOW_REQUEST_SECONDS = float(os.environ.get("HEALTHGUARD_SLOW_REQUEST_MS", 500)) / 1000
+
+# Fraction of requests run under cProfile; 0 disables profiling entirely
+PROFILE_SAMPLE_RATE = float(os.environ.get("HEALTHGUARD_PROFILE_SAMPLE_RATE", 0))
+
+# Number of slow-request samples retained
+SLOW_REQUEST_HISTORY = int(os.environ.get("HEALTHGUARD_SLOW_REQUEST_HISTORY", 20))
+
+# Histogram bucket upper bounds in seconds: 50us to about 2 minutes in 25% steps
+HISTOGRAM_BOUNDS = tuple(0.00005 * 1.25 ** i for i in range(67))
+
+
+class LatencyHistogram:
+    """
+    A fixed-bucket latency histogram with constant memory and O(log buckets) inserts.
+
+    Percentiles are reported as the upper bound of the bucket they fall in (capped at the
+    observed maximum), so they overestimate by at most one bucket width (25%).
+    """
+
+    def __init__(self, bounds=HISTOGRAM_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+
+class RouteStats:
+    """
+    Aggregated timings for one route and method.
+    """
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.queries = 0
+        self.errors = 0
+
+    def summary(self):
+        count = self.latency.count or 1
+        return {
+            "count": self.latency.count,
+            "errors": self.errors,
+            "latency_ms": {
+                "mean": self.latency.total / count * 1000,
+                "p50": self.latency.percentile(0.50) * 1000,
+                "p95": self.latency.percentile(0.95) * 1000,
+                "p99": self.latency.percentile(0.99) * 1000,
+                "max": self.latency.max * 1000,
+            },
+            "db_time_ms_mean": self.db_time / count * 1000,
+            "serialization_time_ms_mean": self.serialization_time / count * 1000,
+            "queries_mean": self.queries / count,
+        }
+
+
+class RequestTimings:
+    """
+    Timings accumulated while a single request is being handled.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.queries = 0
+        self.query_start = None
+        self.profiler = None
+
+
+class RequestMetrics:
+    """
+    Collects per-route latency histograms, DB and serialization time and query counts.
+    """
+
+    def __init__(self, slow_seconds=SLOW_REQUEST_SECONDS, sample_rate=PROFILE_SAMPLE_RATE,
+                 history=SLOW_REQUEST_HISTORY):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.routes = {}
+        self.slow_seconds = slow_seconds
+        self.sample_rate = sample_rate
+        self.slow_requests = deque(maxlen=history)
+
+    def current(self):
+        return getattr(self.local, "timings", None)
+
+    def install(self, app, engine):
+        """
+        Register the request hooks on a Flask app and the query hooks on an engine.
+        """
+        from flask import request
+
+        @app.before_request
+        def start_request_timing():
+            timings = RequestTimings()
+            if self.sample_rate and random.random() < self.sample_rate:
+                timings.profiler = cProfile.Profile()
+                timings.profiler.enable()
+            self.local.timings = timings
+
+        @app.after_request
+        def finish_request_timing(response):
+            timings = self.current()
+            if timings is None:
+                return response
+            self.local.timings = None
+            rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            self.record(f"{request.method} {rule}", timings, response.status_code)
+            return response
+
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        timings = self.current()
+        if timings is not None:
+            timings.query_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        timings = self.current()
+        if timings is not None and timings.query_start is not None:
+            timings.db_time += time.perf_counter() - timings.query_start
+            timings.queries += 1
+            timings.query_start = None
+
+    def add_serialization_time(self, seconds):
+        timings = self.current()
+        if timings is not None:
+            timings.serialization_time += seconds
+
+    def record(self, route, timings, status_code):
+        elapsed = time.perf_counter() - timings.start
+        profile = None
+        if timings.profiler is not None:
+            timings.profiler.disable()
+            if elapsed >= self.slow_seconds:
+                output = io.StringIO()
+                pstats.Stats(timings.profiler, stream=output).sort_stats("cumulative").print_stats(15)
+                profile = output.getvalue()
+
+        with self.lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = RouteStats()
+            stats.latency.record(elapsed)
+            stats.db_time += timings.db_time
+            stats.serialization_time += timings.serialization_time
+            stats.queries += timings.queries
+            if status_code >= 500:
+                stats.errors += 1
+            if elapsed >= self.slow_seconds:
+                self.slow_requests.append({
+                    "route": route,
+                    "latency_ms": elapsed * 1000,
+                    "db_time_ms": timings.db_time * 1000,
+                    "queries": timings.queries,
+                    "profile": profile,
+                })
+
+    def summary(self):
+        with self.lock:
+            return {route: stats.summary() for route, stats in sorted(self.routes.items())}
+
+    def slow_request_samples(self):
+        with self.lock:
+            return list(self.slow_requests)
+
+
+request_metrics = RequestMetrics()
+
+
+def timed_serialization(func):
+    """
+    Decorator adding the wrapped function's run time to the request's serialization time.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            request_metrics.add_serialization_time(time.perf_counter() - start)
+    return wrapper
@@ -0,0 +1,196 @@
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import Float, cast, delete, func, insert, literal, select, text
+
+from database import (HealthData, HealthDataAggregate, engine, ensure_partitions, health_data_partitions, next_month,
+                      uses_partitioned_storage)
+
+# How long each resolution is kept: raw readings are downsampled to per-minute aggregates,
+# per-minute aggregates are rolled up to per-hour ones, and hourly ones are finally dropped
+RAW_RETENTION = timedelta(days=float(os.environ.get("HEALTHGUARD_RAW_RETENTION_DAYS", 7)))
+MINUTE_RETENTION = timedelta(days=float(os.environ.get("HEALTHGUARD_MINUTE_RETENTION_DAYS", 90)))
+HOUR_RETENTION = timedelta(days=float(os.environ.get("HEALTHGUARD_HOUR_RETENTION_DAYS", 730)))
+
+# Seconds between background compaction runs; 0 leaves compaction to `python retention.py`
+COMPACTION_INTERVAL = float(os.environ.get("HEALTHGUARD_COMPACTION_INTERVAL", 0))
+
+# Bucket formats matching SQLAlchemy's SQLite datetime storage format
+SQLITE_BUCKET_FORMATS = {
+    "minute": "%Y-%m-%d %H:%M:00.000000",
+    "hour": "%Y-%m-%d %H:00:00.000000",
+}
+
+PARTITION_NAME = re.compile(r"^health_data_p(\d{4})(\d{2})$")
+
+logger = logging.getLogger(__name__)
+
+AGGREGATE_COLUMNS = ("patient_id", "resolution", "bucket_start", "count",
+                     "heart_rate_sum", "heart_rate_sum_squares", "heart_rate_min", "heart_rate_max",
+                     "systolic_sum", "systolic_sum_squares", "systolic_min", "systolic_max",
+                     "temperature_sum", "temperature_sum_squares", "temperature_min", "temperature_max")
+
+
+def bucket_start(column, resolution, dialect_name):
+    """
+    Build a SQL expression truncating a timestamp column to the start of its bucket.
+
+    Args:
+    - column: The timestamp column.
+    - resolution: "minute" or "hour".
+    - dialect_name: The name of the database dialect.
+
+    Returns:
+    A SQL expression.
+    """
+    if dialect_name == "postgresql":
+        return func.date_trunc(resolution, column)
+    if dialect_name == "sqlite":
+        return func.strftime(SQLITE_BUCKET_FORMATS[resolution], column)
+    raise ValueError(f"Downsampling is not supported on {dialect_name}")
+
+
+def systolic(column, dialect_name):
+    """
+    Build a SQL expression extracting the systolic value of a "120/80" or "120" blood pressure.
+    """
+    if dialect_name == "postgresql":
+        return cast(func.split_part(column, "/", 1), Float)
+    return cast(func.substr(column, 1, func.instr(column + "/", "/") - 1), Float)
+
+
+def diastolic(column, dialect_name):
+    """
+    Build a SQL expression extracting the diastolic value of a "120/80" blood pressure, NULL
+    for a bare systolic one.
+    """
+    if dialect_name == "postgresql":
+        return cast(func.nullif(func.split_part(column, "/", 2), ""), Float)
+    return cast(func.nullif(func.substr(column, func.instr(column, "/") + 1), column), Float)
+
+
+def drop_expired_partitions(connection, cutoff):
+    """
+    Drop every monthly partition whose whole range is older than the cutoff.
+
+    Returns:
+    The names of the dropped partitions.
+    """
+    partitions = health_data_partitions(connection)
+    dropped = []
+    for name in partitions:
+        match = PARTITION_NAME.match(name)
+        if match and next_month(datetime(int(match.group(1)), int(match.group(2)), 1)) <= cutoff:
+            connection.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    return dropped
+
+
+def downsample_raw(connection, cutoff):
+    """
+    Fold raw readings older than the cutoff into per-minute aggregates and remove them.
+
+    Returns:
+    A (rows_removed, partitions_dropped) tuple.
+    """
+    bucket = bucket_start(HealthData.timestamp, "minute", connection.dialect.name)
+    systolic_value = systolic(HealthData.blood_pressure, connection.dialect.name)
+    aggregates = select(
+        HealthData.patient_id, literal("minute"), bucket, func.count(),
+        func.sum(HealthData.heart_rate), func.sum(HealthData.heart_rate * HealthData.heart_rate),
+        func.min(HealthData.heart_rate), func.max(HealthData.heart_rate),
+        func.sum(systolic_value), func.sum(systolic_value * systolic_value),
+        func.min(systolic_value), func.max(systolic_value),
+        func.sum(HealthData.temperature), func.sum(HealthData.temperature * HealthData.temperature),
+        func.min(HealthData.temperature), func.max(HealthData.temperature),
+    ).where(HealthData.timestamp < cutoff).group_by(HealthData.patient_id, bucket)
+    connection.execute(insert(HealthDataAggregate).from_select(AGGREGATE_COLUMNS, aggregates))
+
+    # Whole expired months are dropped in O(1); the rest is a range delete on the timestamp index
+    dropped = drop_expired_partitions(connection, cutoff) if uses_partitioned_storage(connection) else []
+    removed = connection.execute(delete(HealthData).where(HealthData.timestamp < cutoff)).rowcount
+    return removed, dropped
+
+
+def rollup_minutes(connection, cutoff):
+    """
+    Merge per-minute aggregates older than the cutoff into per-hour aggregates.
+
+    Returns:
+    The number of per-minute rows removed.
+    """
+    minute = HealthDataAggregate.resolution == "minute"
+    bucket = bucket_start(HealthDataAggregate.bucket_start, "hour", connection.dialect.name)
+    aggregates = select(
+        HealthDataAggregate.patient_id, literal("hour"), bucket, func.sum(HealthDataAggregate.count),
+        func.sum(HealthDataAggregate.heart_rate_sum), func.sum(HealthDataAggregate.heart_rate_sum_squares),
+        func.min(HealthDataAggregate.heart_rate_min), func.max(HealthDataAggregate.heart_rate_max),
+        func.sum(HealthDataAggregate.systolic_sum), func.sum(HealthDataAggregate.systolic_sum_squares),
+        func.min(HealthDataAggregate.systolic_min), func.max(HealthDataAggregate.systolic_max),
+        func.sum(HealthDataAggregate.temperature_sum), func.sum(HealthDataAggregate.temperature_sum_squares),
+        func.min(HealthDataAggregate.temperature_min), func.max(HealthDataAggregate.temperature_max),
+    ).where(minute, HealthDataAggregate.bucket_start < cutoff).group_by(HealthDataAggregate.patient_id, bucket)
+    connection.execute(insert(HealthDataAggregate).from_select(AGGREGATE_COLUMNS, aggregates))
+    return connection.execute(delete(HealthDataAggregate).where(
+        minute, HealthDataAggregate.bucket_start < cutoff)).rowcount
+
+
+def compact(now=None, bind=engine):
+    """
+    Run one retention pass: downsample old raw readings, roll up old minutes and drop
+    expired hourly aggregates, each stage in its own transaction.
+
+    Args:
+    - now: The reference time, defaulting to the current UTC time.
+    - bind: The engine to compact.
+
+    Returns:
+    A dictionary describing what was compacted.
+    """
+    now = now or datetime.utcnow()
+
+    # Cutoffs fall on hour boundaries so no minute or hour bucket is split between runs
+    def cutoff(retention):
+        return (now - retention).replace(minute=0, second=0, microsecond=0)
+
+    result = {}
+    with bind.begin() as connection:
+        if uses_partitioned_storage(connection):
+            ensure_partitions(connection, now)
+        result["raw_rows_removed"], result["partitions_dropped"] = downsample_raw(connection, cutoff(RAW_RETENTION))
+    with bind.begin() as connection:
+        result["minute_rows_removed"] = rollup_minutes(connection, cutoff(MINUTE_RETENTION))
+    with bind.begin() as connection:
+        result["hour_rows_removed"] = connection.execute(delete(HealthDataAggregate).where(
+            HealthDataAggregate.resolution == "hour",
+            HealthDataAggregate.bucket_start < cutoff(HOUR_RETENTION))).rowcount
+    return result
+
+
+def start_compaction_thread(interval=COMPACTION_INTERVAL, bind=engine):
+    """
+    Run compact() every interval seconds on a daemon thread. A failed pass, e.g. on a
+    locked database, is logged and retried at the next interval.
+
+    Returns:
+    A threading.Event that stops the thread when set.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                compact(bind=bind)
+            except Exception:
+                logger.exception("Compaction failed")
+
+    threading.Thread(target=run, name="healthguard-compaction", daemon=True).start()
+    return stop
+
+
+# Run a single compaction pass, e.g. from cron
+if __name__ == '__main__':
+    print(compact())
@@ -0,0 +1,91 @@
+import json
+
+from flask import Response
+
+from database import HealthData
+from metrics import timed_serialization
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speedup
+    orjson = None
+
+# Fields rendered for a HealthData row, in column order
+HEALTH_DATA_FIELDS = ("patient_id", "heart_rate", "blood_pressure", "temperature", "timestamp")
+
+# Columns to select so rows come back as plain tuples instead of ORM objects
+HEALTH_DATA_COLUMNS = tuple(getattr(HealthData, field) for field in HEALTH_DATA_FIELDS)
+
+# Fields and timestamp format of the single-reading /health responses
+LEGACY_FIELDS = ("heart_rate", "blood_pressure", "temperature", "timestamp")
+LEGACY_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Response formats accepted by list endpoints
+RESPONSE_FORMATS = ("rows", "columns")
+
+
+def default_encoder(obj):
+    # Datetimes are rendered as ISO 8601, matching orjson's native output
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+@timed_serialization
+def dumps(payload):
+    """
+    Encode a payload as JSON bytes, using orjson when it is installed.
+
+    Args:
+    - payload: A JSON-compatible value; datetimes are rendered in ISO 8601.
+
+    Returns:
+    The encoded JSON as bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=default_encoder, separators=(",", ":")).encode()
+
+
+def json_response(payload, status=200):
+    """
+    Build a Flask JSON response with the fast encoder.
+    """
+    return Response(dumps(payload), status=status, mimetype="application/json")
+
+
+@timed_serialization
+def serialize_health_data(data, fields=LEGACY_FIELDS, timestamp_format=LEGACY_TIMESTAMP_FORMAT):
+    """
+    Render a single HealthData object as a dictionary.
+
+    Args:
+    - data: A HealthData object.
+    - fields: The fields to include.
+    - timestamp_format: A strftime format for the timestamp, or None to keep the datetime for ISO encoding.
+
+    Returns:
+    A dictionary mapping field names to values.
+    """
+    health_data = {field: getattr(data, field) for field in fields}
+    if timestamp_format is not None and "timestamp" in health_data:
+        health_data["timestamp"] = health_data["timestamp"].strftime(timestamp_format)
+    return health_data
+
+
+@timed_serialization
+def serialize_health_data_rows(rows, response_format="rows"):
+    """
+    Render HealthData column tuples selected with HEALTH_DATA_COLUMNS.
+
+    Args:
+    - rows: A sequence of tuples in HEALTH_DATA_FIELDS order.
+    - response_format: "rows" for a list of objects, or "columns" for one array per field.
+
+    Returns:
+    A list of dictionaries, or a dictionary of lists for the columnar format.
+    """
+    if response_format == "columns":
+        columns = list(zip(*rows)) if rows else [()] * len(HEALTH_DATA_FIELDS)
+        return {field: list(values) for field, values in zip(HEALTH_DATA_FIELDS, columns)}
+    return [dict(zip(HEALTH_DATA_FIELDS, row)) for row in rows]
@@ -0,0 +1,310 @@
+"""
+Shared-nothing multi-process deployment sharded by patient ID.
+
+Each worker process runs the backend app against its own database and owns the patients
+whose ID hashes to its shard. A lightweight router process accepts the public /health API,
+forwards patient-scoped requests to the owning shard, splits batches per shard and fans
+out the few requests that are not patient-scoped. Gateway sync is not sharded and is
+rejected by the router.
+
+Start a cluster with four shards, each with its own SQLite file:
+
+    python sharding.py --shards 4 --database-url "sqlite:///healthguard-shard{shard}.db"
+"""
+import argparse
+import hashlib
+import http.client
+import json
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from flask import Flask, Response, request, jsonify
+
+# Default database URL template for worker shards; {shard} is replaced by the shard number
+SHARD_DATABASE_URL = os.environ.get("HEALTHGUARD_SHARD_DATABASE_URL", "sqlite:///healthguard-shard{shard}.db")
+
+# Headers that must not be copied between the client and shard connections
+HOP_BY_HOP_HEADERS = ("connection", "content-length", "transfer-encoding", "keep-alive")
+
+# Methods a shard request can be retried with after its connection failed mid-request;
+# DELETE /health removes the newest reading, so even DELETE must not be sent twice
+RETRYABLE_METHODS = ("GET", "HEAD")
+
+# Exceptions raised when a shard cannot be reached or drops the connection
+SHARD_ERRORS = (OSError, http.client.HTTPException)
+
+
+def shard_for(patient_id, shard_count):
+    """
+    Map a patient ID to a shard with a hash that is stable across processes and restarts.
+
+    Args:
+    - patient_id: The patient ID, or None for readings without one.
+    - shard_count: The number of shards.
+
+    Returns:
+    The shard number, between 0 and shard_count - 1.
+    """
+    digest = hashlib.blake2b(str(patient_id or "").encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+class HttpShardClient:
+    """
+    Forwards requests to one worker shard over keep-alive HTTP connections, one per thread.
+    """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(self.host, self.port)
+        return connection
+
+    def request(self, method, path, body=None, headers=None, stream=False):
+        """
+        Send a request to the shard.
+
+        Returns:
+        A (status, headers, body) tuple; body is a file-like response when stream is True.
+        """
+        headers = dict(headers or {})
+        if stream:
+            # Streams hold their connection open, so they get a dedicated one
+            connection = http.client.HTTPConnection(self.host, self.port)
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.getheaders(), response
+        sent = False
+        try:
+            connection = self.connection()
+            connection.request(method, path, body=body, headers=headers)
+            sent = True
+            response = connection.getresponse()
+        except SHARD_ERRORS:
+            # The keep-alive connection went stale; retry once on a fresh one, unless the
+            # shard may already have acted on a request that is not safe to repeat
+            self.local.connection = None
+            if sent and method not in RETRYABLE_METHODS:
+                raise
+            connection = self.connection()
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+        return response.status, response.getheaders(), response.read()
+
+
+def create_router(shards):
+    """
+    Create the router app forwarding the /health API to the given shards.
+
+    Args:
+    - shards: A list of shard clients, indexed by shard number.
+
+    Returns:
+    A Flask app.
+    """
+    router = Flask(__name__)
+    executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(shards)))
+
+    def forward(shard, method, path, body=None, content_type=None):
+        headers = {"Content-Type": content_type} if content_type else {}
+        try:
+            return shards[shard].request(method, path, body=body, headers=headers)
+        except SHARD_ERRORS:
+            return 502, [("Content-Type", "application/json")], json.dumps({"error": f"Shard {shard} unavailable"})
+
+    def fan_out(method, path):
+        return list(executor.map(lambda shard: forward(shard, method, path), range(len(shards))))
+
+    def proxy_response(status, headers, body):
+        headers = [(name, value) for name, value in headers if name.lower() not in HOP_BY_HOP_HEADERS]
+        return Response(body, status=status, headers=headers)
+
+    def current_path():
+        query = request.query_string.decode()
+        return request.path + ("?" + query if query else "")
+
+    def newest_reading_shard():
+        # Ask every shard for its newest reading and pick the most recent one
+        newest = None
+        for shard, (status, headers, body) in enumerate(fan_out("GET", "/health")):
+            if status == 200:
+                reading = json.loads(body)
+                if newest is None or reading["timestamp"] > newest[1]["timestamp"]:
+                    newest = (shard, reading)
+        return newest
+
+    @router.route('/')
+    def index():
+        return "Welcome to the HealthGuard Refugee Initiative backend!"
+
+    @router.route('/health', methods=['GET'])
+    @router.route('/health/history', methods=['GET'])
+    @router.route('/health/summary', methods=['GET'])
+    def route_patient_query():
+        patient_id = request.args.get('patient_id')
+        if patient_id is None and request.path == '/health':
+            newest = newest_reading_shard()
+            if newest is None:
+                return jsonify({"error": "No health data found"}), 404
+            return jsonify(newest[1])
+        return proxy_response(*forward(shard_for(patient_id, len(shards)), "GET", current_path()))
+
+    @router.route('/health/stream', methods=['GET'])
+    @router.route('/health/export', methods=['GET'])
+    def route_stream():
+        owners = {shard_for(patient_id, len(shards)) for patient_id in request.args.getlist('patient_id')}
+        if len(owners) != 1:
+            return jsonify({"error": "Requested patients must belong to a single shard"}), 400
+        shard = owners.pop()
+        try:
+            status, headers, response = shards[shard].request("GET", current_path(), stream=True)
+        except SHARD_ERRORS:
+            return jsonify({"error": f"Shard {shard} unavailable"}), 502
+        if request.path == '/health/export':
+            return proxy_response(status, headers, iter(lambda: response.read(65536), b""))
+        return proxy_response(status, headers, iter(lambda: response.readline(), b""))
+
+    @router.route('/sync/<path:path>', methods=['GET', 'POST'])
+    @router.route('/care-plans/<path:path>', methods=['PUT'])
+    def reject_sync(path):
+        # A gateway's chunks and watermark, and the care plan version sequence, would span shards
+        return jsonify({"error": "Gateway sync is not supported in multi-worker mode"}), 501
+
+    @router.route('/health', methods=['POST'])
+    def route_update():
+        data = request.get_json(silent=True)
+        patient_id = data.get('patient_id') if isinstance(data, dict) else None
+        return proxy_response(*forward(shard_for(patient_id, len(shards)), "POST", "/health",
+                                       request.get_data(), "application/json"))
+
+    @router.route('/health/batch', methods=['POST'])
+    def route_batch():
+        if request.mimetype in ('application/x-ndjson', 'application/jsonlines'):
+            items = []
+            for line in request.get_data().splitlines():
+                if line.strip():
+                    try:
+                        items.append(json.loads(line))
+                    except ValueError:
+                        items.append(None)
+        else:
+            items = request.get_json(silent=True)
+            if not isinstance(items, list):
+                return jsonify({"error": "Invalid request data"}), 400
+
+        # Split the batch per shard, remembering each item's position in the original batch
+        batches = {}
+        for index, item in enumerate(items):
+            patient_id = item.get('patient_id') if isinstance(item, dict) else None
+            positions, sub_batch = batches.setdefault(shard_for(patient_id, len(shards)), ([], []))
+            positions.append(index)
+            sub_batch.append(item)
+
+        def send(shard):
+            positions, sub_batch = batches[shard]
+            status, headers, body = forward(shard, "POST", "/health/batch", json.dumps(sub_batch),
+                                            "application/json")
+            try:
+                result = json.loads(body)
+            except ValueError:
+                result = None
+            if status >= 500 or not isinstance(result, dict):
+                # The shard failed, e.g. with an HTML error page: every item it was sent failed
+                message = f"Shard {shard} failed with status {status}"
+                result = {"errors": [{"index": index, "error": message} for index in range(len(positions))]}
+            return shard, status, positions, result
+
+        # Shards running with an ingest log report readings as accepted rather than inserted
+        counts = {}
+        errors = []
+        shard_statuses = {}
+        for shard, shard_status, positions, result in executor.map(send, list(batches)):
+            shard_statuses[str(shard)] = shard_status
+            for key in ("inserted", "accepted"):
+                if key in result:
+                    counts[key] = counts.get(key, 0) + result[key]
+            errors.extend({"index": positions[error["index"]], "error": error["error"]}
+                          for error in result.get("errors", []))
+        errors.sort(key=lambda error: error["index"])
+        if any(counts.values()):
+            status = 202 if "accepted" in counts else 201
+        else:
+            status = 502 if any(shard_status >= 500 for shard_status in shard_statuses.values()) else 400
+        return jsonify(dict(counts or {"inserted": 0}, errors=errors, shards=shard_statuses)), status
+
+    @router.route('/health', methods=['DELETE'])
+    def route_delete():
+        newest = newest_reading_shard()
+        if newest is None:
+            return jsonify({"error": "No health data found"}), 404
+        return proxy_response(*forward(newest[0], "DELETE", "/health"))
+
+    @router.route('/metrics', methods=['GET'])
+    def route_metrics():
+        return jsonify({"shards": [json.loads(body) if status == 200 else {"error": f"Status {status}"}
+                                   for status, headers, body in fan_out("GET", "/metrics")]})
+
+    return router
+
+
+def run_worker(shard, port, database_url):
+    """
+    Run one worker shard; the backend reads its configuration at import time.
+
+    Background compaction runs in every worker with its own database, and only in shard
+    0 when all shards share one database.
+    """
+    os.environ["HEALTHGUARD_DATABASE_URL"] = database_url.format(shard=shard)
+    if os.environ.get("HEALTHGUARD_SHARED_CACHE_PATH"):
+        os.environ["HEALTHGUARD_SHARED_CACHE_PATH"] += f".shard{shard}"
+    from app import app
+    from database import init_db
+    from retention import COMPACTION_INTERVAL, start_compaction_thread
+
+    init_db()
+    if COMPACTION_INTERVAL > 0 and ("{shard}" in database_url or shard == 0):
+        start_compaction_thread(COMPACTION_INTERVAL)
+    app.run(host="127.0.0.1", port=port, threaded=True)
+
+
+def run_cluster(shard_count, router_port, worker_base_port, database_url=SHARD_DATABASE_URL):
+    """
+    Start the worker shards as separate processes and serve the router in this one.
+    """
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for shard in range(shard_count):
+        worker = context.Process(target=run_worker, args=(shard, worker_base_port + shard, database_url),
+                                 name=f"healthguard-shard{shard}", daemon=True)
+        worker.start()
+        workers.append(worker)
+
+    shards = [HttpShardClient(f"http://127.0.0.1:{worker_base_port + shard}") for shard in range(shard_count)]
+    try:
+        create_router(shards).run(host="0.0.0.0", port=router_port, threaded=True)
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+
+# Run a sharded cluster
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Run the backend as patient-sharded worker processes")
+    parser.add_argument("--shards", type=int, default=os.cpu_count())
+    parser.add_argument("--port", type=int, default=5000, help="router port")
+    parser.add_argument("--worker-base-port", type=int, default=5100)
+    parser.add_argument("--database-url", default=SHARD_DATABASE_URL,
+                        help="database URL template, {shard} is replaced by the shard number")
+    args = parser.parse_args()
+    run_cluster(args.shards, args.port, args.worker_base_port, args.database_url)
@@ -0,0 +1,142 @@
+import os
+import queue
+import threading
+
+from serializers import dumps
+
+# Readings buffered per subscriber before the oldest ones are dropped
+STREAM_QUEUE_SIZE = int(os.environ.get("HEALTHGUARD_STREAM_QUEUE_SIZE", 1000))
+
+# Seconds between keep-alive comments on idle streams
+STREAM_HEARTBEAT = float(os.environ.get("HEALTHGUARD_STREAM_HEARTBEAT", 15))
+
+
+class Subscription:
+    """
+    A subscriber's bounded queue of readings, optionally filtered to some patients.
+
+    When the subscriber falls behind, the oldest readings are dropped so that a slow
+    client never blocks ingestion or grows memory without bound.
+    """
+
+    def __init__(self, patient_ids=None, max_size=STREAM_QUEUE_SIZE):
+        self.patient_ids = frozenset(patient_ids) if patient_ids else None
+        self.queue = queue.Queue(maxsize=max_size)
+        self.dropped = 0
+
+    def put(self, reading):
+        while True:
+            try:
+                self.queue.put_nowait(reading)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        """
+        Wait for the next reading, returning None if none arrives within the timeout.
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class VitalsBroker:
+    """
+    Fans newly committed readings out to live subscribers, indexed by patient ID.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_patient = {}
+        self.all_patients = set()
+
+    def subscribe(self, patient_ids=None, max_size=STREAM_QUEUE_SIZE):
+        subscription = Subscription(patient_ids, max_size)
+        with self.lock:
+            if subscription.patient_ids is None:
+                self.all_patients.add(subscription)
+            else:
+                for patient_id in subscription.patient_ids:
+                    self.by_patient.setdefault(patient_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if subscription.patient_ids is None:
+                self.all_patients.discard(subscription)
+                return
+            for patient_id in subscription.patient_ids:
+                subscribers = self.by_patient.get(patient_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.by_patient[patient_id]
+
+    def has_subscribers(self):
+        return bool(self.all_patients or self.by_patient)
+
+    def publish(self, readings):
+        """
+        Deliver readings to every subscriber interested in their patient.
+
+        Args:
+        - readings: An iterable of dictionaries with at least a "patient_id" key.
+        """
+        if not self.has_subscribers():
+            return
+        with self.lock:
+            all_patients = list(self.all_patients)
+            by_patient = {patient_id: list(subscribers) for patient_id, subscribers in self.by_patient.items()}
+        for reading in readings:
+            for subscription in all_patients:
+                subscription.put(reading)
+            for subscription in by_patient.get(reading.get("patient_id"), ()):
+                subscription.put(reading)
+
+    def stats(self):
+        with self.lock:
+            subscriptions = set(self.all_patients).union(*self.by_patient.values())
+            return {
+                "subscribers": len(subscriptions),
+                "patients": len(self.by_patient),
+                "queued": sum(subscription.queue.qsize() for subscription in subscriptions),
+                "dropped": sum(subscription.dropped for subscription in subscriptions),
+            }
+
+
+def event_stream(broker, subscription, heartbeat=STREAM_HEARTBEAT):
+    """
+    Generate server-sent events for a subscription until the client disconnects.
+
+    Args:
+    - broker: The broker the subscription belongs to.
+    - subscription: The subscription to drain.
+    - heartbeat: Seconds between keep-alive comments when no readings arrive.
+
+    Returns:
+    A generator of SSE-formatted strings.
+    """
+    reported_drops = 0
+    try:
+        yield ": connected\n\n"
+        while True:
+            reading = subscription.get(heartbeat)
+            if subscription.dropped != reported_drops:
+                # Tell the client it fell behind so it can backfill from /health/history
+                yield f"event: dropped\ndata: {subscription.dropped - reported_drops}\n\n"
+                reported_drops = subscription.dropped
+            if reading is None:
+                yield ": heartbeat\n\n"
+                continue
+            yield f"event: reading\ndata: {dumps(reading).decode()}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+vitals_broker = VitalsBroker()
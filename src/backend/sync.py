@@ -0,0 +1,237 @@
+"""
+Offline-first delta sync between field gateways and the central backend.
+
+A gateway numbers the readings it records 1, 2, 3, ... and, whenever it has connectivity,
+uploads them in compressed chunks starting after the watermark the backend last
+acknowledged. A chunk's readings and the new watermark are committed in one transaction,
+so an upload interrupted at any point is resumed by asking for the watermark and
+re-sending from there: readings at or below the watermark are skipped, never duplicated.
+The watermark only ever covers consecutive sequence numbers, so readings after a gap in a
+chunk are left for the gateway to re-send.
+In the other direction, gateways download the care plans changed since the last care
+plan version they saw.
+"""
+import gzip
+import json
+import os
+import zlib
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from database import CarePlan, HealthData, SyncGateway
+from serializers import dumps
+
+# Most readings accepted in one chunk; gateways split larger backlogs into several chunks
+SYNC_CHUNK_ROWS = int(os.environ.get("HEALTHGUARD_SYNC_CHUNK_ROWS", 10000))
+
+# Largest decompressed chunk body, so a small upload cannot inflate without bound
+SYNC_CHUNK_BYTES = int(os.environ.get("HEALTHGUARD_SYNC_CHUNK_BYTES", 16 * 1024 * 1024))
+
+# Care plans returned per download page
+CARE_PLAN_PAGE_SIZE = int(os.environ.get("HEALTHGUARD_CARE_PLAN_PAGE_SIZE", 500))
+
+# Responses smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+# Care plan saves that lose the race for a version number are retried this many times
+CARE_PLAN_SAVE_ATTEMPTS = 3
+
+CONCURRENT_UPLOAD = "Another upload from this gateway committed first"
+
+
+class SyncConflict(Exception):
+    """
+    Raised when a chunk does not continue from the gateway's watermark.
+
+    Attributes:
+    - watermark: The gateway's current watermark, from which it should resume.
+    """
+
+    def __init__(self, message, watermark):
+        super().__init__(message)
+        self.watermark = watermark
+
+
+def decode_chunk(body, content_encoding=None):
+    """
+    Decode an uploaded chunk: a JSON array or NDJSON body, optionally gzip-compressed.
+
+    Args:
+    - body: The raw request body.
+    - content_encoding: The request's Content-Encoding header.
+
+    Returns:
+    A list of decoded readings; undecodable NDJSON lines are returned as None.
+
+    Raises:
+    - ValueError: If the body cannot be decompressed or decoded, or is too large.
+    """
+    if content_encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, SYNC_CHUNK_BYTES)
+        except zlib.error:
+            raise ValueError("Invalid gzip data")
+        if decompressor.unconsumed_tail:
+            raise ValueError("Chunk too large")
+        if not decompressor.eof:
+            raise ValueError("Truncated gzip data")
+    elif content_encoding not in (None, "", "identity"):
+        raise ValueError("Unsupported Content-Encoding")
+    elif len(body) > SYNC_CHUNK_BYTES:
+        raise ValueError("Chunk too large")
+
+    if body.lstrip().startswith(b"["):
+        items = json.loads(body)
+    else:
+        items = []
+        for line in body.splitlines():
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    items.append(None)
+    if len(items) > SYNC_CHUNK_ROWS:
+        raise ValueError(f"Chunks are limited to {SYNC_CHUNK_ROWS} readings")
+    return items
+
+
+def load_watermark(session, gateway_id):
+    watermark = session.execute(select(SyncGateway.watermark).where(
+        SyncGateway.gateway_id == gateway_id)).scalar()
+    return watermark or 0
+
+
+def apply_chunk(session, gateway_id, entries, now):
+    """
+    Insert a gateway's chunk of readings and advance its watermark in one transaction.
+
+    Args:
+    - session: The database session.
+    - gateway_id: The uploading gateway.
+    - entries: A list of (sequence, row, error) tuples in upload order, where row is a dict
+      of HealthData column values, or None when error describes why the reading is invalid.
+    - now: The time of the upload.
+
+    Returns:
+    A (result, rows) tuple: a dictionary with the new watermark, the inserted, duplicate
+    and invalid reading counts and the number of readings deferred because they follow a
+    gap in the chunk, and the list of inserted rows. Only readings that continue without a
+    gap from the watermark are committed; the gateway re-sends the rest from the watermark.
+
+    Raises:
+    - ValueError: If sequence numbers are missing or not strictly increasing.
+    - SyncConflict: If the chunk's first new reading does not follow the watermark, or
+      another upload from the same gateway committed first.
+    """
+    previous = 0
+    for sequence, row, error in entries:
+        if type(sequence) is not int or sequence <= previous:
+            raise ValueError("Readings need strictly increasing positive sequence numbers")
+        previous = sequence
+
+    try:
+        watermark = load_watermark(session, gateway_id)
+
+        # Readings at or below the watermark were committed by an earlier upload
+        fresh = [entry for entry in entries if entry[0] > watermark]
+        if fresh and fresh[0][0] != watermark + 1:
+            raise SyncConflict("Chunk does not continue from the watermark", watermark)
+
+        # Commit only the readings up to the first gap, so the watermark never skips one
+        contiguous = next((index for index, entry in enumerate(fresh) if entry[0] != watermark + 1 + index),
+                          len(fresh))
+        deferred = len(fresh) - contiguous
+        fresh = fresh[:contiguous]
+        rows = [row for sequence, row, error in fresh if error is None]
+        errors = [{"sequence": sequence, "error": error} for sequence, row, error in fresh if error is not None]
+        if rows:
+            session.execute(insert(HealthData), rows)
+        if fresh:
+            # Invalid readings advance the watermark too, so they are reported once instead of blocking the gateway
+            new_watermark = fresh[-1][0]
+            if watermark:
+                updated = session.execute(update(SyncGateway).where(
+                    SyncGateway.gateway_id == gateway_id, SyncGateway.watermark == watermark).values(
+                    watermark=new_watermark, updated_at=now)).rowcount
+            else:
+                updated = session.execute(insert(SyncGateway).values(
+                    gateway_id=gateway_id, watermark=new_watermark, updated_at=now)).rowcount
+            if not updated:
+                session.rollback()
+                raise SyncConflict(CONCURRENT_UPLOAD, load_watermark(session, gateway_id))
+            watermark = new_watermark
+        session.commit()
+    except IntegrityError:
+        # A concurrent first upload from the same gateway created its watermark row
+        session.rollback()
+        raise SyncConflict(CONCURRENT_UPLOAD, load_watermark(session, gateway_id))
+    except Exception:
+        session.rollback()
+        raise
+
+    result = {"watermark": watermark, "inserted": len(rows),
+              "duplicates": len(entries) - len(fresh) - deferred, "deferred": deferred, "errors": errors}
+    return result, rows
+
+
+def save_care_plan(session, patient_id, plan, now):
+    """
+    Store a patient's care plan under the next care plan version.
+
+    Returns:
+    The new version number.
+    """
+    for attempt in range(CARE_PLAN_SAVE_ATTEMPTS):
+        version = (session.execute(select(func.max(CarePlan.version))).scalar() or 0) + 1
+        care_plan = session.get(CarePlan, patient_id)
+        if care_plan is None:
+            session.add(CarePlan(patient_id=patient_id, plan=dumps(plan).decode(), version=version, updated_at=now))
+        else:
+            care_plan.plan = dumps(plan).decode()
+            care_plan.version = version
+            care_plan.updated_at = now
+        try:
+            session.commit()
+            return version
+        except IntegrityError:
+            # A concurrent save took the same version number
+            session.rollback()
+            if attempt == CARE_PLAN_SAVE_ATTEMPTS - 1:
+                raise
+
+
+def care_plans_since(session, since, limit=CARE_PLAN_PAGE_SIZE, patient_ids=None):
+    """
+    Fetch the care plans changed after a version, oldest change first.
+
+    Args:
+    - session: The database session.
+    - since: The last care plan version the gateway has seen.
+    - limit: The maximum number of plans to return.
+    - patient_ids: Optionally, the patients the gateway serves.
+
+    Returns:
+    A (plans, has_more) tuple, where plans is a list of dictionaries.
+    """
+    query = select(CarePlan).where(CarePlan.version > since)
+    if patient_ids:
+        query = query.where(CarePlan.patient_id.in_(patient_ids))
+    care_plans = session.execute(query.order_by(CarePlan.version).limit(limit + 1)).scalars().all()
+    plans = [{"patient_id": care_plan.patient_id, "version": care_plan.version,
+              "plan": json.loads(care_plan.plan), "updated_at": care_plan.updated_at}
+             for care_plan in care_plans[:limit]]
+    return plans, len(care_plans) > limit
+
+
+def compress_response(response, accept_gzip):
+    """
+    Gzip a response body in place when the client accepts it and it is large enough.
+    """
+    body = response.get_data()
+    if accept_gzip and len(body) >= COMPRESS_MIN_BYTES:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
@@ -0,0 +1,192 @@
+import math
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+from database import PATIENT_ID_MAX_LENGTH, REQUIRED_FIELDS
+
+# Readings are validated and normalized in blocks of this size, amortizing the NumPy overhead
+VALIDATION_BLOCK_SIZE = int(os.environ.get("HEALTHGUARD_VALIDATION_BLOCK_SIZE", 5000))
+
+# Physiologically possible ranges, inclusive, in normalized units (bpm, mmHg and °C)
+VITAL_LIMITS = {
+    "heart_rate": (20.0, 300.0),
+    "systolic": (40.0, 300.0),
+    "diastolic": (20.0, 200.0),
+    "temperature": (25.0, 45.0),
+}
+
+# Temperatures submitted without a temperature_unit are read as °F from this value up:
+# no patient has a body temperature of 50 °C, nor one of 50 °F
+FAHRENHEIT_THRESHOLD = 50.0
+
+TEMPERATURE_UNITS = ("C", "F")
+
+
+def as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def to_float_array(values):
+    """
+    Convert a sequence of numbers or numeric strings to float64, with NaN for anything else.
+    """
+    try:
+        array = np.array(values, dtype=np.float64)
+        if array.ndim == 1:
+            return array
+    except (TypeError, ValueError):
+        pass
+    # Fall back to converting one value at a time only when some value is not a plain number
+    return np.array([as_float(value) for value in values], dtype=np.float64)
+
+
+def out_of_range(values, vital):
+    low, high = VITAL_LIMITS[vital]
+    # Written so that NaN, i.e. a value that was not numeric, is out of range too
+    return ~((values >= low) & (values <= high))
+
+
+def parse_blood_pressure(values):
+    """
+    Split blood pressures given as "120/80" strings or as bare systolic numbers.
+
+    Returns:
+    A (systolic, diastolic, has_diastolic) tuple of arrays; diastolic is NaN where it was not given.
+    """
+    try:
+        text = np.asarray(values)
+    except ValueError:
+        # Lists mixed with scalars or strings have no common shape
+        text = None
+    if text is None or text.dtype.kind != "U" or text.ndim != 1:
+        text = np.array([str(value) for value in values])
+    parts = np.char.partition(text, "/")
+    systolic = to_float_array(np.char.strip(parts[:, 0]))
+    diastolic = np.full(len(text), np.nan)
+    has_diastolic = parts[:, 1] != ""
+    diastolic[has_diastolic] = to_float_array(np.char.strip(parts[has_diastolic, 2]))
+    return systolic, diastolic, has_diastolic
+
+
+def normalize_vitals(readings):
+    """
+    Parse, convert and range-check the vitals of a block of readings with array operations.
+
+    Heart rates are in bpm. Blood pressure is split into systolic and diastolic mmHg.
+    Temperatures are converted to °C; °F is taken from an explicit temperature_unit of
+    "F", or from values at or above FAHRENHEIT_THRESHOLD when no unit is given.
+
+    Args:
+    - readings: A list of dictionaries carrying the REQUIRED_FIELDS.
+
+    Returns:
+    A list with, per reading, either a (heart_rate, blood_pressure, temperature) tuple of
+    normalized values or an error message string.
+    """
+    heart_rate = to_float_array([reading["heart_rate"] for reading in readings])
+    systolic, diastolic, has_diastolic = parse_blood_pressure([reading["blood_pressure"] for reading in readings])
+    temperature = to_float_array([reading["temperature"] for reading in readings])
+    unit = np.array([str(reading.get("temperature_unit") or "").upper() for reading in readings])
+
+    fahrenheit = (unit == "F") | ((unit == "") & (temperature >= FAHRENHEIT_THRESHOLD))
+    temperature = np.where(fahrenheit, np.round((temperature - 32.0) * 5.0 / 9.0, 2), temperature)
+
+    # Checks in priority order: a reading is reported with the first one it fails
+    checks = (
+        (out_of_range(heart_rate, "heart_rate"), "Invalid heart_rate"),
+        (out_of_range(systolic, "systolic")
+         | (has_diastolic & (out_of_range(diastolic, "diastolic") | (diastolic >= systolic))),
+         "Invalid blood_pressure"),
+        (~np.isin(unit, ("",) + TEMPERATURE_UNITS), "Invalid temperature_unit"),
+        (out_of_range(temperature, "temperature"), "Invalid temperature"),
+    )
+    failed = np.zeros(len(readings), dtype=np.int8)
+    for code, (mask, message) in enumerate(checks, 1):
+        failed[(failed == 0) & mask] = code
+
+    # Back to Python values once, rather than indexing NumPy scalars per reading
+    results = []
+    for code, heart_rate_value, systolic_value, diastolic_value, diastolic_given, temperature_value in zip(
+            failed.tolist(), heart_rate.tolist(), systolic.tolist(), diastolic.tolist(), has_diastolic.tolist(),
+            temperature.tolist()):
+        if code:
+            results.append(checks[code - 1][1])
+        elif diastolic_given:
+            results.append((heart_rate_value, f"{systolic_value:g}/{diastolic_value:g}", temperature_value))
+        else:
+            results.append((heart_rate_value, f"{systolic_value:g}", temperature_value))
+    return results
+
+
+def validate_block(block, received_at):
+    # Structure and timestamps are checked per reading, the vitals for the whole block at once
+    checked = []
+    readings = []
+    for index, item in block:
+        if not isinstance(item, dict) or any(field not in item for field in REQUIRED_FIELDS):
+            checked.append((index, item, None, "Invalid request data"))
+            continue
+        patient_id = item.get('patient_id')
+        if patient_id is not None and not (isinstance(patient_id, str) and len(patient_id) <= PATIENT_ID_MAX_LENGTH):
+            checked.append((index, item, None, "Invalid patient_id"))
+            continue
+        timestamp = item.get('timestamp')
+        if isinstance(timestamp, str) and timestamp[-1:] in ("Z", "z"):
+            # fromisoformat only accepts a Z suffix from Python 3.11
+            timestamp = timestamp[:-1] + "+00:00"
+        try:
+            timestamp = datetime.fromisoformat(timestamp) if timestamp else received_at
+        except (TypeError, ValueError):
+            checked.append((index, item, None, "Invalid timestamp"))
+            continue
+        if timestamp.tzinfo is not None:
+            # Timestamps are stored as naive UTC, which is what the database columns hold
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        checked.append((index, item, timestamp, None))
+        readings.append(item)
+
+    vitals = iter(normalize_vitals(readings)) if readings else iter(())
+    for index, item, timestamp, error in checked:
+        if error is None:
+            normalized = next(vitals)
+            if isinstance(normalized, str):
+                error = normalized
+            else:
+                heart_rate, blood_pressure, temperature = normalized
+                yield index, {
+                    "patient_id": item.get('patient_id'),
+                    "heart_rate": heart_rate,
+                    "blood_pressure": blood_pressure,
+                    "temperature": temperature,
+                    "timestamp": timestamp
+                }, None
+                continue
+        yield index, None, error
+
+
+def validate_health_data_batch(items, received_at, block_size=VALIDATION_BLOCK_SIZE):
+    """
+    Validate and normalize health data readings, block by block.
+
+    Args:
+    - items: An iterable of (index, reading) pairs, where a reading is a decoded JSON value.
+    - received_at: The timestamp to use for readings that do not carry their own.
+    - block_size: The number of readings normalized together.
+
+    Returns:
+    A generator of (index, row, error) tuples in input order, where row is a dict of column
+    values ready for insertion and error is None, or row is None and error describes the problem.
+    """
+    block = []
+    for index, item in items:
+        block.append((index, item))
+        if len(block) >= block_size:
+            yield from validate_block(block, received_at)
+            block = []
+    if block:
+        yield from validate_block(block, received_at)
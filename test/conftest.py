@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The backend modules import each other as top-level modules (app, database, ...), the
+# models live in the ai package under src/ and the monitoring code in the func package at
+# the repository root, so all three are put on the path for a plain `pytest` run
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in reversed((os.path.join(ROOT, "src"), os.path.join(ROOT, "src", "backend"), ROOT)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,357 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ai.features import FeatureStore, compute_features, vital_frame
+from ai.models import HealthMonitoringModel, ModelRegistry
+from ai.models.compiled_forest import CompiledForest
+from ai.models.inference import BatchingPredictor
+from ai.models.monitoring import FeatureHistogram, ModelMonitor, QuantileSketch
+from ai.search import search
+from func.biometric_analysis import analyze_biometric_data
+
+
+def synthetic_vitals(rows=400, seed=0):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({
+        "heart_rate": rng.uniform(50, 140, rows),
+        "systolic": rng.uniform(90, 180, rows),
+        "temperature": rng.uniform(35.5, 40.5, rows),
+    })
+    y = ((X["heart_rate"] > 110) | (X["temperature"] > 38.5)).astype(int)
+    return X, y
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = ModelRegistry(tempfile.mkdtemp())
+        self.X, self.y = synthetic_vitals()
+
+    def test_save_and_fetch_current(self):
+        model = HealthMonitoringModel()
+        model.train_model(self.X, self.y)
+        self.assertEqual(model.save(self.registry), 1)
+
+        served = HealthMonitoringModel.from_registry(self.registry)
+        self.assertEqual(served.version, 1)
+        self.assertEqual([feature["name"] for feature in served.features], ["heart_rate", "systolic", "temperature"])
+        self.assertIn("accuracy", served.metrics)
+        # Columns are reordered to the saved schema before predicting
+        shuffled = self.X[["temperature", "heart_rate", "systolic"]]
+        np.testing.assert_array_equal(served.predict(shuffled), model.predict(self.X))
+        self.assertIs(HealthMonitoringModel.from_registry(self.registry).model, served.model)
+
+        # The forest is served compiled, from memory-mapped node arrays
+        self.assertIsInstance(served.compiled.threshold, np.memmap)
+        np.testing.assert_array_equal(served.compiled.predict(self.X), model.predict(self.X))
+
+    def test_versions_and_rollback(self):
+        model = HealthMonitoringModel()
+        model.train_model(self.X, self.y)
+        model.save(self.registry)
+        model.save(self.registry)
+        self.assertEqual(self.registry.versions("health_monitoring"), [1, 2])
+        self.assertEqual(self.registry.current("health_monitoring")[1]["version"], 2)
+        self.registry.set_current("health_monitoring", 1)
+        self.assertEqual(HealthMonitoringModel.from_registry(self.registry).version, 1)
+        with self.assertRaises(LookupError):
+            self.registry.current("unknown")
+
+
+class TestBiometricAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.registry = ModelRegistry(tempfile.mkdtemp())
+        X, y = synthetic_vitals(rows=300)
+        self.data = X.rename(columns={"systolic": "blood_pressure"}).assign(health_status=y)
+
+    def test_uses_the_current_registered_model(self):
+        model = HealthMonitoringModel()
+        model.train_model(*synthetic_vitals(seed=1))
+        model.save(self.registry)
+        results = analyze_biometric_data(self.data, self.registry)
+        expected = model.predict(self.data[["heart_rate", "blood_pressure", "temperature"]].to_numpy())
+        self.assertEqual(results["health_status"], expected.tolist())
+        self.assertEqual(self.registry.versions("health_monitoring"), [1])
+        self.assertIn(results["heart_rate_trend"], ("Increasing", "Decreasing", "Stable"))
+
+    def test_fallback_model_is_not_registered(self):
+        results = analyze_biometric_data(self.data, self.registry)
+        self.assertEqual(len(results["health_status"]), len(self.data))
+        self.assertEqual(self.registry.versions("health_monitoring"), [])
+
+
+class TestChunkedTraining(unittest.TestCase):
+    def setUp(self):
+        X, y = synthetic_vitals(rows=2000)
+        self.data = X.assign(label=y)
+        self.directory = tempfile.mkdtemp()
+
+    def test_forest_grows_per_chunk_from_csv(self):
+        path = os.path.join(self.directory, "vitals.csv")
+        self.data.to_csv(path, index=False)
+        model = HealthMonitoringModel(path)
+        accuracy = model.train_model_chunked(chunk_size=500, trees_per_chunk=5)
+        self.assertEqual(len(model.model.estimators_), 20)
+        self.assertGreater(accuracy, 0.9)
+        self.assertEqual(model.metrics["chunks"], 4)
+        self.assertEqual(model.features[0], {"name": "heart_rate", "dtype": "float32"})
+        self.assertGreater(model.metrics["peak_memory_mb"], 0)
+
+    def test_forest_gives_up_on_a_class_missing_from_many_chunks(self):
+        # The second class only shows up in the last rows, after far more chunks than are carried over
+        data = self.data.assign(label=0)
+        data.loc[data.index[-10:], "label"] = 1
+        path = os.path.join(self.directory, "late_class.csv")
+        data.to_csv(path, index=False)
+        with self.assertRaisesRegex(ValueError, "pass a larger chunk_size"):
+            HealthMonitoringModel(path).train_model_chunked(chunk_size=100, trees_per_chunk=5, classes=[0, 1])
+
+    def test_sgd_partial_fit_from_parquet(self):
+        path = os.path.join(self.directory, "vitals.parquet")
+        self.data.to_parquet(path)
+        model = HealthMonitoringModel(path)
+        model.train_model_chunked(learner="sgd", chunk_size=300, classes=[0, 1])
+        self.assertEqual(model.metrics["chunks"], 7)
+        self.assertEqual(model.metrics["train_rows"] + model.metrics["test_rows"], 2000)
+        self.assertEqual(sorted(model.model.classes_.tolist()), [0, 1])
+
+
+class TestBatchingPredictor(unittest.TestCase):
+    def setUp(self):
+        X, y = synthetic_vitals()
+        self.X = X
+        self.model = HealthMonitoringModel()
+        self.model.train_model(X, y)
+        self.predictor = BatchingPredictor(lambda: self.model, max_batch_size=64, max_wait_ms=20)
+
+    def tearDown(self):
+        self.predictor.close()
+
+    def test_concurrent_requests_share_batches(self):
+        readings = self.X.head(50).to_dict("records")
+        futures = [self.predictor.submit(reading) for reading in readings]
+        self.assertEqual([future.result(5) for future in futures], self.model.predict(self.X.head(50)).tolist())
+        stats = self.predictor.stats()
+        self.assertEqual(stats["predictions"], 50)
+        self.assertLess(stats["batches"], 50)
+
+    def test_malformed_reading_fails_alone(self):
+        good = self.predictor.submit(self.X.iloc[0].to_dict())
+        bad = self.predictor.submit({"heart_rate": 80})
+        self.assertIn(good.result(5), (0, 1))
+        with self.assertRaises(KeyError):
+            bad.result(5)
+        self.assertEqual(self.predictor.stats()["errors"], 1)
+
+    def test_monitor_records_per_version(self):
+        futures = [self.predictor.submit(reading) for reading in self.X.to_dict("records")]
+        predictions = [future.result(5) for future in futures]
+        self.predictor.close()
+        report = self.predictor.monitor.report()["None"]
+        self.assertEqual(report["predictions"], len(self.X))
+        self.assertAlmostEqual(sum(report["class_rates"].values()), 1.0)
+        self.assertAlmostEqual(report["class_rates"]["1"], predictions.count(1) / len(self.X))
+        self.assertEqual(sorted(report["features"]), ["heart_rate", "systolic", "temperature"])
+        # The training quantiles are the drift reference; the training data has not drifted
+        self.assertTrue(all(score < 0.2 for score in report["drift"].values()))
+
+    def test_worker_survives_cancellation_and_monitor_errors(self):
+        cancelled = self.predictor.submit(self.X.iloc[0].to_dict())
+        cancelled.cancel()
+
+        def broken_record(*args, **kwargs):
+            raise RuntimeError("monitor failed")
+
+        self.predictor.monitor.record = broken_record
+        # Results are set before the batch is recorded; the worker has logged the first
+        # batch's monitor error by the time the second batch returns
+        with self.assertLogs("ai.models.inference", level="ERROR"):
+            self.assertIn(self.predictor.predict(self.X.iloc[1].to_dict(), timeout=5), (0, 1))
+            self.assertIn(self.predictor.predict(self.X.iloc[2].to_dict(), timeout=5), (0, 1))
+        self.assertTrue(self.predictor.worker.is_alive())
+        self.assertEqual(self.predictor.stats()["predictions"], 2)
+
+
+class TestModelMonitor(unittest.TestCase):
+    def test_sketch_memory_is_bounded(self):
+        sketch = QuantileSketch(size=1024)
+        values = np.random.default_rng(0).normal(size=200000)
+        for chunk in np.array_split(values, 100):
+            sketch.add(chunk)
+        self.assertEqual(sketch.count, len(values))
+        self.assertEqual(len(sketch.values()), 1024)
+        self.assertAlmostEqual(sketch.quantiles(0.5), 0.0, delta=0.1)
+        self.assertAlmostEqual(sketch.quantiles(0.95), 1.645, delta=0.15)
+
+    def test_latency_quantiles_follow_recent_calls(self):
+        monitor = ModelMonitor()
+        for _ in range(50000):
+            monitor.record(1, np.zeros((1, 1)), [0], 0.001)
+        for _ in range(100):
+            monitor.record(1, np.zeros((1, 1)), [0], 0.5)
+        self.assertAlmostEqual(monitor.report()["1"]["latency_ms"]["p99"], 500.0)
+
+    def test_histogram_follows_recent_values(self):
+        rng = np.random.default_rng(0)
+        histogram = FeatureHistogram(rng.normal(size=5000), half_life=1000)
+        for _ in range(100):
+            histogram.add(rng.normal(size=1000))
+        self.assertLess(histogram.drift(), 0.05)
+        self.assertAlmostEqual(histogram.quantiles(0.5), 0.0, delta=0.1)
+        # A shift over the last few half-lives dominates a long stable history
+        for _ in range(5):
+            histogram.add(rng.normal(2.0, size=1000))
+        self.assertGreater(histogram.drift(), 1.0)
+        self.assertAlmostEqual(histogram.quantiles(0.5), 2.0, delta=0.3)
+        self.assertEqual(histogram.count, 105000)
+        # Only the bin counts are kept, never the values themselves
+        self.assertEqual(len(histogram.counts), len(histogram.edges) + 1)
+        self.assertEqual(len(histogram.counts), 100)
+
+    def test_drift_flags_shifted_feature(self):
+        rng = np.random.default_rng(0)
+        monitor = ModelMonitor(max_versions=2)
+        monitor.set_reference(1, rng.normal(size=(5000, 2)), ["stable", "shifted"])
+        for _ in range(10):
+            X = np.column_stack([rng.normal(size=100), rng.normal(1.5, size=100)])
+            monitor.record(1, X, np.zeros(100), 0.001, ["stable", "shifted"])
+        self.assertEqual(monitor.report()["1"]["drifted"], ["shifted"])
+
+        # Only the most recently recorded versions are kept
+        monitor.record(2, np.zeros((1, 2)), [0], 0.001)
+        monitor.record(3, np.zeros((1, 2)), [0], 0.001)
+        self.assertEqual(list(monitor.report()), ["2", "3"])
+
+
+class TestCompiledForest(unittest.TestCase):
+    def test_predictions_are_bit_identical(self):
+        X, y = synthetic_vitals(rows=1000)
+        model = HealthMonitoringModel()
+        model.train_model(X, y)
+        compiled = model.compile()
+        X_test, _ = synthetic_vitals(rows=300, seed=1)
+        X_test.iloc[0, 0] = np.nan
+        np.testing.assert_array_equal(compiled.predict_proba(X_test), model.model.predict_proba(X_test))
+        np.testing.assert_array_equal(model.predict(X_test.head(10)), model.model.predict(X_test.head(10)))
+
+        directory = tempfile.mkdtemp()
+        compiled.save(directory)
+        loaded = CompiledForest.load(directory)
+        self.assertIsInstance(loaded.value, np.memmap)
+        np.testing.assert_array_equal(loaded.predict(X_test), model.model.predict(X_test))
+
+
+class TestHyperparameterSearch(unittest.TestCase):
+    def test_search_ranks_and_caches_folds(self):
+        X, y = synthetic_vitals(rows=300)
+        cache_dir = tempfile.mkdtemp()
+        grids = {
+            "logistic_regression": {"C": [0.0001, 1.0], "max_iter": [1000]},
+            "random_forest_classifier": {"n_estimators": [10], "random_state": [0]},
+        }
+        results = search(X.to_numpy(), y.to_numpy(), grids, folds=3, margin=0.1, n_jobs=2, cache_dir=cache_dir)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]["algorithm"], "random_forest_classifier")
+        self.assertEqual(len(results[0]["scores"]), 3)
+        # A near-zero C underfits and is dropped after the first fold
+        weak = [result for result in results if result["params"].get("C") == 0.0001][0]
+        self.assertTrue(weak["stopped_early"])
+        self.assertEqual(len(weak["scores"]), 1)
+
+        with open(os.path.join(cache_dir, "fold_results.jsonl")) as f:
+            evaluated = len(f.readlines())
+        rerun = search(X.to_numpy(), y.to_numpy(), grids, folds=3, margin=0.1, n_jobs=2, cache_dir=cache_dir)
+        self.assertEqual([result["scores"] for result in rerun], [result["scores"] for result in results])
+        with open(os.path.join(cache_dir, "fold_results.jsonl")) as f:
+            self.assertEqual(len(f.readlines()), evaluated)
+
+    def test_search_with_string_labels(self):
+        X, y = synthetic_vitals(rows=200)
+        labels = np.where(y.to_numpy() == 1, "warning", "normal")
+        grids = {"random_forest_classifier": {"n_estimators": [10], "random_state": [0]}}
+        results = search(X.to_numpy(), labels, grids, folds=3, n_jobs=2, cache_dir=tempfile.mkdtemp())
+        encoded = search(X.to_numpy(), y.to_numpy(), grids, folds=3, n_jobs=2, cache_dir=tempfile.mkdtemp())
+        self.assertEqual(results[0]["scores"], encoded[0]["scores"])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+def synthetic_readings(patients=3, rows=60, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-01-01")
+    return pd.DataFrame({
+        "patient_id": np.repeat([f"p{i}" for i in range(patients)], rows),
+        "timestamp": np.tile(start + pd.to_timedelta(np.arange(rows) * 10, unit="min"), patients),
+        "heart_rate": rng.uniform(50, 140, patients * rows),
+        "blood_pressure": [f"{s}/{d}" for s, d in zip(rng.integers(90, 180, patients * rows),
+                                                     rng.integers(60, 110, patients * rows))],
+        "temperature": rng.uniform(35.5, 40.5, patients * rows),
+    })
+
+
+class TestFeatureStore(unittest.TestCase):
+    def setUp(self):
+        self.store = FeatureStore(tempfile.mkdtemp(), windows=("1h", "6h"))
+        self.readings = synthetic_readings()
+
+    def test_incremental_updates_match_full_computation(self):
+        # Feed the readings in three arrivals; cached features equal a one-shot computation
+        ordered = self.readings.sort_values("timestamp", kind="stable")
+        for part in np.array_split(np.arange(len(ordered)), 3):
+            self.store.update(ordered.iloc[part])
+        expected = compute_features(vital_frame(self.readings), "1h")
+        cached = self.store.read("1h")
+        self.assertEqual(len(cached), len(self.readings))
+        pd.testing.assert_frame_equal(cached, expected, check_exact=False, rtol=1e-9, atol=1e-9)
+
+        # A steady rise shows up as a positive heart rate slope
+        ramp = pd.DataFrame({"patient_id": "ramp", "timestamp": pd.date_range("2024-01-01", periods=7, freq="10min"),
+                             "heart_rate": np.arange(70, 77), "blood_pressure": "120/80", "temperature": 37.0})
+        self.store.update(ramp)
+        self.assertAlmostEqual(self.store.latest("ramp", "1h")["heart_rate_slope"], 6.0)
+
+    def test_late_readings_recompute_the_patient(self):
+        late = self.readings.iloc[::7]
+        self.store.update(self.readings.drop(late.index))
+        self.store.update(late)
+        expected = compute_features(vital_frame(self.readings), "6h")
+        pd.testing.assert_frame_equal(self.store.read("6h"), expected, check_exact=False, rtol=1e-9, atol=1e-9)
+
+    def test_delta_after_gap_longer_than_window(self):
+        self.store.update(self.readings)
+        previous = self.store.latest("p0", "1h")
+        later = pd.DataFrame({"patient_id": ["p0"], "timestamp": [previous["timestamp"] + pd.Timedelta("2D")],
+                              "heart_rate": [previous["heart_rate"] + 5], "blood_pressure": ["120/80"],
+                              "temperature": [37.0]})
+        self.store.update(later)
+        latest = self.store.latest("p0", "1h")
+        self.assertAlmostEqual(latest["heart_rate_delta"], 5.0)
+        self.assertAlmostEqual(latest["heart_rate_mean"], previous["heart_rate"] + 5)
+
+    def test_parts_are_compacted(self):
+        store = FeatureStore(tempfile.mkdtemp(), windows=("1h",), compact_parts=3)
+        ordered = self.readings.sort_values("timestamp", kind="stable")
+        for part in np.array_split(np.arange(len(ordered)), 10):
+            store.update(ordered.iloc[part])
+        self.assertLessEqual(len(store.parts("p0", "1h")), 3)
+        expected = compute_features(vital_frame(self.readings), "1h")
+        pd.testing.assert_frame_equal(store.read("1h"), expected, check_exact=False, rtol=1e-9, atol=1e-9)
+
+    def test_readings_without_patient_are_dropped(self):
+        readings = self.readings.astype({"patient_id": object})
+        readings.loc[readings.index[:5], "patient_id"] = None
+        self.assertEqual(self.store.update(readings), len(readings) - 5)
+        self.assertNotIn("None", set(self.store.read("1h")["patient_id"]))
+
+    def test_train_and_predict_from_store(self):
+        self.store.update(self.readings)
+        labels = self.readings.assign(label=(self.readings["heart_rate"] > 110).astype(int))
+        model = HealthMonitoringModel()
+        model.train_from_store(self.store, "1h", labels)
+        predictions = model.predict_latest(self.store, "1h", ["p0", "p1", "missing"])
+        self.assertEqual(sorted(predictions), ["p0", "p1"])
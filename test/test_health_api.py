@@ -0,0 +1,742 @@
+import asyncio
+import gzip
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+
+os.environ.setdefault("HEALTHGUARD_DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+
+import asgi
+from aggregates import RollingAggregates, RunningStats, WindowedStats, rolling_aggregates
+from app import app
+from cache import LatestReadingCache, latest_reading_cache
+from export import pa
+from ingest_log import IngestLog
+from metrics import LatencyHistogram
+from retention import compact, start_compaction_thread
+from streaming import VitalsBroker, event_stream, vitals_broker
+from validation import validate_health_data_batch
+from database import (Base, engine, session_factory, create_database_engine, pool_metrics, HealthData,
+                      HealthDataAggregate, IngestCheckpoint)
+
+
+class TestHealthHistory(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.client = app.test_client()
+
+        # Create ten readings for one patient and one for another patient
+        start = datetime(2024, 1, 1)
+        for i in range(10):
+            session_factory().add(HealthData(patient_id="p1", heart_rate=70 + i, blood_pressure="120/80",
+                                             temperature=37.0, timestamp=start + timedelta(minutes=i)))
+        session_factory().add(HealthData(patient_id="p2", heart_rate=60, blood_pressure="110/70",
+                                         temperature=36.5, timestamp=start))
+        session_factory().commit()
+
+    def tearDown(self):
+        session_factory.remove()
+        Base.metadata.drop_all(engine)
+
+    def test_history_pages_through_window(self):
+        # Page through the first six minutes three rows at a time
+        url = "/health/history?patient_id=p1&start=2024-01-01T00:00:00&end=2024-01-01T00:06:00&limit=3"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        page = response.get_json()
+        self.assertEqual([row["heart_rate"] for row in page["data"]], [70, 71, 72])
+        self.assertIsNotNone(page["next_cursor"])
+
+        page = self.client.get(url + "&cursor=" + page["next_cursor"]).get_json()
+        self.assertEqual([row["heart_rate"] for row in page["data"]], [73, 74, 75])
+        self.assertIsNone(page["next_cursor"])
+
+    def test_history_columnar_format(self):
+        response = self.client.get("/health/history?patient_id=p1&limit=3&format=columns")
+        self.assertEqual(response.status_code, 200)
+        columns = response.get_json()["data"]
+        self.assertEqual(columns["heart_rate"], [70, 71, 72])
+        self.assertEqual(columns["patient_id"], ["p1", "p1", "p1"])
+        self.assertEqual(columns["timestamp"][0], "2024-01-01T00:00:00")
+
+    def test_history_requires_patient_id(self):
+        response = self.client.get("/health/history")
+        self.assertEqual(response.status_code, 400)
+
+    def test_history_rejects_bad_cursor(self):
+        response = self.client.get("/health/history?patient_id=p1&cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+
+
+class TestHealthBatch(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        session_factory.remove()
+        Base.metadata.drop_all(engine)
+
+    def test_batch_json_array(self):
+        readings = [
+            {"patient_id": "p1", "heart_rate": 80, "blood_pressure": "120/80", "temperature": 37.5},
+            {"patient_id": "p1", "heart_rate": 82},
+            {"patient_id": "p1", "heart_rate": 84, "blood_pressure": 120, "temperature": 37.1,
+             "timestamp": "2024-01-01T00:00:00"},
+        ]
+        response = self.client.post("/health/batch", json=readings)
+        self.assertEqual(response.status_code, 201)
+        result = response.get_json()
+        self.assertEqual(result["inserted"], 2)
+        self.assertEqual(result["errors"], [{"index": 1, "error": "Invalid request data"}])
+        self.assertEqual(session_factory().query(HealthData).count(), 2)
+
+    def test_batch_ndjson(self):
+        body = (
+            '{"patient_id": "p1", "heart_rate": 80, "blood_pressure": "120/80", "temperature": 37.5}\n'
+            'not json\n'
+            '\n'
+            '{"patient_id": "p2", "heart_rate": 70, "blood_pressure": "110/70", "temperature": 36.9}\n'
+        )
+        response = self.client.post("/health/batch", data=body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 201)
+        result = response.get_json()
+        self.assertEqual(result["inserted"], 2)
+        self.assertEqual(result["errors"], [{"index": 1, "error": "Invalid request data"}])
+
+    def test_batch_with_mixed_blood_pressure_shapes(self):
+        vitals = {"patient_id": "p1", "heart_rate": 80, "temperature": 37.5}
+        response = self.client.post("/health/batch", json=[dict(vitals, blood_pressure=[120, 80]),
+                                                          dict(vitals, blood_pressure=120),
+                                                          dict(vitals, blood_pressure="120/80")])
+        self.assertEqual(response.status_code, 201)
+        result = response.get_json()
+        self.assertEqual(result["inserted"], 2)
+        self.assertEqual(result["errors"], [{"index": 0, "error": "Invalid blood_pressure"}])
+
+    def test_batch_rejects_non_array(self):
+        response = self.client.post("/health/batch", json={"heart_rate": 80})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestLatestReadingCache(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        latest_reading_cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        session_factory.remove()
+        Base.metadata.drop_all(engine)
+
+    def test_write_through_and_invalidation(self):
+        self.client.post("/health", json={"patient_id": "p1", "heart_rate": 70,
+                                          "blood_pressure": "120/80", "temperature": 37.5})
+        self.assertEqual(self.client.get("/health?patient_id=p1").get_json()["heart_rate"], 70)
+
+        # A newer reading replaces the cached one
+        self.client.post("/health", json={"patient_id": "p1", "heart_rate": 80,
+                                          "blood_pressure": "120/80", "temperature": 37.5})
+        hits = latest_reading_cache.stats()["hits"]
+        self.assertEqual(self.client.get("/health?patient_id=p1").get_json()["heart_rate"], 80)
+        self.assertEqual(latest_reading_cache.stats()["hits"], hits + 1)
+
+        # Deleting the newest reading must not leave it in the cache
+        self.client.delete("/health")
+        self.assertEqual(self.client.get("/health?patient_id=p1").get_json()["heart_rate"], 70)
+
+    def test_older_reading_does_not_replace_newer(self):
+        self.client.post("/health", json={"patient_id": "p1", "heart_rate": 80, "blood_pressure": "120/80",
+                                          "temperature": 37.5})
+        self.assertEqual(self.client.get("/health?patient_id=p1").get_json()["heart_rate"], 80)
+        response = self.client.post("/health", json={"patient_id": "p1", "heart_rate": 60, "blood_pressure": "120/80",
+                                                     "temperature": 37.5, "timestamp": "2020-01-01T00:00:00"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get("/health?patient_id=p1").get_json()["heart_rate"], 80)
+        self.assertEqual(self.client.get("/health").get_json()["heart_rate"], 80)
+        self.assertEqual(self.client.post("/health", json={"patient_id": ["p1"], "heart_rate": 60,
+                                                           "blood_pressure": "120/80",
+                                                           "temperature": 37.5}).status_code, 400)
+
+    def test_advance_keeps_newest_reading(self):
+        for shared_path in (None, os.path.join(tempfile.mkdtemp(), "cache.db")):
+            cache = LatestReadingCache(ttl=60, shared_path=shared_path)
+            cache.set("p1", {"timestamp": "2024-01-01 00:00:00"})
+            cache.advance("p1", {"timestamp": "2024-01-02 00:00:00"})
+            self.assertEqual(cache.get("p1"), {"timestamp": "2024-01-02 00:00:00"})
+            cache.advance("p1", {"timestamp": "2020-01-01 00:00:00"})
+            self.assertIsNone(cache.get("p1"))
+
+    def test_lru_eviction_and_ttl(self):
+        cache = LatestReadingCache(max_size=2, ttl=60, shared_path=None)
+        cache.set("p1", {"heart_rate": 1})
+        cache.set("p2", {"heart_rate": 2})
+        cache.get("p1")
+        cache.set("p3", {"heart_rate": 3})
+        self.assertIsNone(cache.get("p2"))
+        self.assertEqual(cache.get("p1"), {"heart_rate": 1})
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        expired = LatestReadingCache(max_size=2, ttl=0, shared_path=None)
+        expired.set("p1", {"heart_rate": 1})
+        self.assertIsNone(expired.get("p1"))
+
+    def test_fill_does_not_overwrite_newer_write(self):
+        for shared_path in (None, os.path.join(tempfile.mkdtemp(), "cache.db")):
+            cache = LatestReadingCache(max_size=2, ttl=60, shared_path=shared_path)
+            generation = cache.generation("p1")
+            cache.set("p1", {"heart_rate": 2})
+            cache.fill("p1", {"heart_rate": 1}, generation)
+            self.assertEqual(cache.get("p1"), {"heart_rate": 2})
+
+            generation = cache.generation("p1")
+            cache.invalidate("p1")
+            cache.fill("p1", {"heart_rate": 2}, generation)
+            self.assertIsNone(cache.get("p1"))
+
+            cache.fill("p1", {"heart_rate": 3}, cache.generation("p1"))
+            self.assertEqual(cache.get("p1"), {"heart_rate": 3})
+
+    def test_shared_cache_is_consistent_across_workers(self):
+        shared_path = os.path.join(tempfile.mkdtemp(), "cache.db")
+        first = LatestReadingCache(ttl=60, shared_path=shared_path)
+        second = LatestReadingCache(ttl=60, shared_path=shared_path)
+        first.set("p1", {"heart_rate": 1})
+        self.assertEqual(second.get("p1"), {"heart_rate": 1})
+        second.invalidate("p1")
+        self.assertIsNone(first.get("p1"))
+
+        first.set("p1", {"heart_rate": 1})
+        second.clear()
+        self.assertIsNone(first.get("p1"))
+
+
+class TestAsgi(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        latest_reading_cache.clear()
+
+    def tearDown(self):
+        session_factory.remove()
+        Base.metadata.drop_all(engine)
+
+    def request(self, method, path, body=None, query_string=b""):
+        messages = [{"type": "http.request", "body": json.dumps(body).encode() if body is not None else b""}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": method, "path": path, "query_string": query_string}
+        asyncio.run(asgi.app(scope, receive, send))
+        return sent[0]["status"], json.loads(sent[1]["body"])
+
+    def test_post_uses_shared_ingest_path(self):
+        subscription = vitals_broker.subscribe(["asgi-p1"])
+        try:
+            status, reading = self.request("POST", "/health", {"patient_id": "asgi-p1", "heart_rate": 80,
+                                                               "blood_pressure": "120/80", "temperature": 37.5})
+            self.assertEqual(status, 201)
+            self.assertEqual(reading["heart_rate"], 80)
+            self.assertEqual(subscription.get(0)["heart_rate"], 80)
+        finally:
+            vitals_broker.unsubscribe(subscription)
+        summary = rolling_aggregates.summary("asgi-p1", datetime.utcnow())
+        self.assertEqual(summary["all_time"]["heart_rate"]["count"], 1)
+        self.assertEqual(session_factory().query(HealthData).filter_by(patient_id="asgi-p1").count(), 1)
+
+        status, reading = self.request("GET", "/health", query_string=b"patient_id=asgi-p1")
+        self.assertEqual((status, reading["heart_rate"]), (200, 80))
+
+    def test_get_shares_the_read_cache(self):
+        session_factory().add(HealthData(patient_id="asgi-p2", heart_rate=70, blood_pressure="120/80",
+                                         temperature=37.0, timestamp=datetime(2024, 1, 1)))
+        session_factory().commit()
+        status, reading = self.request("GET", "/health", query_string=b"patient_id=asgi-p2")
+        self.assertEqual((status, reading["heart_rate"]), (200, 70))
+        self.assertEqual(latest_reading_cache.get("asgi-p2")["heart_rate"], 70)
+
+        # A newer reading posted to the Flask app is written through to the cache ASGI reads
+        app.test_client().post("/health", json={"patient_id": "asgi-p2", "heart_rate": 90, "blood_pressure": "120/80",
+                                                "temperature": 37.0, "timestamp": "2024-01-02T00:00:00"})
+        session_factory().query(HealthData).filter_by(patient_id="asgi-p2").delete()
+        session_factory().commit()
+        status, reading = self.request("GET", "/health", query_string=b"patient_id=asgi-p2")
+        self.assertEqual((status, reading["heart_rate"]), (200, 90))
+
+    def test_post_rejects_invalid_data(self):
+        status, result = self.request("POST", "/health", {"heart_rate": 80})
+        self.assertEqual((status, result), (400, {"error": "Invalid request data"}))
+
+
+class TestVitalsBroker(unittest.TestCase):
+    def test_topic_filtering(self):
+        broker = VitalsBroker()
+        everyone = broker.subscribe()
+        only_p1 = broker.subscribe(["p1"])
+        broker.publish([{"patient_id": "p1", "heart_rate": 80}, {"patient_id": "p2", "heart_rate": 70}])
+        self.assertEqual(everyone.queue.qsize(), 2)
+        self.assertEqual(only_p1.get(0)["heart_rate"], 80)
+        self.assertIsNone(only_p1.get(0))
+
+        broker.unsubscribe(only_p1)
+        self.assertEqual(broker.stats()["patients"], 0)
+
+    def test_slow_subscriber_drops_oldest(self):
+        broker = VitalsBroker()
+        subscription = broker.subscribe(["p1"], max_size=2)
+        broker.publish([{"patient_id": "p1", "heart_rate": rate} for rate in (1, 2, 3)])
+        self.assertEqual(subscription.dropped, 1)
+
+        events = event_stream(broker, subscription, heartbeat=0)
+        self.assertEqual(next(events), ": connected\n\n")
+        self.assertEqual(next(events), "event: dropped\ndata: 1\n\n")
+        self.assertIn('"heart_rate":2', next(events))
+        events.close()
+        self.assertFalse(broker.has_subscribers())
+
+
+class TestRequestMetrics(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        session_factory.remove()
+        Base.metadata.drop_all(engine)
+
+    def test_histogram_percentiles(self):
+        histogram = LatencyHistogram()
+        for millis in range(1, 101):
+            histogram.record(millis / 1000)
+        self.assertAlmostEqual(histogram.percentile(0.5), 0.05, delta=0.0125)
+        self.assertAlmostEqual(histogram.percentile(0.99), 0.099, delta=0.025)
+        self.assertEqual(histogram.percentile(1.0), 0.1)
+
+    def test_metrics_endpoint_reports_routes(self):
+        self.client.get("/health/history?patient_id=p1")
+        routes = self.client.get("/metrics").get_json()["routes"]
+        history = routes["GET /health/history"]
+        self.assertGreaterEqual(history["count"], 1)
+        self.assertGreater(history["queries_mean"], 0)
+        self.assertIn("p99", history["latency_ms"])
+
+
+class TestDatabase(unittest.TestCase):
+    def test_import_does_not_create_database(self):
+        cwd = tempfile.mkdtemp()
+        backend = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "backend")
+        env = {name: value for name, value in os.environ.items() if name != "HEALTHGUARD_DATABASE_URL"}
+        env["PYTHONPATH"] = os.path.abspath(backend)
+        subprocess.run([sys.executable, "-c", "import app"], cwd=cwd, env=env, check=True)
+        self.assertEqual(os.listdir(cwd), [])
+
+    def test_pool_status_reports_waits(self):
+        pool_engine = create_database_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "pool.db"))
+        before = pool_metrics.snapshot()["wait_count"]
+        with pool_engine.connect():
+            pass
+        self.assertEqual(pool_metrics.snapshot()["wait_count"], before + 1)
+        pool_engine.dispose()
+
+
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.now = datetime(2024, 6, 1, 12, 30)
+
+        # Three readings in one minute, 30 days old, plus one fresh reading
+        for i in range(3):
+            session_factory().add(HealthData(patient_id="p1", heart_rate=60 + i,
+                                             blood_pressure="130" if i == 2 else "120/80",
+                                             temperature=37.0,
+                                             timestamp=self.now - timedelta(days=30) + timedelta(seconds=i)))
+        session_factory().add(HealthData(patient_id="p1", heart_rate=90, blood_pressure="120/80",
+                                         temperature=37.0, timestamp=self.now))
+        session_factory().commit()
+
+    def tearDown(self):
+        session_factory.remove()
+        Base.metadata.drop_all(engine)
+
+    def test_old_readings_are_downsampled(self):
+        result = compact(self.now)
+        self.assertEqual(result["raw_rows_removed"], 3)
+        self.assertEqual(session_factory().query(HealthData).count(), 1)
+
+        aggregate = session_factory().query(HealthDataAggregate).one()
+        self.assertEqual(aggregate.resolution, "minute")
+        self.assertEqual(aggregate.count, 3)
+        self.assertEqual(aggregate.heart_rate_sum, 183)
+        self.assertEqual((aggregate.heart_rate_min, aggregate.heart_rate_max), (60, 62))
+        self.assertEqual(aggregate.systolic_sum, 370)
+        self.assertEqual(aggregate.heart_rate_sum_squares, 60 ** 2 + 61 ** 2 + 62 ** 2)
+        self.assertEqual((aggregate.systolic_min, aggregate.systolic_max), (120, 130))
+
+    def test_compaction_thread_survives_failures(self):
+        # No tables: every pass fails
+        broken = create_database_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "empty.db"))
+        with self.assertLogs("retention", level="ERROR") as logs:
+            stop = start_compaction_thread(0.01, bind=broken)
+            deadline = time.monotonic() + 5
+            while len(logs.records) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            stop.set()
+        self.assertGreaterEqual(len(logs.records), 2)
+        self.assertIn("Compaction failed", logs.records[0].getMessage())
+        broken.dispose()
+
+    def test_minutes_roll_up_to_hours(self):
+        compact(self.now)
+        compact(self.now + timedelta(days=100))
+        aggregates = session_factory().query(HealthDataAggregate).all()
+        self.assertEqual({aggregate.resolution for aggregate in aggregates}, {"hour"})
+        self.assertEqual(sum(aggregate.count for aggregate in aggregates), 4)
+        self.assertEqual(sum(aggregate.systolic_sum for aggregate in aggregates), 490)
+
+
+class TestRollingAggregates(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        session_factory.remove()
+        Base.metadata.drop_all(engine)
+
+    def test_running_stats_merge_matches_statistics(self):
+        values = [72.0, 80.0, 65.0, 91.0, 77.0, 70.0]
+        left, right = RunningStats(), RunningStats()
+        for value in values[:2]:
+            left.add(value)
+        for value in values[2:]:
+            right.add(value)
+        left.merge(right)
+        summary = left.summary()
+        self.assertAlmostEqual(summary["mean"], statistics.mean(values))
+        self.assertAlmostEqual(summary["variance"], statistics.variance(values))
+        self.assertEqual((summary["min"], summary["max"]), (65.0, 91.0))
+
+    def test_window_drops_old_buckets(self):
+        window = WindowedStats(60, buckets=6)
+        window.add(0, 100.0)
+        window.add(65, 70.0)
+        self.assertEqual(window.summary(65)["count"], 1)
+        self.assertEqual(window.summary(65)["mean"], 70.0)
+
+    def test_summary_endpoint(self):
+        self.client.post("/health/batch", json=[
+            {"patient_id": "summary-p1", "heart_rate": 70, "blood_pressure": "120/80", "temperature": 37.0},
+            {"patient_id": "summary-p1", "heart_rate": 90, "blood_pressure": "140/90", "temperature": 38.0},
+        ])
+        response = self.client.get("/health/summary?patient_id=summary-p1")
+        self.assertEqual(response.status_code, 200)
+        summary = response.get_json()
+        self.assertEqual(summary["all_time"]["heart_rate"]["mean"], 80)
+        self.assertEqual(summary["windows"]["300"]["systolic"]["max"], 140)
+        self.assertEqual(self.client.get("/health/summary?patient_id=unknown").status_code, 404)
+
+    def test_aggregates_are_rebuilt_from_the_database(self):
+        # Readings stored before this process started, e.g. by another worker
+        for rate in (60, 80):
+            session_factory().add(HealthData(patient_id="stored-p1", heart_rate=rate, blood_pressure="120/80",
+                                             temperature=37.0, timestamp=datetime.utcnow()))
+        session_factory().commit()
+        aggregates = RollingAggregates(max_patients=1)
+        self.assertEqual(aggregates.summary("stored-p1", datetime.utcnow())["all_time"]["heart_rate"]["mean"], 70)
+
+        # Deleting a reading drops the patient, so the next summary reflects the database
+        session_factory().delete(session_factory().query(HealthData).filter_by(heart_rate=80).one())
+        session_factory().commit()
+        aggregates.invalidate("stored-p1")
+        self.assertEqual(aggregates.summary("stored-p1", datetime.utcnow())["all_time"]["heart_rate"]["count"], 1)
+
+        self.assertIsNone(aggregates.summary("unknown", datetime.utcnow()))
+        session_factory().add(HealthData(patient_id="stored-p2", heart_rate=90, blood_pressure="120/80",
+                                         temperature=37.0, timestamp=datetime.utcnow()))
+        session_factory().commit()
+        aggregates.summary("stored-p2", datetime.utcnow())
+        self.assertEqual(aggregates.stats()["patients"], 1)
+        self.assertEqual(aggregates.stats()["evictions"], 1)
+
+    def test_offset_timestamps_are_stored_as_utc(self):
+        reading = {"patient_id": "utc-p1", "heart_rate": 70, "blood_pressure": "120/80", "temperature": 37.0}
+        self.client.post("/health", json=dict(reading, timestamp="2024-01-02T00:00:00"))
+        self.assertEqual(self.client.get("/health/summary?patient_id=utc-p1").status_code, 200)
+        # The patient's aggregates are loaded, so these are added to them as they are ingested
+        self.assertEqual(self.client.post("/health", json=dict(reading, timestamp="2024-01-03T00:00:00Z")).status_code,
+                         201)
+        self.assertEqual(self.client.post("/health", json=dict(reading, timestamp="2024-01-03T00:00:00+05:00"))
+                         .status_code, 201)
+        response = self.client.get("/health/summary?patient_id=utc-p1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["all_time"]["heart_rate"]["count"], 3)
+        stored = session_factory().query(HealthData.timestamp).filter_by(patient_id="utc-p1").order_by(
+            HealthData.timestamp).all()
+        self.assertEqual([row.timestamp for row in stored],
+                         [datetime(2024, 1, 2), datetime(2024, 1, 2, 19), datetime(2024, 1, 3)])
+
+    def test_all_time_survives_compaction(self):
+        now = datetime.utcnow()
+        rates = [60, 64, 71, 80, 90]
+        for days, rate in zip((30, 30, 10, 0.5, 0), rates):
+            session_factory().add(HealthData(patient_id="compacted-p1", heart_rate=rate, blood_pressure="120/80",
+                                             temperature=37.0, timestamp=now - timedelta(days=days)))
+        session_factory().commit()
+        before = RollingAggregates().summary("compacted-p1", now)
+        compact(now)
+        self.assertEqual(session_factory().query(HealthData).filter_by(patient_id="compacted-p1").count(), 2)
+        after = RollingAggregates().summary("compacted-p1", now)
+
+        heart_rate = after["all_time"]["heart_rate"]
+        self.assertEqual(heart_rate["count"], 5)
+        self.assertAlmostEqual(heart_rate["mean"], statistics.mean(rates))
+        self.assertAlmostEqual(heart_rate["variance"], statistics.variance(rates))
+        self.assertEqual((heart_rate["min"], heart_rate["max"]), (60, 90))
+        self.assertEqual(after["all_time"]["systolic"]["count"], 5)
+        # Diastolic pressure is not downsampled: only the raw readings are left
+        self.assertEqual(after["all_time"]["diastolic"]["count"], 2)
+        self.assertEqual(after["windows"], before["windows"])
+        self.assertEqual(after["windows"]["86400"]["heart_rate"]["count"], 2)
+        self.assertEqual(after["last"]["heart_rate"], 90)
+
+    def test_delete_invalidates_summary(self):
+        self.client.post("/health/batch", json=[
+            {"patient_id": "delete-p1", "heart_rate": 70, "blood_pressure": "120/80", "temperature": 37.0},
+            {"patient_id": "delete-p1", "heart_rate": 90, "blood_pressure": "120/80", "temperature": 37.0,
+             "timestamp": "2100-01-01T00:00:00"},
+        ])
+        self.assertEqual(self.client.get("/health/summary?patient_id=delete-p1").get_json()
+                         ["all_time"]["heart_rate"]["count"], 2)
+        self.client.delete("/health")
+        self.assertEqual(self.client.get("/health/summary?patient_id=delete-p1").get_json()
+                         ["all_time"]["heart_rate"]["count"], 1)
+
+
+
+class TestIngestLog(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        session_factory.remove()
+        Base.metadata.drop_all(engine)
+
+    def reading(self, heart_rate):
+        return {"patient_id": "log-p1", "heart_rate": heart_rate, "blood_pressure": "120/80",
+                "temperature": 37.0, "timestamp": datetime(2024, 1, 1, 12, 0, heart_rate % 60)}
+
+    def heart_rates(self):
+        return sorted(row.heart_rate for row in session_factory().query(HealthData).all())
+
+    def test_appended_readings_are_group_committed(self):
+        applied = []
+        log = IngestLog(self.directory, on_applied=applied.extend, group_commit_rows=3)
+        self.assertEqual(log.append([self.reading(60), self.reading(61)]), 2)
+        self.assertEqual(log.append([self.reading(62)]), 3)
+        log.close()
+        self.assertEqual(self.heart_rates(), [60, 61, 62])
+        self.assertEqual(len(applied), 3)
+        self.assertEqual(session_factory().get(IngestCheckpoint, "ingest_log").sequence, 3)
+
+    def test_recovery_replays_entries_past_checkpoint(self):
+        log = IngestLog(self.directory)
+        log.append([self.reading(60)])
+        log.close()
+        # Simulate a crash after the second reading was logged but before it was applied
+        with open(os.path.join(self.directory, "ingest-00000000000000000002.log"), "wb") as f:
+            f.write(b'{"sequence": 1, "row": {}}\n')
+            f.write(b'{"sequence": 2, "row": {"patient_id": "log-p1", "heart_rate": 61, '
+                    b'"blood_pressure": "120/80", "temperature": 37.0, "timestamp": "2024-01-01T12:00:01"}}\n')
+            f.write(b'{"sequence": 3, "row": {"patie')
+        log = IngestLog(self.directory)
+        self.assertEqual(self.heart_rates(), [60, 61])
+        self.assertEqual(log.append([self.reading(62)]), 3)
+        log.close()
+        self.assertEqual(self.heart_rates(), [60, 61, 62])
+
+    def test_malformed_rows_are_rejected_before_logging(self):
+        log = IngestLog(self.directory)
+        with self.assertRaises(ValueError):
+            log.append([self.reading(60), dict(self.reading(61), patient_id={"id": 1})])
+        self.assertEqual(log.append([self.reading(62)]), 1)
+        log.close()
+        self.assertEqual(self.heart_rates(), [62])
+
+    def test_rejected_rows_are_dead_lettered(self):
+        log = IngestLog(self.directory)
+        log.close()
+        # Entries the database rejects, e.g. logged by an older version, must not block the rest
+        with open(os.path.join(self.directory, "ingest-00000000000000000001.log"), "wb") as f:
+            f.write(b'{"sequence": 1, "row": {"patient_id": "log-p1", "heart_rate": 60, '
+                    b'"blood_pressure": "120/80", "temperature": 37.0, "timestamp": "2024-01-01T12:00:00"}}\n')
+            f.write(b'{"sequence": 2, "row": {"patient_id": {"id": 1}, "heart_rate": 61, '
+                    b'"blood_pressure": "120/80", "temperature": 37.0, "timestamp": "2024-01-01T12:00:01"}}\n')
+            f.write(b'{"sequence": 3, "row": {"patient_id": "log-p1", "heart_rate": 62, '
+                    b'"blood_pressure": "120/80", "temperature": 37.0, "timestamp": "not a time"}}\n')
+            f.write(b'{"sequence": 4, "row": {"patient_id": "log-p1", "heart_rate": 63, '
+                    b'"blood_pressure": "120/80", "temperature": 37.0, "timestamp": "2024-01-01T12:00:03"}}\n')
+        log = IngestLog(self.directory)
+        self.assertEqual(self.heart_rates(), [60, 63])
+        self.assertEqual(log.stats()["dead_letters"], 2)
+        with open(os.path.join(self.directory, "dead-letter.jsonl")) as f:
+            self.assertEqual([json.loads(line)["sequence"] for line in f], [2, 3])
+
+        # A group commit the database rejects is applied row by row
+        with self.assertLogs("ingest_log", level="ERROR"):
+            log.apply_or_dead_letter([(5, self.reading(4)), (6, dict(self.reading(5), heart_rate=None))])
+        log.close()
+        self.assertEqual(self.heart_rates(), [4, 60, 63])
+        self.assertEqual(session_factory().get(IngestCheckpoint, "ingest_log").sequence, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+class TestGatewaySync(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        session_factory.remove()
+        Base.metadata.drop_all(engine)
+
+    def upload(self, sequences):
+        readings = [{"sequence": sequence, "patient_id": "sync-p1", "heart_rate": 60 + sequence,
+                     "blood_pressure": "120/80", "temperature": 37.0,
+                     "timestamp": f"2024-01-01T12:00:{sequence:02d}"} for sequence in sequences]
+        body = gzip.compress("\n".join(json.dumps(reading) for reading in readings).encode())
+        return self.client.post("/sync/gateways/camp-a/readings", data=body,
+                                headers={"Content-Encoding": "gzip", "Content-Type": "application/x-ndjson"})
+
+    def test_resent_readings_are_skipped(self):
+        response = self.upload([1, 2, 3])
+        self.assertEqual(response.get_json(), {"watermark": 3, "inserted": 3, "duplicates": 0, "deferred": 0,
+                                               "errors": []})
+        # Resume after an interrupted upload that was in fact committed
+        response = self.upload([2, 3, 4, 5])
+        self.assertEqual(response.get_json()["watermark"], 5)
+        self.assertEqual(response.get_json()["duplicates"], 2)
+        self.assertEqual(session_factory().query(HealthData).count(), 5)
+        self.assertEqual(self.client.get("/sync/gateways/camp-a").get_json()["watermark"], 5)
+
+    def test_gap_is_rejected_with_watermark(self):
+        self.upload([1, 2])
+        response = self.upload([4, 5])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.get_json()["watermark"], 2)
+        self.assertEqual(self.upload([2, 1]).status_code, 400)
+        self.assertEqual(self.upload([1, 2, 5]).status_code, 409)
+
+    def test_gap_inside_chunk_commits_contiguous_prefix(self):
+        response = self.upload([1, 2, 5, 6])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["watermark"], 2)
+        self.assertEqual(response.get_json()["deferred"], 2)
+        self.assertEqual(session_factory().query(HealthData).count(), 2)
+
+        # The gateway re-sends from the watermark, and the missing readings are not lost
+        response = self.upload([3, 4, 5, 6])
+        self.assertEqual(response.get_json()["watermark"], 6)
+        self.assertEqual(session_factory().query(HealthData).count(), 6)
+
+    def test_care_plans_since_version(self):
+        self.client.put("/care-plans/sync-p1", json={"medication": "paracetamol"})
+        self.client.put("/care-plans/sync-p2", json={"medication": "ors"})
+        self.client.put("/care-plans/sync-p1", json={"medication": "ibuprofen"})
+        page = self.client.get("/sync/care-plans?since=0&limit=1").get_json()
+        self.assertEqual([plan["patient_id"] for plan in page["care_plans"]], ["sync-p2"])
+        self.assertTrue(page["has_more"])
+        page = self.client.get(f"/sync/care-plans?since={page['version']}").get_json()
+        self.assertEqual(page["care_plans"][0]["plan"], {"medication": "ibuprofen"})
+        self.assertEqual(page["version"], 3)
+        self.assertFalse(page["has_more"])
+
+
+@unittest.skipIf(pa is None, "pyarrow is not installed")
+class TestColumnarExport(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.client = app.test_client()
+        self.client.post("/health/batch", json=[
+            {"patient_id": patient_id, "heart_rate": 60 + i, "blood_pressure": "120/80", "temperature": 37.0,
+             "timestamp": f"2024-01-01T12:00:{i:02d}"}
+            for i in range(10) for patient_id in ("export-p1", "export-p2")
+        ])
+
+    def tearDown(self):
+        session_factory.remove()
+        Base.metadata.drop_all(engine)
+
+    def test_parquet_export_filters_patients_and_range(self):
+        import pyarrow.parquet as pq
+
+        response = self.client.get("/health/export?format=parquet&patient_id=export-p1"
+                                   "&start=2024-01-01T12:00:02&end=2024-01-01T12:00:05")
+        self.assertEqual(response.status_code, 200)
+        table = pq.read_table(io.BytesIO(response.data))
+        self.assertEqual(table.column_names, ["patient_id", "heart_rate", "blood_pressure", "temperature", "timestamp"])
+        self.assertEqual(table.column("heart_rate").to_pylist(), [62.0, 63.0, 64.0])
+        self.assertEqual(set(table.column("patient_id").to_pylist()), {"export-p1"})
+
+    def test_arrow_stream_export_in_batches(self):
+        import export
+
+        batches = list(export.record_batches(export.export_query(), batch_rows=3))
+        self.assertEqual([batch.num_rows for batch in batches], [3, 3, 3, 3, 3, 3, 2])
+        response = self.client.get("/health/export?format=arrow")
+        table = pa.ipc.open_stream(response.data).read_all()
+        self.assertEqual(table.num_rows, 20)
+        self.assertEqual(self.client.get("/health/export?format=csv").status_code, 400)
+
+
+class TestValidation(unittest.TestCase):
+    def validate(self, *readings):
+        received_at = datetime(2024, 1, 1)
+        return list(validate_health_data_batch(enumerate(readings), received_at, block_size=2))
+
+    def test_normalizes_blood_pressure_and_temperature(self):
+        results = self.validate(
+            {"heart_rate": "72", "blood_pressure": " 120 / 80 ", "temperature": 98.6},
+            {"heart_rate": 80, "blood_pressure": 130, "temperature": 37.2},
+            {"heart_rate": 90, "blood_pressure": "125/85", "temperature": 38, "temperature_unit": "c"},
+        )
+        rows = [row for index, row, error in results]
+        self.assertEqual([(row["heart_rate"], row["blood_pressure"], row["temperature"]) for row in rows],
+                         [(72.0, "120/80", 37.0), (80.0, "130", 37.2), (90.0, "125/85", 38.0)])
+
+    def test_rejects_impossible_values_in_order(self):
+        results = self.validate(
+            {"heart_rate": 72, "blood_pressure": "120/80", "temperature": 37},
+            {"heart_rate": 500, "blood_pressure": "120/80", "temperature": 37},
+            {"heart_rate": 72, "blood_pressure": "80/120", "temperature": 37},
+            {"heart_rate": 72, "blood_pressure": "high", "temperature": 37},
+            {"heart_rate": 72, "blood_pressure": "120/80", "temperature": 37, "temperature_unit": "K"},
+            {"heart_rate": 72, "blood_pressure": "120/80", "temperature": 20},
+            {"heart_rate": 72},
+        )
+        self.assertEqual([index for index, row, error in results], list(range(7)))
+        self.assertEqual([error for index, row, error in results],
+                         [None, "Invalid heart_rate", "Invalid blood_pressure", "Invalid blood_pressure",
+                          "Invalid temperature_unit", "Invalid temperature", "Invalid request data"])
+
+    def test_rejects_malformed_patient_id(self):
+        vitals = {"heart_rate": 72, "blood_pressure": "120/80", "temperature": 37}
+        results = self.validate(dict(vitals, patient_id="p1"), dict(vitals, patient_id=["p1"]),
+                                dict(vitals, patient_id={"id": 1}), dict(vitals, patient_id="p" * 65))
+        self.assertEqual([error for index, row, error in results],
+                         [None, "Invalid patient_id", "Invalid patient_id", "Invalid patient_id"])
+
@@ -0,0 +1,146 @@
+import queue
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from func.health_monitoring_system import (StreamingVitalsMonitor, detect_abnormalities,
+                                           detect_abnormalities_batch, start_vitals_monitor)
+from func.vital_rules import DEFAULT_RULES, VITAL_RULES, RuleSet
+
+
+class TestStreamingVitalsMonitor(unittest.TestCase):
+    def test_alerts_on_transitions_only(self):
+        alerts = []
+        monitor = StreamingVitalsMonitor(alerts.append)
+        monitor.consume([
+            {"patient_id": "p1", "heart_rate": 80, "blood_pressure": "120/80", "temperature": 37.0},
+            {"patient_id": "p1", "heart_rate": 120},
+            {"patient_id": "p1", "heart_rate": 125},
+            {"patient_id": "p2", "heart_rate": 70, "temperature": 102.2},
+            {"patient_id": "p1", "heart_rate": 90},
+            {"heart_rate": 90},
+        ])
+        self.assertEqual([(alert["patient_id"], alert["type"], alert["status"]) for alert in alerts], [
+            ("p1", "Heart Rate", "Abnormal"),
+            ("p2", "Temperature", "Abnormal"),
+            ("p1", "Heart Rate", "Normal"),
+        ])
+        state = monitor.patients["p1"]
+        self.assertAlmostEqual(state.means["heart_rate"], 103.75)
+        # 37 degrees Celsius is monitored as 98.6 degrees Fahrenheit
+        self.assertAlmostEqual(state.latest["temperature"], 98.6)
+        self.assertEqual(monitor.stats(), {"patients": 2, "readings": 5, "alerts": 3, "rejected": 1})
+
+    def test_rejects_a_single_reading_dict(self):
+        monitor = StreamingVitalsMonitor(lambda alert: None)
+        with self.assertRaises(TypeError):
+            monitor.consume({"patient_id": "p1", "heart_rate": 120})
+        self.assertEqual(monitor.stats(), {"patients": 0})
+
+    def test_alert_callback_errors_are_logged_not_rejected(self):
+        def on_alert(alert):
+            raise KeyError("pager")
+
+        monitor = StreamingVitalsMonitor(on_alert)
+        with self.assertLogs("func.health_monitoring_system", level="ERROR"):
+            monitor.consume([{"patient_id": "p1", "heart_rate": 120}, {"patient_id": "p2", "heart_rate": 130}])
+        self.assertEqual(monitor.stats(), {"patients": 2, "readings": 2, "alerts": 2, "alert_errors": 2})
+
+    def test_many_patients_from_queue(self):
+        alerts = []
+        readings = queue.Queue()
+        monitor, thread = start_vitals_monitor(readings, alerts.append)
+        for i in range(20000):
+            readings.put({"patient_id": i, "heart_rate": 150 if i % 100 == 0 else 75, "temperature": 98.6})
+        readings.put(None)
+        thread.join(30)
+        self.assertEqual(len(monitor.patients), 20000)
+        self.assertEqual(len(alerts), 200)
+        self.assertLess(max(alert["latency_ms"] for alert in alerts), 50)
+
+        monitor.patients[0].last_seen = time.monotonic() - 3600
+        self.assertEqual(monitor.evict_idle(600), 1)
+
+
+class TestBatchAbnormalityDetection(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        rows = 5000
+        self.readings = pd.DataFrame({
+            "patient_id": rng.integers(0, 300, rows),
+            "heart_rate": rng.normal(80, 9, rows),
+            "blood_pressure": rng.normal(118, 8, rows),
+            "temperature": rng.normal(98.4, 0.6, rows),
+        })
+
+    def test_matches_per_patient_detection(self):
+        # "120/80" strings, as the backend stores them; all strings, so pandas 3 infers a str dtype
+        readings = self.readings.assign(blood_pressure=[f"{value:.0f}/80" for value in self.readings["blood_pressure"]])
+        readings.loc[0, "blood_pressure"] = "190/120"
+        table = detect_abnormalities_batch(readings)
+        crisis = table[(table["patient_id"] == readings.loc[0, "patient_id"]) & (table["type"] == "Blood Pressure")]
+        self.assertEqual(crisis["max"].tolist(), [190.0])
+        expected = []
+        for patient_id, frame in readings.groupby("patient_id"):
+            expected.extend((patient_id, abnormality["type"], abnormality["value"])
+                            for abnormality in detect_abnormalities(frame))
+        actual = list(zip(table["patient_id"], table["type"], table["value"]))
+        self.assertEqual([row[:2] for row in actual], [row[:2] for row in expected])
+        np.testing.assert_allclose([row[2] for row in actual], [row[2] for row in expected])
+
+    def test_per_patient_thresholds(self):
+        readings = pd.DataFrame({"patient_id": ["a", "a", "b"], "heart_rate": [55, 58, 55],
+                                 "blood_pressure": ["120/80", "118/76", None]})
+        thresholds = pd.DataFrame({"heart_rate_low": [50.0]}, index=["a"])
+        table = detect_abnormalities_batch(readings, thresholds=thresholds)
+        self.assertEqual(table[["patient_id", "type"]].values.tolist(), [["b", "Heart Rate"]])
+        self.assertEqual(table["min"].tolist(), [55.0])
+        self.assertTrue(detect_abnormalities_batch(readings.iloc[:0]).empty)
+
+
+class TestVitalRules(unittest.TestCase):
+    def test_populations_and_tiers(self):
+        self.assertEqual(VITAL_RULES.evaluate_one({"heart_rate": 105})["heart_rate"]["name"], "heart_rate_high")
+        self.assertEqual(VITAL_RULES.evaluate_one({"heart_rate": 105, "pregnant": True}), {})
+        self.assertEqual(VITAL_RULES.evaluate_one({"heart_rate": 105, "age": 6}), {})
+        self.assertEqual(VITAL_RULES.evaluate_one({"heart_rate": 90, "age": 0.5})["heart_rate"]["name"],
+                         "heart_rate_low_infant")
+        fired = VITAL_RULES.evaluate_one({"blood_pressure": "165/100", "temperature": 39.6, "pregnant": True})
+        self.assertEqual({vital: rule["severity"] for vital, rule in fired.items()},
+                         {"blood_pressure": "critical", "temperature": "critical"})
+
+    def test_batch_matches_single_readings(self):
+        rng = np.random.default_rng(0)
+        rows = 3000
+        readings = pd.DataFrame({
+            "heart_rate": rng.normal(95, 30, rows),
+            "blood_pressure": rng.normal(125, 30, rows),
+            "temperature": rng.normal(99, 2, rows),
+            "age": rng.choice([0.5, 5, 30, np.nan], rows),
+            "pregnant": rng.random(rows) < 0.1,
+        })
+        # Half the batch with "120/80" string blood pressures, in a column of its own dtype
+        strings = readings.iloc[rows // 2:].assign(
+            blood_pressure=[f"{value:.0f}/80" for value in readings["blood_pressure"].iloc[rows // 2:]])
+        strings.iloc[0, strings.columns.get_loc("blood_pressure")] = "190/120"
+        self.assertTrue(VITAL_RULES.evaluate(strings)["rule"].eq("blood_pressure_very_high").any())
+        readings = pd.concat([readings.iloc[:rows // 2], strings], ignore_index=True)
+        fired = VITAL_RULES.evaluate(readings)
+        expected = [(row, rule["name"]) for row, reading in enumerate(readings.to_dict("records"))
+                    for rule in VITAL_RULES.evaluate_one(reading).values()]
+        self.assertEqual(sorted(zip(fired["row"], fired["rule"])), sorted(expected))
+
+    def test_rule_validation(self):
+        with self.assertRaises(ValueError):
+            RuleSet([{"name": "bad", "vital": "heart_rate", "above": 100, "below": 60}])
+        with self.assertRaises(ValueError):
+            RuleSet([{"name": "bad", "vital": "heart_rate", "above": 100, "populations": ["elderly"]}])
+
+    def test_monitor_escalates_between_tiers(self):
+        alerts = []
+        monitor = StreamingVitalsMonitor(alerts.append, RuleSet(DEFAULT_RULES))
+        monitor.consume([{"patient_id": 1, "heart_rate": hr} for hr in (110, 120, 160, 90)])
+        self.assertEqual([(alert["rule"], alert["status"]) for alert in alerts], [
+            ("heart_rate_high", "Abnormal"), ("heart_rate_very_high", "Abnormal"), ("heart_rate_very_high", "Normal")])
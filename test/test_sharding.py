@@ -0,0 +1,123 @@
+import http.client
+import json
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault("HEALTHGUARD_DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+
+from app import app
+from database import Base, engine, session_factory
+from sharding import HttpShardClient, create_router, shard_for
+
+
+class RecordingShard:
+    """
+    A shard client backed by the in-process app that records the requests it receives.
+    """
+
+    def __init__(self):
+        self.client = app.test_client()
+        self.requests = []
+
+    def request(self, method, path, body=None, headers=None, stream=False):
+        self.requests.append((method, path, body))
+        response = self.client.open(path, method=method, data=body, headers=headers)
+        return response.status_code, list(response.headers.items()), response.get_data()
+
+
+class FailingShard:
+    """
+    A shard answering every request with an HTML error page.
+    """
+
+    def request(self, method, path, body=None, headers=None, stream=False):
+        return 500, [("Content-Type", "text/html")], b"<html>Internal Server Error</html>"
+
+
+class DroppedConnection:
+    """
+    A connection that accepts requests but drops before responding.
+    """
+
+    def __init__(self):
+        self.requests = 0
+
+    def request(self, method, path, body=None, headers=None):
+        self.requests += 1
+
+    def getresponse(self):
+        raise http.client.RemoteDisconnected("Remote end closed connection without response")
+
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(engine)
+        self.shards = [RecordingShard() for _ in range(4)]
+        self.router = create_router(self.shards).test_client()
+
+    def tearDown(self):
+        session_factory.remove()
+        Base.metadata.drop_all(engine)
+
+    def test_shard_for_is_stable_and_spread(self):
+        self.assertEqual(shard_for("patient-1", 4), shard_for("patient-1", 4))
+        owners = {shard_for(f"patient-{i}", 4) for i in range(100)}
+        self.assertEqual(owners, {0, 1, 2, 3})
+
+    def test_post_goes_to_owning_shard(self):
+        reading = {"patient_id": "patient-7", "heart_rate": 80, "blood_pressure": "120/80", "temperature": 37.0}
+        response = self.router.post("/health", json=reading)
+        self.assertEqual(response.status_code, 201)
+        owner = shard_for("patient-7", 4)
+        self.assertEqual([len(shard.requests) for shard in self.shards].count(1), 1)
+        self.assertEqual(self.shards[owner].requests[0][:2], ("POST", "/health"))
+
+        response = self.router.get("/health/history?patient_id=patient-7")
+        self.assertEqual(len(response.get_json()["data"]), 1)
+        self.assertEqual(self.shards[owner].requests[-1][1], "/health/history?patient_id=patient-7")
+
+    def test_batch_is_split_and_errors_keep_original_indexes(self):
+        readings = [{"patient_id": f"patient-{i}", "heart_rate": 70, "blood_pressure": "120/80",
+                     "temperature": 37.0} for i in range(20)]
+        readings[13] = {"patient_id": "patient-13"}
+        response = self.router.post("/health/batch", json=readings)
+        self.assertEqual(response.status_code, 201)
+        result = response.get_json()
+        self.assertEqual(result["inserted"], 19)
+        self.assertEqual(result["errors"], [{"index": 13, "error": "Invalid request data"}])
+
+        # Every shard only received its own patients
+        for number, shard in enumerate(self.shards):
+            for method, path, body in shard.requests:
+                for item in json.loads(body):
+                    self.assertEqual(shard_for(item["patient_id"], 4), number)
+
+    def test_batch_reports_failed_shard(self):
+        self.shards[1] = FailingShard()
+        self.router = create_router(self.shards).test_client()
+        readings = [{"patient_id": f"patient-{i}", "heart_rate": 70, "blood_pressure": "120/80",
+                     "temperature": 37.0} for i in range(20)]
+        response = self.router.post("/health/batch", json=readings)
+        self.assertEqual(response.status_code, 201)
+        result = response.get_json()
+        failed = [i for i in range(20) if shard_for(f"patient-{i}", 4) == 1]
+        self.assertEqual(result["inserted"], 20 - len(failed))
+        self.assertEqual([error["index"] for error in result["errors"]], failed)
+        self.assertEqual(result["shards"]["1"], 500)
+
+    def test_non_idempotent_requests_are_not_retried(self):
+        client = HttpShardClient("http://127.0.0.1:1")
+        dropped = client.local.connection = DroppedConnection()
+        with self.assertRaises(http.client.RemoteDisconnected):
+            client.request("POST", "/health", body=b"{}")
+        self.assertEqual(dropped.requests, 1)
+
+    def test_sync_is_rejected(self):
+        self.assertEqual(self.router.post("/sync/gateways/g1/readings", data=b"[]").status_code, 501)
+        self.assertEqual(self.router.put("/care-plans/patient-1", json={}).status_code, 501)
+        self.assertTrue(all(not shard.requests for shard in self.shards))
+
+
+if __name__ == "__main__":
+    unittest.main()